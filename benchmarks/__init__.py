@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for kleides-mfa using the test project in ``tests``.
+
+Run a benchmark as a module from the repository root, for example::
+
+    python -m benchmarks.auth_request
+    python -m benchmarks.hot_paths --output results.json
+    python -m benchmarks.load_test --users 100 --concurrency 1 4 16
+    python -m benchmarks.startup -n 10
+'''
+import os
+import timeit
+import tracemalloc
+
+import django
+
+
+def setup(database=None):
+    '''
+    Setup Django with the test project and create the test database in
+    memory or in the ``database`` file. Returns the configuration for
+    ``teardown_databases``.
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.test.utils import (
+        setup_databases, setup_test_environment)
+
+    if database is not None:
+        settings_dict = settings.DATABASES['default']
+        settings_dict.setdefault('TEST', {})['NAME'] = database
+        options = settings_dict.setdefault('OPTIONS', {})
+        # Wait for the write lock of concurrent connections.
+        options['timeout'] = 30
+        if django.VERSION >= (5, 1):
+            options['transaction_mode'] = 'IMMEDIATE'
+            options['init_command'] = 'PRAGMA journal_mode=WAL;'
+    setup_test_environment()
+    return setup_databases(verbosity=0, interactive=False)
+
+
+def measure(func, number, repeat=3):
+    '''
+    Return the wall time in microseconds, the queries and the peak of the
+    allocated bytes of a single call of func.
+    '''
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    # Warm up and count the queries of a single call.
+    func()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    query_count = len(queries)
+
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timeit.repeat(func, number=number, repeat=repeat))
+    return {
+        'wall_us': round(seconds / number * 1e6, 1),
+        'queries': query_count,
+        'alloc_peak_bytes': peak,
+    }
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+'''
+Measure the per call cost of the auth_request endpoint through the full
+middleware stack of the test project.
+'''
+import argparse
+import logging
+
+from . import measure, setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--number', type=int, default=1000,
+        help='calls per measurement (default: %(default)s)')
+    args = parser.parse_args()
+
+    setup()
+    # Denied requests are logged as warnings by django.request.
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    from django.test import Client
+    from django.test.utils import override_settings
+    from django.utils import timezone
+    from django_otp import DEVICE_ID_SESSION_KEY
+
+    from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+    from tests.factories import UserFactory
+
+    anonymous = Client()
+    single_factor = Client()
+    verified = Client()
+    user = UserFactory()
+    single_factor.force_login(user)
+    device = user.totpdevice_set.create(name='benchmark')
+    verified.force_login(user)
+    session = verified.session
+    session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+    session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+    session.save()
+
+    cases = [
+        ('anonymous', anonymous, 'verified', 0),
+        ('single factor', single_factor, 'single-factor', 0),
+        ('verified', verified, 'verified', 0),
+        ('recently verified', verified, 'recently-verified', 0),
+        ('verified (cached)', verified, 'verified', 60),
+    ]
+    print('{:<20} {:>8} {:>12}'.format('case', 'queries', 'us/call'))
+    for name, client, level, timeout in cases:
+        url = '/auth-request/{}/'.format(level)
+        with override_settings(
+                KLEIDES_MFA_AUTH_REQUEST_CACHE_TIMEOUT=timeout):
+            result = measure(lambda: client.get(url), args.number)
+        print('{:<20} {:>8} {:>12.1f}'.format(
+            name, result['queries'], result['wall_us']))
+
+
+if __name__ == '__main__':
+    main()
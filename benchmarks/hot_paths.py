@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+'''
+Measure the MFA request hot paths over N plugins and M devices per plugin.
+
+The registered plugins are replaced by benchmark plugins of the TOTP device
+model with a verify form that accepts any token, so the results measure
+kleides-mfa and not the token algorithms. Save the results as JSON with
+--output and compare them with the results of another release with
+--compare.
+'''
+import argparse
+import itertools
+import json
+import platform
+
+from . import measure, setup
+
+PATHS = ('middleware', 'is_recently_verified', 'user_has_device', 'login')
+
+
+def register_plugins(plugin_count):
+    '''
+    Replace the registered plugins with benchmark plugins and return their
+    slugs. The plugin priority selects the plugins of a scenario.
+    '''
+    from django_otp.plugins.otp_totp.models import TOTPDevice
+
+    from kleides_mfa.forms import DeviceVerifyForm
+    from kleides_mfa.registry import registry
+
+    class BenchmarkVerifyForm(DeviceVerifyForm):
+        def verify_token(self, token):
+            return True
+
+    for plugin in list(registry.plugins()):
+        registry.unregister(plugin.slug)
+    for index in range(plugin_count):
+        registry.register(
+            'Benchmark {}'.format(index), TOTPDevice,
+            verify_form_class=BenchmarkVerifyForm)
+    return tuple('benchmark-{}'.format(i) for i in range(plugin_count))
+
+
+def create_user(device_count):
+    '''
+    Return a user with TOTP devices.
+    '''
+    from django_otp.plugins.otp_totp.models import TOTPDevice
+
+    from tests.factories import UserFactory
+
+    user = UserFactory()
+    TOTPDevice.objects.bulk_create(
+        TOTPDevice(user=user, name='Device {}'.format(index))
+        for index in range(device_count))
+    return user
+
+
+def benchmark_paths(user, number):
+    from django.contrib.auth.middleware import AuthenticationMiddleware
+    from django.contrib.sessions.middleware import SessionMiddleware
+    from django.http import HttpResponse
+    from django.test import Client, RequestFactory
+    from django.utils import timezone
+    from django_otp import DEVICE_ID_SESSION_KEY
+
+    from kleides_mfa.middleware import KleidesAuthenticationMiddleware
+    from kleides_mfa.registry import registry
+    from kleides_mfa.views.mixins import (
+        VERIFIED_SESSION_KEY, is_recently_verified)
+
+    device = user.totpdevice_set.first()
+    client = Client()
+    client.force_login(user)
+    session = client.session
+    session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+    session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+    session.save()
+    factory = RequestFactory()
+    factory.cookies = client.cookies
+
+    def middleware_chain(view):
+        # The middleware of the test project that resolve the user.
+        chain = SessionMiddleware(AuthenticationMiddleware(
+            KleidesAuthenticationMiddleware(view)))
+        return lambda: chain(factory.get('/'))
+
+    def verified_view(request):
+        assert request.user.is_verified
+        return HttpResponse()
+
+    def recently_verified_view(request):
+        assert is_recently_verified(request)
+        return HttpResponse()
+
+    login_client = Client()
+    plugin = next(registry.plugins())
+    verify_url = '/{}/verify/{}/'.format(plugin.slug, device.pk)
+
+    def login():
+        login_client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        response = login_client.post(verify_url, {'otp_token': '123456'})
+        assert response.status_code == 302, response.status_code
+        login_client.logout()
+
+    return {
+        'middleware': measure(middleware_chain(verified_view), number),
+        'is_recently_verified': measure(
+            middleware_chain(recently_verified_view), number),
+        'user_has_device': measure(
+            lambda: registry.user_has_device(user), number),
+        'login': measure(login, max(1, number // 10)),
+    }
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {
+            (result['path'], result['plugins'], result['devices']): result
+            for result in json.load(f)['results']}
+    print()
+    print('Change compared to {}'.format(baseline_file))
+    for result in results:
+        key = (result['path'], result['plugins'], result['devices'])
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        print('{:<22} {:>4} {:>4} {:>+8.1f}% {:>+5} {:>+9.1f}%'.format(
+            *key,
+            (result['wall_us'] / old['wall_us'] - 1) * 100,
+            result['queries'] - old['queries'],
+            (result['alloc_peak_bytes'] / max(old['alloc_peak_bytes'], 1)
+             - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--number', type=int, default=200,
+        help='calls per measurement (default: %(default)s)')
+    parser.add_argument(
+        '--plugins', type=int, nargs='+', default=[1, 4, 16],
+        help='plugin counts (default: %(default)s)')
+    parser.add_argument(
+        '--devices', type=int, nargs='+', default=[1, 10, 100],
+        help='device counts per user (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    args = parser.parse_args()
+
+    setup()
+
+    import django
+    from django.test.utils import override_settings
+
+    import kleides_mfa
+
+    # Measure kleides-mfa instead of the password hasher.
+    override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher']).enable()
+    slugs = register_plugins(max(args.plugins))
+
+    results = []
+    print('{:<22} {:>4} {:>4} {:>10} {:>7} {:>10}'.format(
+        'path', 'N', 'M', 'us/call', 'queries', 'peak KiB'))
+    for plugin_count, device_count in itertools.product(
+            args.plugins, args.devices):
+        user = create_user(device_count)
+        with override_settings(
+                KLEIDES_MFA_PLUGIN_PRIORITY=slugs[:plugin_count]):
+            paths = benchmark_paths(user, args.number)
+        for path in PATHS:
+            result = dict(
+                paths[path], path=path, plugins=plugin_count,
+                devices=device_count)
+            results.append(result)
+            print('{:<22} {:>4} {:>4} {:>10.1f} {:>7} {:>10.1f}'.format(
+                path, plugin_count, device_count, result['wall_us'],
+                result['queries'], result['alloc_peak_bytes'] / 1024))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'kleides_mfa': kleides_mfa.__version__,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'number': args.number,
+                'results': results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
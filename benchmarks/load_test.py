@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+'''
+Load test the password login and device verification flow.
+
+The test project is served by a threaded WSGI server with a file-backed
+SQLite database. For every concurrency level users are seeded with a TOTP
+device, recovery codes or a Yubikey that is verified by a fake validation
+server. Every user logs in once with the login form and the verify form of
+its device. The throughput, the latency percentiles and the queries of
+every stage are reported to find the saturation point of the MFA flow.
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import platform
+import secrets
+import statistics
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from . import setup
+
+DEVICE_TYPES = ('totp', 'recovery-code', 'yubikey')
+STAGES = ('login_form', 'login', 'verify_form', 'verify')
+QUERIES_HEADER = 'X-Load-Test-Queries'
+MODHEX = 'cbdefghijklnrtuv'
+YUBIKEY_PUBLIC_ID = 'cccccccccccb'
+STATIC_TOKEN = 'loadtest'
+
+
+class FlowError(Exception):
+    pass
+
+
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Accept every token like a Yubikey validation server without api key.
+    '''
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        body = 'otp={}\r\nnonce={}\r\nstatus=OK\r\n'.format(
+            params['otp'][0], params['nonce'][0]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_address
+
+
+def query_counting_app(app):
+    '''
+    Add the number of queries of the request as a response header.
+    '''
+    from kleides_mfa.query_budget import count_queries
+
+    def wrapper(environ, start_response):
+        with count_queries() as queries:
+            def counting_start_response(status, headers, exc_info=None):
+                headers.append((QUERIES_HEADER, str(len(queries))))
+                return start_response(status, headers, exc_info)
+            return app(environ, counting_start_response)
+    return wrapper
+
+
+def start_servers():
+    '''
+    Start the fake validation server and the test project server.
+    Returns the address of the test project server.
+    '''
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.servers.basehttp import (
+        ThreadedWSGIServer, WSGIRequestHandler)
+    from otp_yubikey.models import ValidationService
+
+    class QuietWSGIRequestHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class LoadTestServer(ThreadedWSGIServer):
+        request_queue_size = 1024
+
+    host, port = serve(ThreadingHTTPServer(
+        ('127.0.0.1', 0), ValidationRequestHandler))
+    ValidationService.objects.create(
+        name='Load test', api_key='', use_ssl=False, param_sl='',
+        param_timeout='',
+        base_url='http://{}:{}/wsapi/2.0/verify'.format(host, port))
+
+    server = LoadTestServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+    server.set_app(query_counting_app(WSGIHandler()))
+    return serve(server)
+
+
+def seed_users(prefix, count, password):
+    '''
+    Return a list of (device type, username, token function) of new users.
+    '''
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django_otp.oath import TOTP
+    from django_otp.plugins.otp_static.models import StaticDevice, StaticToken
+    from django_otp.plugins.otp_totp.models import TOTPDevice
+    from otp_yubikey.models import RemoteYubikeyDevice, ValidationService
+
+    User = get_user_model()
+    # Hash the password once, the login hashes it for every user.
+    password_hash = make_password(password)
+    service = ValidationService.objects.get(name='Load test')
+    users = []
+
+    def totp_token(device):
+        totp = TOTP(
+            device.bin_key, device.step, device.t0, device.digits,
+            device.drift)
+        return lambda: '{:0{}d}'.format(totp.token(), device.digits)
+
+    def yubikey_token():
+        return YUBIKEY_PUBLIC_ID + ''.join(
+            secrets.choice(MODHEX) for i in range(32))
+
+    for device_type in DEVICE_TYPES:
+        usernames = [
+            '{}-{}-{}'.format(prefix, device_type, index)
+            for index in range(count)]
+        User.objects.bulk_create(
+            User(username=username, password=password_hash)
+            for username in usernames)
+        type_users = list(
+            User.objects.filter(username__in=usernames).order_by('pk'))
+        if device_type == 'totp':
+            devices = TOTPDevice.objects.bulk_create(
+                TOTPDevice(user=user, name='TOTP') for user in type_users)
+            tokens = [totp_token(device) for device in devices]
+        elif device_type == 'recovery-code':
+            StaticDevice.objects.bulk_create(
+                StaticDevice(user=user, name='Recovery codes')
+                for user in type_users)
+            StaticToken.objects.bulk_create(
+                StaticToken(device=device, token=STATIC_TOKEN)
+                for device in StaticDevice.objects.filter(
+                    user__in=type_users))
+            tokens = [lambda: STATIC_TOKEN] * count
+        else:
+            RemoteYubikeyDevice.objects.bulk_create(
+                RemoteYubikeyDevice(
+                    user=user, name='Yubikey', service=service,
+                    public_id=YUBIKEY_PUBLIC_ID)
+                for user in type_users)
+            tokens = [yubikey_token] * count
+        users.extend(
+            (device_type, user.username, token)
+            for user, token in zip(type_users, tokens))
+    return users
+
+
+class Browser():
+    '''
+    A client with cookies that does not follow redirects.
+    '''
+    def __init__(self, address):
+        self.address = address
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None):
+        headers = {'Cookie': '; '.join(
+            '{}={}'.format(name, morsel.value)
+            for name, morsel in self.cookies.items())}
+        body = None
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.cookies[
+                'csrftoken'].value)
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        connection = http.client.HTTPConnection(*self.address)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        seconds = time.perf_counter() - start
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        return response, seconds
+
+
+def login_flow(address, username, password, token):
+    '''
+    Login and verify the device. Returns the seconds and the queries of
+    every stage.
+    '''
+    browser = Browser(address)
+    stages = {}
+
+    def stage(name, method, path, data=None, status=200):
+        response, seconds = browser.request(method, path, data)
+        if response.status != status:
+            raise FlowError('{} returned {}'.format(name, response.status))
+        stages[name] = (seconds, int(response.getheader(QUERIES_HEADER, 0)))
+        return response
+
+    stage('login_form', 'GET', '/login/')
+    response = stage('login', 'POST', '/login/', {
+        'username': username, 'password': password}, status=302)
+    verify_path = response.getheader('Location')
+    stage('verify_form', 'GET', verify_path)
+    stage('verify', 'POST', verify_path, {'otp_token': token()}, status=302)
+    return stages
+
+
+def percentiles(values):
+    '''
+    Return the 50th, 95th and 99th percentile.
+    '''
+    if len(values) < 2:
+        return values * 3
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+def run(address, users, password, concurrency):
+    '''
+    Run the login flow of all users. Returns the result of the run.
+    '''
+    def flow(user):
+        device_type, username, token = user
+        try:
+            return device_type, login_flow(address, username, password, token)
+        except (FlowError, OSError) as e:
+            return device_type, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        flows = list(executor.map(flow, users))
+    seconds = time.perf_counter() - start
+
+    stages = []
+    for device_type in DEVICE_TYPES:
+        type_flows = [
+            result for flow_device_type, result in flows
+            if flow_device_type == device_type
+            and not isinstance(result, Exception)]
+        for name in STAGES + ('flow',):
+            if name == 'flow':
+                timings = [
+                    (sum(s for s, q in result.values()),
+                     sum(q for s, q in result.values()))
+                    for result in type_flows]
+            else:
+                timings = [result[name] for result in type_flows]
+            if not timings:
+                continue
+            p50, p95, p99 = percentiles([s * 1000 for s, q in timings])
+            stages.append({
+                'device': device_type, 'stage': name, 'p50_ms': p50,
+                'p95_ms': p95, 'p99_ms': p99,
+                'queries': max(q for s, q in timings)})
+    errors = [str(result) for d, result in flows if isinstance(
+        result, Exception)]
+    return {
+        'concurrency': concurrency,
+        'flows': len(flows),
+        'failed': len(errors),
+        'errors': sorted(set(errors)),
+        'seconds': seconds,
+        'flows_per_second': (len(flows) - len(errors)) / seconds,
+        'stages': stages,
+    }
+
+
+def report(result):
+    print()
+    print(
+        'concurrency {concurrency}: {flows} flows in {seconds:.2f}s, '
+        '{flows_per_second:.1f} flows/s, {failed} failed'.format(**result))
+    for error in result['errors']:
+        print('  error: {}'.format(error))
+    print('{:<14} {:<12} {:>9} {:>9} {:>9} {:>8}'.format(
+        'device', 'stage', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    for stage in result['stages']:
+        print(
+            '{device:<14} {stage:<12} {p50_ms:>9.1f} {p95_ms:>9.1f} '
+            '{p99_ms:>9.1f} {queries:>8}'.format(**stage))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--users', type=int, default=50,
+        help='users per device type and concurrency (default: %(default)s)')
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=[1, 4, 16],
+        help='concurrent login flows (default: %(default)s)')
+    parser.add_argument(
+        '--database',
+        help='the SQLite database file (default: a temporary file)')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database or os.path.join(directory, 'load_test.db')
+        old_config = setup(database)
+
+        import django
+        from django.test.utils import override_settings, teardown_databases
+
+        import kleides_mfa
+
+        # Measure without the query logging and checks of DEBUG.
+        override_settings(DEBUG=False).enable()
+        try:
+            address = start_servers()
+            password = secrets.token_urlsafe()
+            results = []
+            for concurrency in args.concurrency:
+                users = seed_users(
+                    'c{}'.format(concurrency), args.users, password)
+                results.append(run(address, users, password, concurrency))
+                report(results[-1])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'kleides_mfa': kleides_mfa.__version__,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'users': args.users,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+'''
+Measure the startup cost of kleides-mfa in new interpreters.
+
+Every run measures ``django.setup()`` of the test project and the first use
+of the forms and views, which are imported lazily, in a new interpreter.
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+RUN = '''
+import json, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter()
+from kleides_mfa.registry import registry
+registry.form_classes()
+import kleides_mfa.urls
+first_use = time.perf_counter()
+print(json.dumps({
+    'setup_ms': (setup - start) * 1000,
+    'first_use_ms': (first_use - setup) * 1000,
+}))
+'''
+
+
+def run():
+    result = subprocess.run(
+        [sys.executable, '-c', RUN],
+        env=dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings'),
+        capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--number', type=int, default=10,
+        help='interpreters to start (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    runs = [run() for i in range(args.number)]
+    results = {}
+    print('{:<14} {:>10} {:>10}'.format('stage', 'median ms', 'min ms'))
+    for stage in ('setup_ms', 'first_use_ms'):
+        values = [r[stage] for r in runs]
+        results[stage] = {
+            'median': statistics.median(values), 'min': min(values)}
+        print('{:<14} {:>10.1f} {:>10.1f}'.format(
+            stage[:-3], results[stage]['median'], results[stage]['min']))
+
+    if args.output:
+        import django
+
+        import kleides_mfa
+
+        with open(args.output, 'w') as f:
+            json.dump({
+                'kleides_mfa': kleides_mfa.__version__,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,32 @@
 # -*- coding: utf-8 -*-
+import copy
+from functools import partial
+
 from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.utils import flatten_fieldsets, unquote
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import FieldDoesNotExist, PermissionDenied
+from django.db import transaction
+from django.db.models import Count, Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponseNotAllowed, HttpResponseRedirect
 from django.shortcuts import resolve_url
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.translation import gettext, gettext_lazy as _
 
+from kleides_mfa.audit import audit_log
+from kleides_mfa.models import AuditLogEntry
+from kleides_mfa.registry import registry
+from kleides_mfa.signals import mfa_removed, mfa_updated
 from kleides_mfa.views.mixins import is_recently_verified
 
+RECENTLY_VERIFIED_ATTRIBUTE = '_kleides_mfa_recently_verified'
+RECOVERY_CODE_SLUG = 'recovery-code'
+
 
 class AdminSiteMfaRequiredMixin():
     """
@@ -24,7 +43,13 @@ class AdminSiteMfaRequiredMixin():
         """
         if not super().has_permission(request):
             return False
-        return is_recently_verified(request)
+        # The admin checks the permission several times per request, verify
+        # and refresh the verification time in the session once.
+        verified = getattr(request, RECENTLY_VERIFIED_ATTRIBUTE, None)
+        if verified is None:
+            verified = is_recently_verified(request)
+            setattr(request, RECENTLY_VERIFIED_ATTRIBUTE, verified)
+        return verified
 
     def login(self, request, extra_context=None):
         """
@@ -48,3 +73,156 @@ class AdminSiteMfaRequiredMixin():
 
 class KleidesMfaAdminSite(AdminSiteMfaRequiredMixin, admin.AdminSite):
     pass
+
+
+def _has_tokens(model):
+    try:
+        model._meta.get_field('token_set')
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+class UserMfaDevicesAdminMixin():
+    """
+    Mixin for the user admin that lists the devices of the user by plugin on
+    the change page, with actions to delete a device and to replace the
+    recovery codes.
+
+    The devices are fetched with a query per plugin and the number of
+    recovery codes is annotated. A device is deleted after a confirmation.
+    """
+    mfa_devices_template = 'kleides_mfa/admin/user_devices.html'
+    mfa_device_delete_template = (
+        'kleides_mfa/admin/delete_device_confirmation.html')
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is None:
+            return readonly_fields
+        return tuple(readonly_fields) + ('mfa_devices',)
+
+    def get_fieldsets(self, request, obj=None):
+        fieldsets = super().get_fieldsets(request, obj)
+        if obj is None or 'mfa_devices' in flatten_fieldsets(fieldsets):
+            return fieldsets
+        return list(fieldsets) + [
+            (_('Multi factor authentication'), {'fields': ('mfa_devices',)})]
+
+    def get_mfa_device_prefetches(self):
+        prefetches = []
+        for plugin in registry.plugins():
+            queryset = plugin.model.objects.order_by('pk')
+            if _has_tokens(plugin.model):
+                queryset = queryset.annotate(token_count=Count('token_set'))
+            accessor = plugin.model._meta.get_field(
+                'user').remote_field.get_accessor_name()
+            prefetches.append(Prefetch(accessor, queryset=queryset))
+        return prefetches
+
+    def _mfa_url(self, name, *args):
+        return reverse('admin:{}_{}_{}'.format(
+            self.opts.app_label, self.opts.model_name, name),
+            args=args, current_app=self.admin_site.name)
+
+    @admin.display(description=_('Devices'))
+    def mfa_devices(self, obj):
+        prefetches = self.get_mfa_device_prefetches()
+        prefetch_related_objects([obj], *prefetches)
+        plugins = []
+        for plugin, prefetch in zip(registry.plugins(), prefetches):
+            plugins.append({
+                'plugin': plugin,
+                'has_tokens': _has_tokens(plugin.model),
+                'devices': [
+                    (device, self._mfa_url(
+                        'mfa_device_delete', obj.pk, plugin.slug, device.pk))
+                    for device in getattr(obj, prefetch.prefetch_to).all()],
+            })
+        return render_to_string(self.mfa_devices_template, {
+            'plugins': plugins,
+            'recovery_code_slug': RECOVERY_CODE_SLUG,
+            'recovery_codes_url': self._mfa_url(
+                'mfa_recovery_codes', obj.pk),
+        })
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path(
+                '<path:object_id>/mfa-devices/<slug:slug>/<int:device_id>/'
+                'delete/',
+                self.admin_site.admin_view(self.mfa_device_delete_view),
+                name='{}_{}_mfa_device_delete'.format(*info)),
+            path(
+                '<path:object_id>/mfa-devices/recovery-codes/',
+                self.admin_site.admin_view(self.mfa_recovery_codes_view),
+                name='{}_{}_mfa_recovery_codes'.format(*info)),
+        ] + super().get_urls()
+
+    def get_mfa_user(self, request, object_id):
+        user = self.get_object(request, unquote(object_id))
+        if user is None:
+            raise Http404
+        if not self.has_change_permission(request, user):
+            raise PermissionDenied
+        return user
+
+    def get_mfa_plugin(self, slug):
+        try:
+            return registry.get_plugin(slug)
+        except KeyError:
+            raise Http404
+
+    def mfa_response(self, request, user, message):
+        self.log_change(request, user, message)
+        self.message_user(request, message)
+        return HttpResponseRedirect(self._mfa_url('change', user.pk))
+
+    def mfa_device_delete_view(self, request, object_id, slug, device_id):
+        user = self.get_mfa_user(request, object_id)
+        plugin = self.get_mfa_plugin(slug)
+        try:
+            device = plugin.get_user_device(device_id, user, confirmed=None)
+        except plugin.model.DoesNotExist:
+            raise Http404
+        if request.method != 'POST':
+            return TemplateResponse(request, self.mfa_device_delete_template, {
+                **self.admin_site.each_context(request),
+                'title': _('Are you sure?'),
+                'opts': self.opts,
+                'original': user,
+                'change_url': self._mfa_url('change', user.pk),
+                'plugin': plugin,
+                'device': device,
+            })
+        # The delete clears the pk of the device, the copy keeps the
+        # persistent id for the audit log and the receivers.
+        removed = copy.copy(device)
+        with transaction.atomic():
+            device.delete()
+            audit_log.record(
+                request, AuditLogEntry.REMOVED, plugin, removed, user)
+            transaction.on_commit(partial(
+                mfa_removed.send, sender=__name__, instance=removed,
+                request=request))
+        return self.mfa_response(request, user, gettext(
+            'Deleted the {plugin} "{name}".').format(
+                plugin=plugin.name, name=device.name))
+
+    def mfa_recovery_codes_view(self, request, object_id):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        user = self.get_mfa_user(request, object_id)
+        plugin = self.get_mfa_plugin(RECOVERY_CODE_SLUG)
+        devices = plugin.get_user_devices(user, confirmed=None)
+        if not devices:
+            raise Http404
+        with transaction.atomic():
+            plugin.get_update_form_class().replace_tokens(devices)
+            for device in devices:
+                transaction.on_commit(partial(
+                    mfa_updated.send, sender=__name__, instance=device,
+                    request=request))
+        return self.mfa_response(request, user, gettext(
+            'Replaced the recovery codes.'))
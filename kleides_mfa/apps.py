@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 from django.apps import AppConfig, apps
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.core.signals import request_finished, request_started
 from django.db import router
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -40,7 +42,7 @@ def create_yubikey_validationservice(app_config, using='default', **kwargs):
         return
 
     if (app_config.label == 'otp_yubikey'
-            and ValidationService.objects.using(using).all().count() == 0):
+            and not ValidationService.objects.using(using).exists()):
         ValidationService.objects.using(using).get_or_create(defaults={
             'name': 'YubiCloud', 'use_ssl': True,
             'param_sl': '', 'param_timeout': ''})
@@ -49,10 +51,24 @@ def create_yubikey_validationservice(app_config, using='default', **kwargs):
 class KleidesMfaConfig(AppConfig):
     name = 'kleides_mfa'
     verbose_name = 'Kleides Multi Factor Authentication'
+    default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
+        from .audit import audit_log, devices_removed as audit_devices_removed
+        from .cache import device_changed, devices_changed
         from .conf import app_settings
+        from .events import connect_signals
         from .registry import registry
+        from .routers import unpin
+        from .session_index import session_ended
+        from .signals import (
+            mfa_added, mfa_bulk_removed, mfa_bulk_updated, mfa_removed,
+            mfa_updated)
+        from .status import connect_signals as connect_status_signals
+        from .trusted_browsers import device_removed, devices_removed
+
+        app_settings.reload()
+        app_settings.warn_deprecated()
 
         # Monkey patch user authentication properties.
         User = get_user_model()
@@ -66,16 +82,49 @@ class KleidesMfaConfig(AppConfig):
         AnonymousUser.is_single_factor_authenticated = property(
             is_single_factor_authenticated)
 
+        # Invalidate the cached device lists.
+        for signal in (mfa_added, mfa_removed, mfa_updated):
+            signal.connect(
+                device_changed,
+                dispatch_uid='kleides_mfa.cache.device_changed')
+        for signal in (mfa_bulk_removed, mfa_bulk_updated):
+            signal.connect(
+                devices_changed,
+                dispatch_uid='kleides_mfa.cache.devices_changed')
+        mfa_removed.connect(
+            device_removed,
+            dispatch_uid='kleides_mfa.trusted_browsers.device_removed')
+        mfa_bulk_removed.connect(
+            devices_removed,
+            dispatch_uid='kleides_mfa.trusted_browsers.devices_removed')
+        # Dispatch the events of deferred receivers.
+        connect_signals()
+        # Write the audit log entries of the bulk device removals.
+        mfa_bulk_removed.connect(
+            audit_devices_removed,
+            dispatch_uid='kleides_mfa.audit.devices_removed')
+        # Write the buffered audit log entries after the response.
+        request_finished.connect(
+            audit_log.request_finished,
+            dispatch_uid='kleides_mfa.audit.audit_log')
+        # Route the device reads of every request to the replica again.
+        for signal in (request_started, request_finished):
+            signal.connect(unpin, dispatch_uid='kleides_mfa.routers.unpin')
+        # Remove the session index entries of a logout.
+        user_logged_out.connect(
+            session_ended, dispatch_uid='kleides_mfa.session_index')
+
         # Check if known devices are installed and register them as plugins.
+        # The forms are imported on first use.
         if apps.is_installed('django_otp.plugins.otp_totp'):
-            from .forms import TOTPDeviceCreateForm, DeviceVerifyForm
             from django_otp.plugins.otp_totp.models import TOTPDevice
             registry.register(
-                'TOTP', TOTPDevice, create_form_class=TOTPDeviceCreateForm,
-                verify_form_class=DeviceVerifyForm)
+                'TOTP', TOTPDevice,
+                create_form_class='kleides_mfa.forms.TOTPDeviceCreateForm',
+                verify_form_class='kleides_mfa.forms.DeviceVerifyForm',
+                cache_device_list=True)
 
         if apps.is_installed('django_otp.plugins.otp_static'):
-            from .forms import RecoveryDeviceForm, DeviceVerifyForm
             from django_otp.plugins.otp_static.models import StaticDevice
             message = _('Your recovery codes have been generated, save them '
                         'somewhere safe! Any old codes you have will no '
@@ -86,22 +135,41 @@ class KleidesMfaConfig(AppConfig):
                 device_list_javascript='js/kleides_mfa/recovery-code.js',
                 device_list_template=(
                     'kleides_mfa/device_recovery-code_list.html'),
-                create_form_class=RecoveryDeviceForm,
-                update_form_class=RecoveryDeviceForm,
-                verify_form_class=DeviceVerifyForm,
+                create_form_class='kleides_mfa.forms.RecoveryDeviceForm',
+                update_form_class='kleides_mfa.forms.RecoveryDeviceForm',
+                verify_form_class='kleides_mfa.forms.DeviceVerifyForm',
                 create_message=message, update_message=message,
                 delete_message=delete_message)
 
         if apps.is_installed('otp_yubikey'):
-            from .forms import DeviceVerifyForm, YubikeyDeviceCreateForm
-            from otp_yubikey.models import RemoteYubikeyDevice
+            from .yubikey import validation_services
+            from otp_yubikey.models import (
+                RemoteYubikeyDevice, ValidationService, YubikeyDevice)
             registry.register(
                 'Yubikey', RemoteYubikeyDevice,
-                create_form_class=YubikeyDeviceCreateForm,
-                verify_form_class=DeviceVerifyForm)
+                create_form_class='kleides_mfa.forms.YubikeyDeviceCreateForm',
+                verify_form_class='kleides_mfa.forms.DeviceVerifyForm',
+                cache_device_list=True)
+            registry.register(
+                'Local Yubikey', YubikeyDevice,
+                device_list_template=(
+                    'kleides_mfa/device_local-yubikey_list.html'),
+                create_form_class=(
+                    'kleides_mfa.forms.LocalYubikeyDeviceCreateForm'),
+                verify_form_class='kleides_mfa.forms.LocalYubikeyVerifyForm',
+                cache_device_list=True)
             post_migrate.connect(
                 create_yubikey_validationservice,
                 dispatch_uid='kleides_mfa.apps.KleidesMfaConfig')
+            post_save.connect(
+                validation_services.clear, sender=ValidationService,
+                dispatch_uid='kleides_mfa.yubikey.validation_services')
+            post_delete.connect(
+                validation_services.clear, sender=ValidationService,
+                dispatch_uid='kleides_mfa.yubikey.validation_services')
+
+        # Maintain the UserMfaStatus of the registered plugin models.
+        connect_status_signals()
 
         if (apps.is_installed('django.contrib.admin')
                 and app_settings.KLEIDES_MFA_PATCH_ADMIN):  # pragma: no branch
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+'''
+Buffered audit log of the device enrollments, deletions and verifications.
+
+The entries are kept in memory and written with ``bulk_create`` at the end
+of a request when ``KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE`` entries are buffered
+or ``KLEIDES_MFA_AUDIT_LOG_FLUSH_INTERVAL`` seconds have passed since the
+last write, by default at the end of every request. The remaining entries
+are written when the process exits.
+'''
+import atexit
+import logging
+import threading
+import time
+
+from django.utils import timezone
+
+from .conf import app_settings
+
+__all__ = ['AuditLogRecorder', 'audit_log']
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogRecorder():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._flushed = time.monotonic()
+
+    def record(self, request, action, plugin, device, user=None):
+        '''
+        Buffer an audit log entry of the device action.
+        '''
+        if not app_settings.KLEIDES_MFA_AUDIT_LOG:
+            return
+        from .models import AuditLogEntry
+        if user is None:
+            user = request.user
+        entry = AuditLogEntry(
+            created=timezone.now(), action=action, plugin=plugin.slug,
+            persistent_id=device.persistent_id, user_id=user.pk,
+            ip_address=request.META.get('REMOTE_ADDR') or None)
+        with self._lock:
+            self._buffer.append(entry)
+
+    def should_flush(self):
+        return bool(self._buffer) and (
+            len(self._buffer) >= app_settings.KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE
+            or time.monotonic() - self._flushed
+            >= app_settings.KLEIDES_MFA_AUDIT_LOG_FLUSH_INTERVAL)
+
+    def flush(self):
+        '''
+        Write the buffered entries to the database.
+        '''
+        from .models import AuditLogEntry
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            self._flushed = time.monotonic()
+        if not entries:
+            return
+        try:
+            AuditLogEntry.objects.bulk_create(
+                entries,
+                batch_size=app_settings.KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE)
+        except Exception:
+            # The response is already sent, the failed entries are logged.
+            logger.exception(
+                'Unable to write %d audit log entries', len(entries))
+
+    def request_finished(self, **kwargs):
+        '''
+        Signal handler connected to request_finished.
+        '''
+        if self.should_flush():
+            self.flush()
+
+
+audit_log = AuditLogRecorder()
+atexit.register(audit_log.flush)
+
+
+def devices_removed(sender, plugin, devices, **kwargs):
+    '''
+    Signal handler connected to mfa_bulk_removed. The entries of the devices
+    are written at once, without a request.
+    '''
+    if not app_settings.KLEIDES_MFA_AUDIT_LOG:
+        return
+    from .models import AuditLogEntry
+    now = timezone.now()
+    AuditLogEntry.objects.bulk_create([
+        AuditLogEntry(
+            created=now, action=AuditLogEntry.REMOVED, plugin=plugin.slug,
+            persistent_id=device.persistent_id, user_id=device.user_id)
+        for device in devices],
+        batch_size=app_settings.KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import functools
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .conf import app_settings
+
+__all__ = ['bump_device_list_version', 'device_list_version']
+
+
+def _device_list_version_key(user_id):
+    return 'kleides-mfa:device-list-version:{}'.format(user_id)
+
+
+def device_list_version(user):
+    '''
+    Return the version of the device list of the user.
+
+    The version is part of the device list fragment cache key. A missing
+    version is initialized with the current time so an evicted version never
+    matches previously cached fragments.
+    '''
+    cache = caches[app_settings.KLEIDES_MFA_CACHE]
+    key = _device_list_version_key(user.pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_device_list_version(user_id):
+    '''
+    Invalidate the cached device list fragments of the user.
+    '''
+    cache = caches[app_settings.KLEIDES_MFA_CACHE]
+    key = _device_list_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def _bump_on_commit(user_id):
+    # A version bumped before the change is committed lets a concurrent
+    # request cache the old device list under the new version.
+    transaction.on_commit(
+        functools.partial(bump_device_list_version, user_id))
+
+
+def device_changed(sender, instance, **kwargs):
+    '''
+    Signal handler connected to mfa_added, mfa_removed and mfa_updated.
+    '''
+    _bump_on_commit(instance.user_id)
+
+
+def devices_changed(sender, devices, **kwargs):
+    '''
+    Signal handler connected to mfa_bulk_removed and mfa_bulk_updated.
+    '''
+    for user_id in {device.user_id for device in devices}:
+        _bump_on_commit(user_id)
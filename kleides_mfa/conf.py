@@ -12,14 +12,16 @@ For instance, to enable mfa on the the admin interface:
 '''
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any
+from dataclasses import dataclass, fields
 import warnings
 
 from django.conf import settings as django_settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
-# All attributes accessed with this prefix are possible to overwrite
-# through django.conf.settings.
+# All attributes with this prefix are possible to overwrite through
+# django.conf.settings. The values are resolved once and reloaded when a
+# setting changes.
 settings_prefix = "KLEIDES_MFA_"
 
 
@@ -31,7 +33,7 @@ class AppSettings:
     # plugin.slug. # These are known plugins in order of security.
     # hardware tokens > software tokens > backup codes.
     KLEIDES_MFA_PLUGIN_PRIORITY: list[str] | tuple[str] = (
-        'u2f', 'yubikey', 'totp', 'recovery-code',
+        'u2f', 'yubikey', 'local-yubikey', 'totp', 'recovery-code',
     )
 
     # Patch the AdminSite class and default admin site instance to require
@@ -52,31 +54,126 @@ class AppSettings:
     # a forced verified timeout while the user is actively using the account.
     KLEIDES_MFA_VERIFIED_UPDATE: bool = True
 
-    def __getattribute__(self, name: str) -> Any:
+    # The cache alias used to store data shared between requests, such as the
+    # otp_yubikey validation service choices.
+    KLEIDES_MFA_CACHE: str = 'default'
+
+    # Amount of seconds the device list of a plugin is cached for a user.
+    # The cache is invalidated when a device is added, changed or removed in
+    # the kleides_mfa views, which requires a KLEIDES_MFA_CACHE that is shared
+    # between the processes. Use 0 to disable the cache.
+    KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT: int | None = 0
+
+    # Amount of seconds a passed auth request is cached in-process by session
+    # key. A logout is not effective for cached sessions until the timeout
+    # expires. Use 0 to disable the cache.
+    KLEIDES_MFA_AUTH_REQUEST_CACHE_TIMEOUT: int = 0
+
+    # Amount of days a user can trust a browser to skip the device
+    # verification after a password login. Use 0 to disable trusted browsers.
+    KLEIDES_MFA_TRUSTED_BROWSER_DAYS: int = 0
+
+    # The name of the signed trusted browser cookie.
+    KLEIDES_MFA_TRUSTED_BROWSER_COOKIE_NAME: str = 'kleides_mfa_trusted'
+
+    # The dispatcher of the events for deferred receivers. The
+    # ThreadEventDispatcher delivers the events in a worker thread of the
+    # process, the OutboxEventDispatcher stores them in the database.
+    KLEIDES_MFA_EVENT_DISPATCHER: str = (
+        'kleides_mfa.events.ThreadEventDispatcher')
+
+    # Maximum amount of events queued by the ThreadEventDispatcher.
+    KLEIDES_MFA_EVENT_QUEUE_SIZE: int = 1000
+
+    # The OutboxEventDispatcher retries an event with failed receivers after
+    # the delay in seconds, which doubles with every attempt. The event is no
+    # longer retried after the maximum amount of attempts.
+    KLEIDES_MFA_EVENT_RETRY_DELAY: int = 60
+    KLEIDES_MFA_EVENT_MAX_ATTEMPTS: int = 10
+
+    # Record the device enrollments, deletions and verifications in the
+    # AuditLogEntry model.
+    KLEIDES_MFA_AUDIT_LOG: bool = False
+
+    # The buffered audit log entries are written at the end of a request when
+    # the batch size is reached or the flush interval in seconds has passed.
+    # Entries are only written when a request finishes, an interval of 0
+    # writes them at the end of every request.
+    KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE: int = 100
+    KLEIDES_MFA_AUDIT_LOG_FLUSH_INTERVAL: int = 0
+
+    # Check the queries of the views and middleware against their budget when
+    # DEBUG is enabled. Use 'warn', 'raise' or None to disable the check.
+    KLEIDES_MFA_QUERY_BUDGET: str | None = None
+
+    # The dotted path of the sink of the device lookup and token verification
+    # metrics, 'kleides_mfa.metrics.PrometheusSink' or
+    # 'kleides_mfa.metrics.StatsdSink'. Use None to disable the metrics.
+    KLEIDES_MFA_METRICS_SINK: str | None = None
+
+    # The (host, port) of the statsd server of the StatsdSink.
+    KLEIDES_MFA_METRICS_STATSD_ADDRESS: tuple[str, int] = ('localhost', 8125)
+
+    # The dotted path of a callable that returns the tracer of the login
+    # stages, such as 'kleides_mfa.tracing.opentelemetry_tracer'. Use None to
+    # disable tracing.
+    KLEIDES_MFA_TRACER: str | None = None
+
+    # The database alias of a replica for the reads of the device tables by
+    # the kleides_mfa.routers.ReplicaRouter. Use None to read the primary.
+    KLEIDES_MFA_REPLICA_DATABASE: str | None = None
+
+    # Amount of seconds a browser reads the device tables from the primary
+    # after it wrote to them, to read past the replication lag.
+    KLEIDES_MFA_REPLICA_PIN_SECONDS: int = 15
+
+    # Maintain the UserMfaStatus of every user with a device and use it to
+    # check if a user has a device. Run the kleides_mfa_rebuild_status command
+    # after enabling it.
+    KLEIDES_MFA_USER_STATUS: bool = False
+
+    # Amount of days after which unconfirmed devices are deleted by
+    # kleides_mfa.purge.purge_unconfirmed_devices.
+    KLEIDES_MFA_PURGE_UNCONFIRMED_DAYS: int = 7
+
+    # Index the sessions by the verified user and device in the DeviceSession
+    # model to revoke them with kleides_mfa.session_index.revoke_sessions.
+    KLEIDES_MFA_SESSION_INDEX: bool = False
+
+    def reload(self):
         '''
-        Check if a Django project settings should override the app default.
+        Resolve the settings from the Django project settings.
 
-        Only allow settings from the settings prefix in order to avoid
-        returning any random properties of the django settings we the settings
-        prefix.
+        Only settings with the settings prefix are resolved in order to avoid
+        returning any random properties of the django settings.
         '''
-        if name == 'KLEIDES_MFA_PATCH_ADMIN':
-            value = getattr(django_settings, 'KLEIDES_MFA_PATCH_ADMIN', True)
-            if value:
-                warnings.warn(
-                    'The KLEIDES_MFA_PATCH_ADMIN=True setting is deprecated. '
-                    'Use the default_site="kleides_mfa.admin.KleidesMfaAdmin" '
-                    'attribute on your project AppConfig and remove the '
-                    'django.contrib.admin app. '
-                    'Then set KLEIDES_MFA_PATCH_ADMIN to False. '
-                    'https://docs.djangoproject.com/en/5.0/ref/contrib/admin/'
-                    '#overriding-the-default-admin-site', DeprecationWarning)
-            return value
+        for field in fields(self):
+            value = getattr(django_settings, field.name, field.default)
+            object.__setattr__(self, field.name, value)
 
-        if name.startswith(settings_prefix) and hasattr(django_settings, name):
-            return getattr(django_settings, name)
-
-        return super().__getattribute__(name)
+    def warn_deprecated(self):
+        '''
+        Warn about the use of deprecated settings.
+        '''
+        if self.KLEIDES_MFA_PATCH_ADMIN:
+            warnings.warn(
+                'The KLEIDES_MFA_PATCH_ADMIN=True setting is deprecated. '
+                'Use the default_site="kleides_mfa.admin.KleidesMfaAdmin" '
+                'attribute on your project AppConfig and remove the '
+                'django.contrib.admin app. '
+                'Then set KLEIDES_MFA_PATCH_ADMIN to False. '
+                'https://docs.djangoproject.com/en/5.0/ref/contrib/admin/'
+                '#overriding-the-default-admin-site', DeprecationWarning)
 
 
 app_settings = AppSettings()
+if django_settings.configured:
+    app_settings.reload()
+
+
+@receiver(setting_changed)
+def reload_app_settings(setting, **kwargs):
+    if setting.startswith(settings_prefix):
+        app_settings.reload()
+        if setting == 'KLEIDES_MFA_PATCH_ADMIN':
+            app_settings.warn_deprecated()
@@ -1,19 +1,37 @@
 from functools import wraps
-from urllib.parse import urlparse
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.conf import settings
-from django.contrib import messages
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.core.exceptions import PermissionDenied
-from django.shortcuts import resolve_url
-from django.utils.translation import gettext_lazy as _
 
-from .views.mixins import is_recently_verified, is_user_in_setup
+from .utils import aget_user
+from .views.mixins import (
+    ais_recently_verified, ais_user_in_setup, is_recently_verified,
+    is_user_in_setup, login_redirect)
+
+
+def _async_wrapper(
+    view_func, test_func, login_url, raise_exception, redirect_field_name
+):
+    @wraps(view_func)
+    async def _async_wrapper_view(request, *args, **kwargs):
+        if await test_func(request):
+            return await view_func(request, *args, **kwargs)
+
+        if raise_exception:
+            raise PermissionDenied
+
+        return login_redirect(
+            request, login_url or settings.LOGIN_URL, redirect_field_name,
+            user=await aget_user(request))
+
+    return _async_wrapper_view
 
 
 def user_passes_test(
     test_func, login_url=None, raise_exception=False,
-    redirect_field_name=REDIRECT_FIELD_NAME
+    redirect_field_name=REDIRECT_FIELD_NAME, async_test_func=None
 ):
     '''
     Decorator for views that checks that the user passes the given test,
@@ -21,9 +39,16 @@ def user_passes_test(
     that takes the request object and returns True if the user passes.
     If raise_exception is True a PermissionDenied exception is raised instead
     of redicting to the login page.
+    Async views are tested with the async_test_func coroutine function, if
+    it is not provided the test_func is run in a thread.
     '''
 
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            return _async_wrapper(
+                view_func, async_test_func or sync_to_async(test_func),
+                login_url, raise_exception, redirect_field_name)
+
         @wraps(view_func)
         def _wrapper_view(request, *args, **kwargs):
             if test_func(request):
@@ -32,25 +57,8 @@ def user_passes_test(
             if raise_exception:
                 raise PermissionDenied
 
-            if request.user.is_verified:
-                messages.info(
-                    request,
-                    _('We need to confirm your identity, please login again.'))
-
-            path = request.build_absolute_uri()
-            resolved_login_url = resolve_url(login_url or settings.LOGIN_URL)
-            # If the login url is the same scheme and net location then just
-            # use the path as the "next" url.
-            login_scheme, login_netloc = urlparse(resolved_login_url)[:2]
-            current_scheme, current_netloc = urlparse(path)[:2]
-            if (not login_scheme or login_scheme == current_scheme) and (
-                not login_netloc or login_netloc == current_netloc
-            ):
-                path = request.get_full_path()
-            from django.contrib.auth.views import redirect_to_login
-
-            return redirect_to_login(
-                path, resolved_login_url, redirect_field_name)
+            return login_redirect(
+                request, login_url or settings.LOGIN_URL, redirect_field_name)
 
         return _wrapper_view
 
@@ -59,7 +67,7 @@ def user_passes_test(
 
 def create_decorator(
     function=None, test_func=None, login_url=None, raise_exception=False,
-    redirect_field_name=REDIRECT_FIELD_NAME
+    redirect_field_name=REDIRECT_FIELD_NAME, async_test_func=None
 ):
     if not callable(test_func):
         raise ValueError('test_func must be a callable that accepts a request')
@@ -68,6 +76,7 @@ def create_decorator(
         test_func,
         login_url=login_url, raise_exception=raise_exception,
         redirect_field_name=redirect_field_name,
+        async_test_func=async_test_func,
     )
 
     if function:
@@ -76,6 +85,24 @@ def create_decorator(
     return actual_decorator
 
 
+async def _ais_single_factor_authenticated(request):
+    return (await aget_user(request)).is_single_factor_authenticated
+
+
+async def _ais_verified(request):
+    return (await aget_user(request)).is_verified
+
+
+async def _ais_verified_or_in_setup(request):
+    return await _ais_verified(request) or await ais_user_in_setup(request)
+
+
+async def _ais_recently_verified_or_in_setup(request):
+    return (
+        await ais_recently_verified(request)
+        or await ais_user_in_setup(request))
+
+
 def single_factor_required(*args, **kwargs):
     '''
     Decorator for views that only required a single authentication factor.
@@ -83,6 +110,7 @@ def single_factor_required(*args, **kwargs):
     return create_decorator(
         *args,
         test_func=lambda r: r.user.is_single_factor_authenticated,
+        async_test_func=_ais_single_factor_authenticated,
         **kwargs)
 
 
@@ -93,6 +121,7 @@ def multi_factor_required(*args, **kwargs):
     return create_decorator(
         *args,
         test_func=lambda r: r.user.is_verified,
+        async_test_func=_ais_verified,
         **kwargs)
 
 
@@ -100,7 +129,9 @@ def recent_multi_factor_required(*args, **kwargs):
     '''
     Decorator for views that require recent multi factor authentication.
     '''
-    return create_decorator(*args, test_func=is_recently_verified, **kwargs)
+    return create_decorator(
+        *args, test_func=is_recently_verified,
+        async_test_func=ais_recently_verified, **kwargs)
 
 
 def setup_or_mfa_required(*args, **kwargs):
@@ -111,6 +142,7 @@ def setup_or_mfa_required(*args, **kwargs):
     return create_decorator(
         *args,
         test_func=lambda r: r.user.is_verified or is_user_in_setup(r),
+        async_test_func=_ais_verified_or_in_setup,
         **kwargs)
 
 
@@ -122,4 +154,5 @@ def setup_or_recent_mfa_required(*args, **kwargs):
     return create_decorator(
         *args,
         test_func=lambda r: is_recently_verified(r) or is_user_in_setup(r),
+        async_test_func=_ais_recently_verified_or_in_setup,
         **kwargs)
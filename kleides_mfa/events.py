@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+'''
+Deferred delivery of the kleides_mfa signals.
+
+Receivers connected with :func:`deferred_receiver` are called outside of the
+request with a JSON serializable event instead of the signal arguments. The
+events are handed to the dispatcher of ``KLEIDES_MFA_EVENT_DISPATCHER`` when
+the transaction commits.
+'''
+from collections import defaultdict
+from datetime import timedelta
+import logging
+import queue
+import threading
+
+from django.contrib.auth.signals import user_login_failed
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .conf import app_settings
+from .signals import (
+    mfa_added, mfa_bulk_removed, mfa_bulk_updated, mfa_removed, mfa_updated)
+
+__all__ = [
+    'OutboxEventDispatcher', 'ThreadEventDispatcher', 'deferred_receiver',
+    'deliver', 'disconnect_deferred', 'get_dispatcher']
+
+logger = logging.getLogger(__name__)
+
+SIGNALS = {
+    'mfa_added': mfa_added,
+    'mfa_removed': mfa_removed,
+    'mfa_updated': mfa_updated,
+    'mfa_bulk_removed': mfa_bulk_removed,
+    'mfa_bulk_updated': mfa_bulk_updated,
+    'login_failed': user_login_failed,
+}
+
+_receivers = defaultdict(list)
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def deferred_receiver(name):
+    '''
+    Decorator to call the function with the event dictionary of every
+    ``mfa_added``, ``mfa_removed``, ``mfa_updated``, ``mfa_bulk_removed``,
+    ``mfa_bulk_updated`` or ``login_failed`` event.
+    '''
+    if name not in SIGNALS:
+        raise ValueError('Unknown event {!r}'.format(name))
+
+    def decorator(func):
+        if func not in _receivers[name]:
+            _receivers[name].append(func)
+        return func
+    return decorator
+
+
+def disconnect_deferred(name, func):
+    '''
+    Disconnect a function connected with :func:`deferred_receiver`.
+    '''
+    if func in _receivers[name]:
+        _receivers[name].remove(func)
+
+
+def _object_data(obj):
+    if obj is None:
+        return None
+    data = {'model': obj._meta.label_lower, 'pk': obj.pk}
+    if hasattr(obj, 'get_username'):
+        data['username'] = obj.get_username()
+    if hasattr(obj, 'persistent_id'):
+        data.update(
+            name=obj.name, user_id=obj.user_id,
+            persistent_id=obj.persistent_id)
+    return data
+
+
+def _request_data(request):
+    if request is None:
+        return None
+    return {
+        'path': request.path,
+        'remote_addr': request.META.get('REMOTE_ADDR'),
+        'user_agent': request.META.get('HTTP_USER_AGENT'),
+    }
+
+
+def event_data(name, sender, **kwargs):
+    '''
+    Return the JSON serializable event of the signal arguments.
+    '''
+    credentials = kwargs.get('credentials') or {}
+    device = kwargs.get('instance', kwargs.get('device'))
+    event = {
+        'name': name,
+        'sender': str(sender),
+        'time': timezone.now().isoformat(),
+        'device': _object_data(device),
+        'user': _object_data(kwargs.get('user')),
+        'username': credentials.get('username'),
+        'request': _request_data(kwargs.get('request')),
+    }
+    if 'devices' in kwargs:
+        # The bulk events of a chunk of devices of a plugin.
+        event['plugin'] = kwargs['plugin'].slug
+        event['devices'] = [
+            _object_data(device) for device in kwargs['devices']]
+    return event
+
+
+def _call_receivers(event):
+    errors = []
+    for func in list(_receivers[event['name']]):
+        try:
+            func(event)
+        except Exception as e:
+            logger.exception(
+                'Deferred receiver %r failed for the %s event',
+                func, event['name'])
+            errors.append('{!r}: {!r}'.format(func, e))
+    return errors
+
+
+def deliver(event):
+    '''
+    Call the receivers of the event. Returns False if a receiver failed.
+    '''
+    return not _call_receivers(event)
+
+
+class ThreadEventDispatcher():
+    '''
+    Deliver the events from a bounded queue in a worker thread.
+    Events are dropped with a warning when the queue is full.
+    '''
+    def __init__(self):
+        self.queue = queue.Queue(
+            maxsize=app_settings.KLEIDES_MFA_EVENT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def dispatch(self, event):
+        transaction.on_commit(lambda: self.put(event))
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            logger.warning(
+                'The event queue is full, dropped the %s event', event['name'])
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name='kleides-mfa-events', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                deliver(event)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def join(self):
+        '''
+        Wait until all queued events are delivered.
+        '''
+        self.queue.join()
+
+
+class OutboxEventDispatcher():
+    '''
+    Store the events in the OutboxEvent model within the transaction.
+    The ``kleides_mfa_deliver_events`` command delivers the stored events.
+    '''
+    def dispatch(self, event):
+        from .models import OutboxEvent
+        OutboxEvent.objects.create(name=event['name'], payload=event)
+
+    def retry_delay(self, attempts):
+        '''
+        Return the delay of the next attempt after the number of attempts.
+        '''
+        return timedelta(seconds=(
+            app_settings.KLEIDES_MFA_EVENT_RETRY_DELAY * 2 ** (attempts - 1)))
+
+    def claim(self, batch_size):
+        '''
+        Return a batch of due events. The next attempt of the events is
+        postponed by the retry delay in a short transaction, an interrupted
+        delivery is retried after the delay.
+        '''
+        from .models import OutboxEvent
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(next_attempt__lte=now)
+                .order_by('next_attempt', 'pk')[:batch_size])
+            for outbox_event in events:
+                outbox_event.attempts += 1
+                outbox_event.next_attempt = now + self.retry_delay(
+                    outbox_event.attempts)
+            OutboxEvent.objects.bulk_update(
+                events, ['attempts', 'next_attempt'])
+        return events
+
+    def deliver(self, batch_size=100):
+        '''
+        Deliver a batch of due events outside of the claim transaction.
+        Returns the number of delivered and failed events. Failed events are
+        retried after the retry delay until the maximum attempts.
+        '''
+        from .models import OutboxEvent
+        delivered = []
+        failed = []
+        for outbox_event in self.claim(batch_size):
+            errors = _call_receivers(outbox_event.payload)
+            if not errors:
+                delivered.append(outbox_event.pk)
+                continue
+            outbox_event.last_error = '\n'.join(errors)
+            if (outbox_event.attempts
+                    >= app_settings.KLEIDES_MFA_EVENT_MAX_ATTEMPTS):
+                logger.error(
+                    'The %s event %s failed %d times and is not retried',
+                    outbox_event.name, outbox_event.pk, outbox_event.attempts)
+                outbox_event.next_attempt = None
+            failed.append(outbox_event)
+        OutboxEvent.objects.filter(pk__in=delivered).update(
+            delivered=timezone.now(), next_attempt=None, last_error='')
+        OutboxEvent.objects.bulk_update(failed, ['last_error', 'next_attempt'])
+        return len(delivered), len(failed)
+
+
+def get_dispatcher():
+    '''
+    Return the dispatcher instance of ``KLEIDES_MFA_EVENT_DISPATCHER``.
+    '''
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = import_string(
+                app_settings.KLEIDES_MFA_EVENT_DISPATCHER)()
+        return _dispatcher
+
+
+@receiver(setting_changed)
+def clear_dispatcher(setting, **kwargs):
+    global _dispatcher
+    if setting in (
+            'KLEIDES_MFA_EVENT_DISPATCHER', 'KLEIDES_MFA_EVENT_QUEUE_SIZE'):
+        with _dispatcher_lock:
+            _dispatcher = None
+
+
+def _signal_handler(name):
+    def handler(sender, **kwargs):
+        if _receivers[name]:
+            get_dispatcher().dispatch(event_data(name, sender, **kwargs))
+    return handler
+
+
+def connect_signals():
+    '''
+    Connect the signal handlers that dispatch the events.
+    '''
+    for name, signal in SIGNALS.items():
+        signal.connect(
+            _signal_handler(name), weak=False,
+            dispatch_uid='kleides_mfa.events.{}'.format(name))
@@ -4,10 +4,14 @@ import time
 from django import forms
 from django.apps import apps
 from django.conf import settings
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, ngettext_lazy
 
 from django_otp.oath import TOTP
 
+from .conf import app_settings
+from .metrics import timer
+from .tracing import OUTCOME, trace
+
 
 TOTP_SESSION_KEY = 'kleides-mfa-totp-key'
 
@@ -43,6 +47,14 @@ class DeviceVerifyForm(BaseVerifyForm):
         super().__init__(*args, **kwargs)
         self.fields['otp_token'].widget.attrs.update({
             'autocomplete': 'off', 'autofocus': 'autofocus'})
+        days = app_settings.KLEIDES_MFA_TRUSTED_BROWSER_DAYS
+        if days:
+            self.fields['trust_browser'] = forms.BooleanField(
+                label=ngettext_lazy(
+                    'Trust this browser for %(days)d day',
+                    'Trust this browser for %(days)d days', 'days') % {
+                        'days': days},
+                required=False)
 
     def clean(self):
         cleaned_data = super().clean()
@@ -51,10 +63,18 @@ class DeviceVerifyForm(BaseVerifyForm):
             return cleaned_data
 
         # Note that tokens can become invalid once verified.
-        if not self.device.verify_token(token):
+        with trace('verify_token', self.plugin) as span, \
+                timer('verify', self.plugin) as verify_timer:
+            verify_timer.success = self.verify_token(token)
+            span.set_attribute(
+                OUTCOME, 'success' if verify_timer.success else 'failure')
+        if not verify_timer.success:
             raise forms.ValidationError(self.error_messages['invalid'])
         return cleaned_data
 
+    def verify_token(self, token):
+        return self.device.verify_token(token)
+
 
 class BaseDeviceForm(forms.ModelForm):
     def __init__(self, plugin, request, *args, **kwargs):
@@ -142,8 +162,9 @@ if apps.is_installed('django_otp.plugins.otp_totp'):  # noqa: E501 C901
                     self.instance.drift)
                 totp.time = time.time()
 
-                verified = totp.verify(
-                    token, self.instance.tolerance, self.instance.last_t)
+                with timer('verify', self.plugin) as verify_timer:
+                    verified = verify_timer.success = totp.verify(
+                        token, self.instance.tolerance, self.instance.last_t)
                 if verified:
                     # Device is verified, update attributes and prepare the
                     # instance to be saved.
@@ -180,36 +201,72 @@ if apps.is_installed('django_otp.plugins.otp_static'):
             instance, created = (
                 self.request.user.staticdevice_set.get_or_create(
                     defaults={'name': self.plugin.name}))
-            instance.token_set.all().delete()
-            for i in range(self.token_amount):
-                instance.token_set.create(token=StaticToken.random_token())
+            self.replace_tokens([instance])
             return instance
 
+        @classmethod
+        def replace_tokens(cls, devices):
+            '''
+            Replace the recovery codes of the devices with new codes.
+            '''
+            StaticToken.objects.filter(device__in=devices).delete()
+            StaticToken.objects.bulk_create(
+                StaticToken(device=device, token=StaticToken.random_token())
+                for device in devices for i in range(cls.token_amount))
+
         class Meta:
             model = StaticDevice
             fields = ()
 
 
-if apps.is_installed('otp_yubikey'):  # pragma: no branch
-    from otp_yubikey.models import RemoteYubikeyDevice, ValidationService
+if apps.is_installed('otp_yubikey'):  # noqa: C901 pragma: no branch
+    from binascii import hexlify
+
+    from django.db.models import Q
+    from otp_yubikey.models import (
+        RemoteYubikeyDevice, ValidationService, YubikeyDevice)
+    from yubiotp.otp import decode_otp
+
+    from .yubikey import validation_services
+
+    def decode_yubikey_token(device, token):
+        '''
+        Decrypt a Yubikey OTP token with the key of a local Yubikey device.
+        Return a tuple of the public id and the OTP, or (None, None) when the
+        token was not generated with the private id and key of the device.
+        '''
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        try:
+            public_id, otp = decode_otp(token, device.bin_key)
+        except ValueError:
+            # Invalid hex key, modhex token or checksum (CRCError).
+            return None, None
+        if hexlify(otp.uid) != device.private_id.encode():
+            return None, None
+        return public_id, otp
 
     class YubikeyDeviceCreateForm(DeviceCreateForm):
-        service = forms.ModelChoiceField(
-            label=_('Service'), queryset=ValidationService.objects.all(),
-            empty_label=None)
+        service = forms.TypedChoiceField(label=_('Service'), coerce=int)
         otp_token = forms.CharField(label=_('Token'))
 
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
             self.fields['otp_token'].widget.attrs.update({
                 'autocomplete': 'off', 'autofocus': 'autofocus'})
-            try:
-                self.fields['service'].initial = (
-                    self.fields['service'].queryset.get().pk)
+            # The choices are taken from the cached validation services to
+            # avoid querying the services for every form.
+            choices = validation_services.choices()
+            self.fields['service'].choices = choices
+            # Multiple is good, none is bad.
+            if len(choices) == 1:
+                self.fields['service'].initial = choices[0][0]
                 self.fields['service'].widget = forms.HiddenInput()
-            except ValidationService.MultipleObjectsReturned:
-                # Multiple is good, none is bad.
-                pass
+
+        def clean_service(self):
+            # The cached choices may include a service that was deleted.
+            return ValidationService.objects.filter(
+                pk=self.cleaned_data['service']).first()
 
         def clean(self):
             cleaned_data = super().clean()
@@ -219,7 +276,9 @@ if apps.is_installed('otp_yubikey'):  # pragma: no branch
             if token and service:
                 self.instance.service = service
                 self.instance.public_id = token[:-32]
-                verified = self.instance.verify_token(token)
+                with timer('verify', self.plugin) as verify_timer:
+                    verified = verify_timer.success = (
+                        self.instance.verify_token(token))
             if not verified:
                 raise forms.ValidationError(self.error_messages['invalid'])
             return cleaned_data
@@ -227,3 +286,61 @@ if apps.is_installed('otp_yubikey'):  # pragma: no branch
         class Meta:
             model = RemoteYubikeyDevice
             fields = ('service', 'name', 'otp_token',)
+
+    class LocalYubikeyDeviceCreateForm(DeviceCreateForm):
+        '''
+        Register a Yubikey that is verified locally with its AES key.
+
+        The public id of a token cannot be checked before the device is saved
+        because ``YubikeyDevice.public_id`` is derived from the primary key.
+        The Yubikey must be programmed with that public id to verify tokens.
+        '''
+        otp_token = forms.CharField(label=_('Token'))
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.fields['otp_token'].widget.attrs.update({
+                'autocomplete': 'off', 'autofocus': 'autofocus'})
+
+        def clean(self):
+            cleaned_data = super().clean()
+            token = cleaned_data.get('otp_token')
+            otp = None
+            if token:
+                self.instance.private_id = cleaned_data.get('private_id', '')
+                self.instance.key = cleaned_data.get('key', '')
+                with timer('verify', self.plugin) as verify_timer:
+                    public_id, otp = decode_yubikey_token(
+                        self.instance, token)
+                    verify_timer.success = otp is not None
+            if otp is None:
+                raise forms.ValidationError(self.error_messages['invalid'])
+            self.instance.session = otp.session
+            self.instance.counter = otp.counter
+            return cleaned_data
+
+        class Meta:
+            model = YubikeyDevice
+            fields = ('name', 'private_id', 'key', 'otp_token',)
+
+    class LocalYubikeyVerifyForm(DeviceVerifyForm):
+        '''
+        Verify a local Yubikey token.
+
+        The counters are updated with a conditional UPDATE instead of the
+        read-modify-save in ``YubikeyDevice.verify_token`` so concurrent
+        requests cannot both accept the same token.
+        '''
+        def verify_token(self, token):
+            public_id, otp = decode_yubikey_token(self.device, token)
+            if otp is None or public_id != self.device.public_id():
+                return False
+            updated = type(self.device)._default_manager.filter(
+                Q(session__lt=otp.session)
+                | Q(session=otp.session, counter__lt=otp.counter),
+                pk=self.device.pk,
+            ).update(session=otp.session, counter=otp.counter)
+            if updated:
+                self.device.session = otp.session
+                self.device.counter = otp.counter
+            return bool(updated)
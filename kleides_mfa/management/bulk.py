@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+'''
+Base class of the management commands that change the devices of many users.
+
+The users are processed in chunks of ``--chunk-size`` users with a
+transaction per chunk, optionally in a pool of ``--processes`` processes.
+'''
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from itertools import repeat
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from ..status import deferred_status_updates
+
+
+def _process_chunk(module, user_ids, options):
+    # Runs in the pool processes.
+    return import_module(module).Command().run_chunk(user_ids, options)
+
+
+class BulkUserCommand(BaseCommand):
+    '''
+    Call :meth:`process_chunk` with every chunk of users and report the
+    totals returned by it.
+    '''
+    #: Options passed to :meth:`process_chunk`, they must be picklable.
+    chunk_options = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users', default=[],
+            help='Process the user id, can be repeated.')
+        parser.add_argument(
+            '--users-file',
+            help='Process the user ids in the file, one per line.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Users per transaction (default: 500).')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Process the chunks in a pool of processes (default: 1).')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false',
+            dest='interactive', help='Do not ask for confirmation.')
+
+    def get_user_ids(self, users, users_file):
+        '''
+        Return the sorted user ids of the options or None for all users.
+        '''
+        user_ids = set(users)
+        if users_file:
+            try:
+                with open(users_file) as f:
+                    user_ids.update(int(line) for line in f if line.strip())
+            except (OSError, ValueError) as e:
+                raise CommandError('Invalid users file: {}'.format(e))
+        return sorted(user_ids) if users or users_file else None
+
+    def chunks(self, user_ids, chunk_size):
+        '''
+        Yield lists of at most chunk_size user ids.
+        '''
+        if user_ids is not None:
+            for index in range(0, len(user_ids), chunk_size):
+                yield user_ids[index:index + chunk_size]
+            return
+        users = get_user_model().objects.order_by('pk').values_list(
+            'pk', flat=True)
+        last_pk = None
+        while True:
+            chunk = users if last_pk is None else users.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1]
+
+    def get_confirmation(self, user_ids, options):
+        '''
+        Return the question to confirm before processing the users.
+        '''
+        raise NotImplementedError
+
+    def process_chunk(self, user_ids, **options):
+        '''
+        Process the users and return a dictionary of counts.
+        '''
+        raise NotImplementedError
+
+    def run_chunk(self, user_ids, options):
+        '''
+        Process the users in a transaction. Returns the counts and the
+        number of users.
+        '''
+        with transaction.atomic(), deferred_status_updates():
+            return self.process_chunk(user_ids, **options), len(user_ids)
+
+    def map_chunks(self, chunks, options, processes):
+        if processes == 1:
+            for chunk in chunks:
+                yield self.run_chunk(chunk, options)
+            return
+        # Query the chunks first, the forked processes must not share the
+        # database connections.
+        chunks = list(chunks)
+        connections.close_all()
+        with ProcessPoolExecutor(
+                processes, initializer=django.setup) as executor:
+            yield from executor.map(
+                _process_chunk, repeat(type(self).__module__), chunks,
+                repeat(options))
+
+    def confirm(self, question):
+        answer = input('{} Type "yes" to continue: '.format(question))
+        return answer == 'yes'
+
+    def handle(self, users, users_file, chunk_size, processes, **options):
+        if chunk_size < 1 or processes < 1:
+            raise CommandError(
+                'The chunk size and the processes must be at least 1.')
+        user_ids = self.get_user_ids(users, users_file)
+        if options['interactive'] and not self.confirm(
+                self.get_confirmation(user_ids, options)):
+            self.stdout.write('Cancelled.')
+            return
+        chunk_options = {name: options[name] for name in self.chunk_options}
+        totals = Counter()
+        processed = 0
+        for chunk_totals, chunk_users in self.map_chunks(
+                self.chunks(user_ids, chunk_size), chunk_options, processes):
+            totals.update(chunk_totals)
+            processed += chunk_users
+            if options['verbosity'] > 0:
+                self.stdout.write('Processed {} users: {}'.format(
+                    processed, self.format_totals(totals)))
+        self.stdout.write(self.style.SUCCESS('Done, {} users: {}'.format(
+            processed, self.format_totals(totals))))
+
+    def format_totals(self, totals):
+        return ', '.join(
+            '{} {}'.format(count, name)
+            for name, count in sorted(totals.items())) or 'nothing changed'
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ...models import AuditLogEntry
+
+FIELDS = (
+    'created', 'action', 'plugin', 'persistent_id', 'user_id', 'ip_address')
+
+
+class Command(BaseCommand):
+    help = 'Export the MFA audit log as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'), default='csv',
+            help='Output format (default: csv).')
+        parser.add_argument(
+            '--since', help='Export entries created at or after the ISO '
+                            'date and time.')
+        parser.add_argument(
+            '--until', help='Export entries created before the ISO date and '
+                            'time.')
+        parser.add_argument(
+            '--user', type=int, help='Export entries of the user id.')
+
+    def get_queryset(self, since, until, user):
+        queryset = AuditLogEntry.objects.order_by('created', 'pk')
+        for lookup, value in (
+                ('created__gte', since), ('created__lt', until)):
+            if value is None:
+                continue
+            created = parse_datetime(value)
+            if created is None:
+                raise CommandError(
+                    'Invalid date and time {!r}'.format(value))
+            if settings.USE_TZ and timezone.is_naive(created):
+                created = timezone.make_aware(created)
+            queryset = queryset.filter(**{lookup: created})
+        if user is not None:
+            queryset = queryset.filter(user_id=user)
+        return queryset.values_list(*FIELDS)
+
+    def handle(self, format, since, until, user, **options):
+        # Stream the rows instead of loading the complete log in memory.
+        rows = self.get_queryset(since, until, user).iterator(chunk_size=2000)
+        if format == 'csv':
+            writer = csv.writer(self.stdout, lineterminator='\n')
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow(
+                    (row[0].isoformat(),) + tuple(
+                        '' if value is None else value for value in row[1:]))
+        else:
+            for row in rows:
+                data = dict(zip(FIELDS, row), created=row[0].isoformat())
+                self.stdout.write(json.dumps(data))
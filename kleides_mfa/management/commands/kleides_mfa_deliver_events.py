@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...events import OutboxEventDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Deliver the events stored by the OutboxEventDispatcher.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of events claimed per transaction.')
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep delivering events and wait the interval in seconds '
+                 'after delivering the pending events.')
+
+    def handle(self, batch_size, interval, **options):
+        dispatcher = OutboxEventDispatcher()
+        while True:
+            delivered, failed = dispatcher.deliver(batch_size=batch_size)
+            if delivered or failed:
+                self.stdout.write('Delivered {} event(s), {} failed'.format(
+                    delivered, failed))
+            if delivered + failed < batch_size:
+                # All due events are delivered or failed.
+                if not interval:
+                    break
+                time.sleep(interval)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...purge import purge_unconfirmed_devices
+
+
+class Command(BaseCommand):
+    help = 'Delete the unconfirmed devices that are older than the cutoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Delete the devices created more than the days ago '
+                 '(default: KLEIDES_MFA_PURGE_UNCONFIRMED_DAYS).')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of devices deleted per transaction.')
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep purging devices and wait the interval in seconds '
+                 'after every purge.')
+
+    def handle(self, days, batch_size, interval, **options):
+        while True:
+            purged = purge_unconfirmed_devices(
+                days=days, batch_size=batch_size)
+            for slug, count in purged.items():
+                if count is None:
+                    self.stdout.write(
+                        '{}: skipped, the device model has no created_at '
+                        'field'.format(slug))
+                else:
+                    self.stdout.write('{}: purged {} device(s)'.format(
+                        slug, count))
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...status import update_user_statuses
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the MFA status of all users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Users per transaction (default: 1000).')
+
+    def handle(self, chunk_size, **options):
+        users = get_user_model().objects.order_by('pk').values_list(
+            'pk', flat=True)
+        total = 0
+        last_pk = None
+        while True:
+            chunk = users if last_pk is None else users.filter(pk__gt=last_pk)
+            user_ids = list(chunk[:chunk_size])
+            if not user_ids:
+                break
+            with transaction.atomic():
+                update_user_statuses(user_ids)
+            total += len(user_ids)
+            last_pk = user_ids[-1]
+            if options['verbosity'] > 1:
+                self.stdout.write('Rebuilt {} users'.format(total))
+        self.stdout.write('Rebuilt the MFA status of {} users.'.format(total))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from ...registry import registry
+from ...signals import mfa_bulk_updated
+from ..bulk import BulkUserCommand
+
+SLUG = 'recovery-code'
+
+
+class Command(BulkUserCommand):
+    help = 'Replace the recovery codes of users with new codes.'
+
+    def get_plugin(self):
+        try:
+            return registry.get_plugin(SLUG)
+        except KeyError:
+            raise CommandError('The recovery code plugin is not registered.')
+
+    def get_confirmation(self, user_ids, options):
+        return 'Replace the recovery codes of {}?'.format(
+            'all users' if user_ids is None else '{} users'.format(
+                len(user_ids)))
+
+    def handle(self, *args, **options):
+        self.get_plugin()
+        super().handle(*args, **options)
+
+    def process_chunk(self, user_ids):
+        plugin = self.get_plugin()
+        devices = list(plugin.model.objects.filter(user_id__in=user_ids))
+        if not devices:
+            return {}
+        plugin.get_update_form_class().replace_tokens(devices)
+        transaction.on_commit(partial(
+            mfa_bulk_updated.send, sender=__name__, plugin=plugin,
+            devices=devices))
+        return {plugin.slug: len(devices)}
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from functools import partial
+
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from ...registry import registry
+from ...signals import mfa_bulk_removed
+from ..bulk import BulkUserCommand
+
+
+class Command(BulkUserCommand):
+    help = 'Remove the MFA devices of users.'
+    chunk_options = ('plugins',)
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--plugin', action='append', dest='plugins', default=[],
+            help='Remove the devices of the plugin slug, can be repeated '
+                 '(default: all plugins).')
+
+    def get_plugins(self, slugs):
+        if not slugs:
+            return registry.plugins()
+        try:
+            return [registry.get_plugin(slug) for slug in slugs]
+        except KeyError as e:
+            raise CommandError('Unknown plugin {}.'.format(e))
+
+    def get_confirmation(self, user_ids, options):
+        plugins = self.get_plugins(options['plugins'])
+        return 'Remove the {} devices of {}?'.format(
+            ', '.join(plugin.slug for plugin in plugins),
+            'all users' if user_ids is None else '{} users'.format(
+                len(user_ids)))
+
+    def handle(self, *args, **options):
+        if not (options['plugins'] or options['users']
+                or options['users_file']):
+            raise CommandError(
+                'Select the devices with --plugin, --user or --users-file.')
+        self.get_plugins(options['plugins'])
+        super().handle(*args, **options)
+
+    def process_chunk(self, user_ids, plugins):
+        removed = {}
+        for plugin in self.get_plugins(plugins):
+            devices = list(plugin.model.objects.filter(user_id__in=user_ids))
+            if not devices:
+                continue
+            plugin.model.objects.filter(
+                pk__in=[device.pk for device in devices]).delete()
+            transaction.on_commit(partial(
+                mfa_bulk_removed.send, sender=__name__, plugin=plugin,
+                devices=devices))
+            removed[plugin.slug] = len(devices)
+        return removed
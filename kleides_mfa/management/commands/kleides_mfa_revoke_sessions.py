@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ...conf import app_settings
+from ...session_index import revoke_sessions
+
+
+class Command(BaseCommand):
+    help = 'End the sessions of a user or of a device.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, help='End the sessions of the user id.')
+        parser.add_argument(
+            '--device', dest='persistent_id',
+            help='End the sessions verified with the device persistent id, '
+                 'such as otp_totp.totpdevice/1.')
+
+    def handle(self, user, persistent_id, **options):
+        if not app_settings.KLEIDES_MFA_SESSION_INDEX:
+            raise CommandError('KLEIDES_MFA_SESSION_INDEX is not enabled.')
+        if user is None and persistent_id is None:
+            raise CommandError('Select the sessions with --user or --device.')
+        if user is not None:
+            User = get_user_model()
+            try:
+                user = User.objects.get(pk=user)
+            except User.DoesNotExist:
+                raise CommandError('User {} does not exist.'.format(user))
+        count = revoke_sessions(user=user, persistent_id=persistent_id)
+        self.stdout.write('Ended {} session(s).'.format(count))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+'''
+Timing metrics of the device lookups and token verifications by plugin.
+
+The measurements are passed to the sink of ``KLEIDES_MFA_METRICS_SINK``.
+The PrometheusSink keeps histograms and counters in the process and renders
+them in the Prometheus text format with the MetricsView. The StatsdSink sends
+timers and counters over UDP to a statsd server.
+'''
+from contextlib import contextmanager
+import bisect
+import math
+import socket
+import threading
+import time
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from django.views.generic import View
+
+from .conf import app_settings
+
+__all__ = [
+    'MetricsView', 'PrometheusSink', 'StatsdSink', 'get_sink', 'timer']
+
+OPERATIONS = {
+    'device_lookup': 'Device lookups by plugin.',
+    'device_list': 'Device list queries by plugin.',
+    'verify': 'Token verifications by plugin.',
+}
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+class PrometheusSink():
+    '''
+    Histograms of the duration and counters of the results in the process.
+    '''
+    buckets = (
+        0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+        math.inf)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (operation, plugin) -> [bucket counts, sum, count]
+        self._histograms = {}
+        # (operation, plugin, result) -> count
+        self._counters = {}
+
+    def record(self, operation, plugin, seconds, success):
+        result = 'success' if success else 'failure'
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                (operation, plugin), [[0] * len(self.buckets), 0.0, 0])
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            key = (operation, plugin, result)
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _format_bucket(self, bucket):
+        return '+Inf' if bucket == math.inf else repr(float(bucket))
+
+    def render(self):
+        '''
+        Return the metrics in the Prometheus text exposition format.
+        '''
+        with self._lock:
+            histograms = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for operation, help_text in OPERATIONS.items():
+            name = 'kleides_mfa_{}_seconds'.format(operation)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (key_operation, plugin), (counts, total, count) in sorted(
+                    histograms.items()):
+                if key_operation != operation:
+                    continue
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{{plugin="{}",le="{}"}} {}'.format(
+                        name, plugin, self._format_bucket(bucket),
+                        cumulative))
+                lines.append('{}_sum{{plugin="{}"}} {!r}'.format(
+                    name, plugin, total))
+                lines.append('{}_count{{plugin="{}"}} {}'.format(
+                    name, plugin, count))
+
+            name = 'kleides_mfa_{}_total'.format(operation)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            for (key_operation, plugin, result), count in sorted(
+                    counters.items()):
+                if key_operation == operation:
+                    lines.append(
+                        '{}{{plugin="{}",result="{}"}} {}'.format(
+                            name, plugin, result, count))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdSink():
+    '''
+    Send the timers and counters to ``KLEIDES_MFA_METRICS_STATSD_ADDRESS``.
+    '''
+    prefix = 'kleides_mfa'
+
+    def __init__(self):
+        self.address = app_settings.KLEIDES_MFA_METRICS_STATSD_ADDRESS
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, operation, plugin, seconds, success):
+        name = '{}.{}.{}'.format(self.prefix, operation, plugin)
+        result = 'success' if success else 'failure'
+        data = '{}:{:.3f}|ms\n{}.{}:1|c'.format(
+            name, seconds * 1000, name, result)
+        try:
+            self.socket.sendto(data.encode(), self.address)
+        except OSError:
+            # Metrics must never break a login.
+            pass
+
+
+def get_sink():
+    '''
+    Return the sink instance of ``KLEIDES_MFA_METRICS_SINK`` or None.
+    '''
+    global _sink
+    if not app_settings.KLEIDES_MFA_METRICS_SINK:
+        return None
+    with _sink_lock:
+        if _sink is None:
+            _sink = import_string(app_settings.KLEIDES_MFA_METRICS_SINK)()
+        return _sink
+
+
+@receiver(setting_changed)
+def clear_sink(setting, **kwargs):
+    global _sink
+    if setting.startswith('KLEIDES_MFA_METRICS_'):
+        with _sink_lock:
+            _sink = None
+
+
+class _Timer():
+    def __init__(self):
+        self.success = False
+
+
+@contextmanager
+def timer(operation, plugin):
+    '''
+    Measure the duration of the block. Set ``success`` on the returned timer
+    to record a successful result. Exceptions are recorded as failures.
+    '''
+    sink = get_sink()
+    result = _Timer()
+    if sink is None:
+        yield result
+        return
+
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        sink.record(
+            operation, plugin.slug, time.perf_counter() - start,
+            result.success)
+
+
+class MetricsView(View):
+    '''
+    Render the metrics of the PrometheusSink.
+    Restrict the access to this view to the Prometheus server.
+    '''
+    def get(self, request, *args, **kwargs):
+        sink = get_sink()
+        if not isinstance(sink, PrometheusSink):
+            return HttpResponse(
+                'The metrics sink is not a PrometheusSink', status=404,
+                content_type='text/plain')
+        return HttpResponse(
+            sink.render(), content_type='text/plain; version=0.0.4')
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 import functools
 
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async)
 from django.utils.functional import SimpleLazyObject
 
 from django_otp import DEVICE_ID_SESSION_KEY
 from django_otp.models import Device
 
+from .query_budget import REQUEST_USER, count_queries, query_budget_enabled
+from .routers import pin_request, pin_response
+from .utils import aget_session, apop_session
+
 
 class KleidesAuthenticationMiddleware(object):
     """
@@ -21,17 +27,52 @@ class KleidesAuthenticationMiddleware(object):
     populates ``request.user.otp_device`` to the
     :class:`~django_otp.models.Device` object that has verified the user,
     or ``None`` if the user has not been verified.
+
+    This middleware is async capable. It wraps ``request.auser()`` similarly
+    to ``request.user``.
     """
+    sync_capable = True
+    async_capable = True
+    query_budget = REQUEST_USER
+
     def __init__(self, get_response=None):
         self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+
+        self._install_lazy_accessors(request)
+        pin_request(request)
+        return pin_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        self._install_lazy_accessors(request)
+        pin_request(request)
+        return pin_response(request, await self.get_response(request))
+
+    def _install_lazy_accessors(self, request):
         user = getattr(request, 'user', None)
         if user is not None:
+            verify_user = self._verify_user
+            if query_budget_enabled():
+                verify_user = self._verify_user_within_budget
             request.user = SimpleLazyObject(
-                functools.partial(self._verify_user, request, user))
+                functools.partial(verify_user, request, user))
+
+        auser = getattr(request, 'auser', None)
+        if auser is not None:
+            request.auser = functools.partial(
+                self._averify_user, request, auser)
 
-        return self.get_response(request)
+    def _verify_user_within_budget(self, request, user):
+        with count_queries() as queries:
+            user = self._verify_user(request, user)
+        self.query_budget.check(len(queries), type(self).__name__)
+        return user
 
     def _verify_user(self, request, user):
         """
@@ -53,3 +94,66 @@ class KleidesAuthenticationMiddleware(object):
         user.otp_device = device
 
         return user
+
+    async def _averify_user(self, request, auser):
+        """
+        Sets OTP-related fields on the user returned by ``request.auser()``.
+        The result is cached on the request.
+        """
+        if hasattr(request, '_kleides_mfa_acached_user'):
+            return request._kleides_mfa_acached_user
+
+        user = await auser()
+        device = None
+
+        if user.is_single_factor_authenticated:
+            persistent_id = await aget_session(
+                request.session, DEVICE_ID_SESSION_KEY)
+            if persistent_id:
+                if hasattr(Device, 'afrom_persistent_id'):
+                    device = await Device.afrom_persistent_id(persistent_id)
+                else:  # pragma: no cover
+                    device = await sync_to_async(Device.from_persistent_id)(
+                        persistent_id)
+                # Ensure the device belongs to the user.
+                if device is not None and device.user_id != user.pk:
+                    device = None
+
+            if device is None:
+                await apop_session(request.session, DEVICE_ID_SESSION_KEY)
+
+        user.otp_device = device
+        request._kleides_mfa_acached_user = user
+
+        return user
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Check the queries of a kleides_mfa view, including the rendering of its
+    template response, against the ``query_budget`` of the view when query
+    budgets are enabled.
+
+    Install this middleware last so only the queries of the view are counted.
+    The queries of async views run in other threads and are not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._is_async or not query_budget_enabled():
+            return self.get_response(request)
+
+        with count_queries() as queries:
+            response = self.get_response(request)
+        view_budget = getattr(request, '_kleides_mfa_query_budget', None)
+        if view_budget is not None:
+            query_budget, name = view_budget
+            query_budget.check(len(queries), name)
+        return response
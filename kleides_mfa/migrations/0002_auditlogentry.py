@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kleides_mfa', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='created')),
+                ('action', models.CharField(choices=[('added', 'Added'), ('removed', 'Removed'), ('verified', 'Verified'), ('failed', 'Verification failed')], max_length=16, verbose_name='action')),
+                ('plugin', models.CharField(max_length=64, verbose_name='plugin')),
+                ('persistent_id', models.CharField(max_length=255, verbose_name='persistent id')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='IP address')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'audit log entry',
+                'verbose_name_plural': 'audit log entries',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kleides_mfa', '0002_auditlogentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserMfaStatus',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='mfa_status', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+                ('plugins', models.PositiveBigIntegerField(default=0, verbose_name='plugins')),
+                ('device_count', models.PositiveIntegerField(default=0, verbose_name='device count')),
+                ('last_verified', models.DateTimeField(blank=True, null=True, verbose_name='last verified')),
+            ],
+            options={
+                'verbose_name': 'user MFA status',
+                'verbose_name_plural': 'user MFA statuses',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kleides_mfa', '0003_usermfastatus'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('persistent_id', models.CharField(db_index=True, max_length=255, verbose_name='persistent id')),
+                ('session_key', models.CharField(max_length=40, verbose_name='session key')),
+                ('expires', models.DateTimeField(db_index=True, verbose_name='expires')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'device session',
+                'verbose_name_plural': 'device sessions',
+                'constraints': [models.UniqueConstraint(fields=('session_key', 'persistent_id'), name='kleides_mfa_devicesession_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def clear_delivered_next_attempt(apps, schema_editor):
+    # The delivered events are not attempted again.
+    OutboxEvent = apps.get_model('kleides_mfa', 'OutboxEvent')
+    OutboxEvent.objects.using(schema_editor.connection.alias).filter(
+        delivered__isnull=False).update(next_attempt=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kleides_mfa', '0004_devicesession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='attempts'),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='last_error',
+            field=models.TextField(blank=True, verbose_name='last error'),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True, verbose_name='next attempt'),
+        ),
+        migrations.RunPython(
+            clear_delivered_next_attempt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+def plugin_bits_to_slugs(apps, schema_editor):
+    # The bits were the positions of the slugs in the plugin priority.
+    from kleides_mfa.conf import app_settings
+    priority = app_settings.KLEIDES_MFA_PLUGIN_PRIORITY
+    UserMfaStatus = apps.get_model('kleides_mfa', 'UserMfaStatus')
+    statuses = UserMfaStatus.objects.using(schema_editor.connection.alias)
+    for plugin_bits in statuses.values_list(
+            'plugin_bits', flat=True).distinct():
+        slugs = [
+            slug for bit, slug in enumerate(priority)
+            if plugin_bits & (1 << bit)]
+        statuses.filter(plugin_bits=plugin_bits).update(
+            plugins=',{},'.format(','.join(slugs)) if slugs else '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kleides_mfa', '0005_outboxevent_attempts'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='usermfastatus',
+            old_name='plugins',
+            new_name='plugin_bits',
+        ),
+        migrations.AddField(
+            model_name='usermfastatus',
+            name='plugins',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='plugins'),
+        ),
+        migrations.RunPython(plugin_bits_to_slugs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='usermfastatus',
+            name='plugin_bits',
+        ),
+    ]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class OutboxEvent(models.Model):
+    '''
+    An event stored by the OutboxEventDispatcher for deferred delivery.
+    Undelivered events without a next attempt failed the maximum attempts.
+    '''
+    name = models.CharField(_('name'), max_length=32)
+    payload = models.JSONField(_('payload'), encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(_('created'), default=timezone.now)
+    delivered = models.DateTimeField(
+        _('delivered'), blank=True, null=True, db_index=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    next_attempt = models.DateTimeField(
+        _('next attempt'), blank=True, null=True, default=timezone.now,
+        db_index=True)
+    last_error = models.TextField(_('last error'), blank=True)
+
+    class Meta:
+        verbose_name = _('outbox event')
+        verbose_name_plural = _('outbox events')
+
+    def __str__(self):
+        return '{} {}'.format(self.name, self.created.isoformat())
+
+
+class AuditLogEntry(models.Model):
+    '''
+    A device enrollment, deletion or verification of a user.
+    '''
+    ADDED = 'added'
+    REMOVED = 'removed'
+    VERIFIED = 'verified'
+    FAILED = 'failed'
+    ACTION_CHOICES = (
+        (ADDED, _('Added')),
+        (REMOVED, _('Removed')),
+        (VERIFIED, _('Verified')),
+        (FAILED, _('Verification failed')),
+    )
+
+    created = models.DateTimeField(
+        _('created'), default=timezone.now, db_index=True)
+    action = models.CharField(
+        _('action'), max_length=16, choices=ACTION_CHOICES)
+    plugin = models.CharField(_('plugin'), max_length=64)
+    persistent_id = models.CharField(_('persistent id'), max_length=255)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, verbose_name=_('user'), blank=True,
+        null=True, on_delete=models.SET_NULL, related_name='+')
+    ip_address = models.GenericIPAddressField(
+        _('IP address'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('audit log entry')
+        verbose_name_plural = _('audit log entries')
+
+    def __str__(self):
+        return '{} {} {}'.format(
+            self.created.isoformat(), self.action, self.persistent_id)
+
+
+class UserMfaStatus(models.Model):
+    '''
+    The confirmed devices of a user, maintained when
+    ``KLEIDES_MFA_USER_STATUS`` is enabled.
+
+    ``plugins`` holds the plugin slugs enclosed in commas, such as
+    ``,totp,recovery-code,``.
+    '''
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, verbose_name=_('user'), primary_key=True,
+        on_delete=models.CASCADE, related_name='mfa_status')
+    plugins = models.CharField(
+        _('plugins'), max_length=255, blank=True, default='')
+    device_count = models.PositiveIntegerField(_('device count'), default=0)
+    last_verified = models.DateTimeField(
+        _('last verified'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('user MFA status')
+        verbose_name_plural = _('user MFA statuses')
+
+    def __str__(self):
+        return '{} {}'.format(self.user_id, ','.join(self.plugin_slugs))
+
+    @property
+    def plugin_slugs(self):
+        return [slug for slug in self.plugins.split(',') if slug]
+
+
+class DeviceSession(models.Model):
+    '''
+    A session that was verified with a device, maintained when
+    ``KLEIDES_MFA_SESSION_INDEX`` is enabled.
+    '''
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, verbose_name=_('user'),
+        on_delete=models.CASCADE, related_name='+')
+    persistent_id = models.CharField(
+        _('persistent id'), max_length=255, db_index=True)
+    # Indexed by the unique constraint.
+    session_key = models.CharField(_('session key'), max_length=40)
+    expires = models.DateTimeField(_('expires'), db_index=True)
+
+    class Meta:
+        verbose_name = _('device session')
+        verbose_name_plural = _('device sessions')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session_key', 'persistent_id'],
+                name='kleides_mfa_devicesession_unique'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.persistent_id, self.session_key)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Delete the unconfirmed devices that were abandoned during the setup.
+
+:func:`purge_unconfirmed_devices` can be called by a periodic task, such as
+a Celery beat task or a cron job, or by the ``kleides_mfa_purge_devices``
+command.
+'''
+from datetime import timedelta
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import bump_device_list_version
+from .conf import app_settings
+from .registry import registry
+from .status import deferred_status_updates
+
+__all__ = ['purge_unconfirmed_devices']
+
+
+def _bump_device_list_versions(user_ids):
+    for user_id in user_ids:
+        bump_device_list_version(user_id)
+
+
+def _purge_batch(model, cutoff, batch_size):
+    '''
+    Delete a batch of unconfirmed devices, returns the number of deleted
+    devices.
+    '''
+    with transaction.atomic(), deferred_status_updates():
+        devices = list(
+            model.objects.filter(
+                Q(created_at__lt=cutoff) | Q(created_at__isnull=True),
+                confirmed=False)
+            .order_by('pk').values_list('pk', 'user_id')[:batch_size])
+        if not devices:
+            return 0
+        # The device could be confirmed after the select.
+        model.objects.filter(
+            pk__in=[pk for pk, user_id in devices], confirmed=False).delete()
+        transaction.on_commit(partial(
+            _bump_device_list_versions,
+            {user_id for pk, user_id in devices}))
+    return len(devices)
+
+
+def purge_unconfirmed_devices(days=None, batch_size=1000):
+    '''
+    Delete the unconfirmed devices of the registered plugins that were
+    created more than ``days`` ago, ``KLEIDES_MFA_PURGE_UNCONFIRMED_DAYS`` by
+    default, with a transaction per batch. Devices of models without a
+    ``created_at`` field are not deleted.
+
+    Returns a dictionary of plugin slug to the number of deleted devices or
+    None when the model has no ``created_at`` field.
+    '''
+    if days is None:
+        days = app_settings.KLEIDES_MFA_PURGE_UNCONFIRMED_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    purged = {}
+    for plugin in registry.plugins():
+        try:
+            plugin.model._meta.get_field('created_at')
+        except FieldDoesNotExist:
+            purged[plugin.slug] = None
+            continue
+        purged[plugin.slug] = 0
+        while True:
+            count = _purge_batch(plugin.model, cutoff, batch_size)
+            purged[plugin.slug] += count
+            if count < batch_size:
+                break
+    return purged
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+Query budgets of the kleides_mfa views and middleware.
+
+A budget is the maximum number of queries of a view, scaled by the number of
+registered plugins. Budgets are checked by the ``QueryBudgetMiddleware`` when
+``settings.DEBUG`` is enabled and ``KLEIDES_MFA_QUERY_BUDGET`` is ``'warn'``
+or ``'raise'``. The view budgets are the sum of the budgets of their stages.
+'''
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+import warnings
+
+from django.conf import settings
+from django.db import connections
+
+from .conf import app_settings
+from .registry import registry
+
+__all__ = [
+    'LOGIN_USER', 'QueryBudget', 'QueryBudgetExceeded', 'QueryBudgetWarning',
+    'REQUEST_USER', 'SESSION_INDEX', 'SESSION_LOGIN', 'TOKEN_VERIFICATION',
+    'USER_DEVICES', 'count_queries', 'query_budget_enabled']
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudgetWarning(RuntimeWarning):
+    pass
+
+
+class QueryBudget(namedtuple('QueryBudget', ('queries', 'per_plugin'))):
+    '''
+    The maximum queries plus the maximum queries per registered plugin.
+    '''
+    def __new__(cls, queries, per_plugin=0):
+        return super().__new__(cls, queries, per_plugin)
+
+    def __add__(self, other):
+        return QueryBudget(
+            self.queries + other.queries, self.per_plugin + other.per_plugin)
+
+    def limit(self):
+        if not self.per_plugin:
+            return self.queries
+        return self.queries + self.per_plugin * len(tuple(registry.plugins()))
+
+    def check(self, count, name):
+        '''
+        Warn or raise when the count exceeds the budget.
+        '''
+        limit = self.limit()
+        if count <= limit:
+            return
+        message = '{} executed {} queries, the budget is {}'.format(
+            name, count, limit)
+        if app_settings.KLEIDES_MFA_QUERY_BUDGET == 'raise':
+            raise QueryBudgetExceeded(message)
+        warnings.warn(message, QueryBudgetWarning, stacklevel=2)
+
+
+# The session, user and device of the KleidesAuthenticationMiddleware.
+REQUEST_USER = QueryBudget(3)
+# The user of the login credentials.
+LOGIN_USER = QueryBudget(1)
+# The devices of the user, a query per plugin.
+USER_DEVICES = QueryBudget(0, per_plugin=1)
+# The token verification, such as deleting the used recovery code and the
+# throttling update of the device.
+TOKEN_VERIFICATION = QueryBudget(3)
+# The Django login, cycling the session key and updating last_login.
+SESSION_LOGIN = QueryBudget(7)
+# The session index entry and pruning the expired entries.
+SESSION_INDEX = QueryBudget(5)
+
+
+def query_budget_enabled():
+    return bool(settings.DEBUG and app_settings.KLEIDES_MFA_QUERY_BUDGET)
+
+
+class _QueryCounter():
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return self.count
+
+
+@contextmanager
+def count_queries():
+    '''
+    Count the queries of all database connections within the context.
+    '''
+    counter = _QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple
+import threading
+
+from asgiref.sync import sync_to_async
 
 from django.forms import modelform_factory
+from django.utils.module_loading import import_string
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
 from .conf import app_settings
-from .forms import DeviceDeleteForm, DeviceUpdateForm
+from .metrics import timer
 
 __all__ = ['registry']
 
 KleidesPluginDevices = namedtuple('KleidesPluginDevices', 'plugin devices')
 KleidesPluginDevice = namedtuple('KleidesPluginDevice', 'plugin device')
+KleidesPluginFormClasses = namedtuple(
+    'KleidesPluginFormClasses', 'plugin form_classes')
 
 
 class AlreadyRegistered(Exception):
@@ -19,12 +25,17 @@ class AlreadyRegistered(Exception):
 
 
 class KleidesMfaPlugin():
+    '''
+    A device model and its forms. The form classes can be dotted paths that
+    are imported on first use to keep the forms out of the startup.
+    '''
     def __init__(
             self, name, model, create_form_class=None, delete_form_class=None,
             update_form_class=None, verify_form_class=None,
             show_create_button=True, create_message=None, update_message=None,
             delete_message=None, show_verify_button=True,
-            device_list_javascript=None, device_list_template=None):
+            device_list_javascript=None, device_list_template=None,
+            cache_device_list=False):
         self.slug = slugify(name)
         self.name = name
         self.model = model
@@ -37,8 +48,13 @@ class KleidesMfaPlugin():
         self.delete_message = delete_message
         self.device_list_javascript = device_list_javascript
         self.device_list_template = device_list_template
+        # Only device list templates without forms or secrets can be cached.
+        self.cache_device_list = cache_device_list
         self.show_create_button = show_create_button
         self.show_verify_button = show_verify_button
+        # Generated model form classes by form type.
+        self._model_form_classes = {}
+        self._model_form_classes_lock = threading.Lock()
 
     def __str__(self):
         return self.name
@@ -47,23 +63,61 @@ class KleidesMfaPlugin():
         return 'KleidesMfaPlugin(name={!r}, model={!r})'.format(
             self.name, self.model)
 
+    def _get_model_form_class(self, form_type, **kwargs):
+        '''
+        Return a model form class for the plugin model that is created once
+        on first use.
+        '''
+        form_class = self._model_form_classes.get(form_type)
+        if form_class is None:
+            with self._model_form_classes_lock:
+                form_class = self._model_form_classes.get(form_type)
+                if form_class is None:
+                    form_class = modelform_factory(self.model, **kwargs)
+                    self._model_form_classes[form_type] = form_class
+        return form_class
+
+    def _resolve_form_class(self, attribute):
+        '''
+        Return the form class of the attribute, importing a dotted path once.
+        '''
+        form_class = getattr(self, attribute)
+        if isinstance(form_class, str):
+            form_class = import_string(form_class)
+            setattr(self, attribute, form_class)
+        return form_class
+
     def get_create_form_class(self):
-        return self.create_form_class
+        return self._resolve_form_class('create_form_class')
 
     def get_delete_form_class(self):
         if self.delete_form_class is None:
-            return modelform_factory(
-                self.model, form=DeviceDeleteForm, fields=())
-        return self.delete_form_class
+            from .forms import DeviceDeleteForm
+            return self._get_model_form_class(
+                'delete', form=DeviceDeleteForm, fields=())
+        return self._resolve_form_class('delete_form_class')
 
     def get_update_form_class(self):
         if self.update_form_class is None:
-            return modelform_factory(
-                self.model, form=DeviceUpdateForm, fields=('name',))
-        return self.update_form_class
+            from .forms import DeviceUpdateForm
+            return self._get_model_form_class(
+                'update', form=DeviceUpdateForm, fields=('name',))
+        return self._resolve_form_class('update_form_class')
 
     def get_verify_form_class(self):
-        return self.verify_form_class
+        return self._resolve_form_class('verify_form_class')
+
+    def get_form_classes(self):
+        '''
+        Return a dict of the resolved form classes by form type.
+        Form types the plugin does not support are None.
+        '''
+        return {
+            'create': self.get_create_form_class(),
+            'delete': self.get_delete_form_class(),
+            'update': self.get_update_form_class(),
+            'verify': self.get_verify_form_class(),
+        }
 
     def get_create_message(self, device):
         if self.create_message is not None:
@@ -87,13 +141,28 @@ class KleidesMfaPlugin():
         return message.format(plugin=self.name, name=device.name)
 
     def get_user_device(self, device_id, user, confirmed=True):
-        return self.model.objects.devices_for_user(user, confirmed).get(
-            pk=device_id)
+        with timer('device_lookup', self) as lookup_timer:
+            device = self.model.objects.devices_for_user(user, confirmed).get(
+                pk=device_id)
+            lookup_timer.success = True
+        return device
 
     def get_user_devices(self, user, confirmed=True):
-        devices = []
-        for device in self.model.objects.devices_for_user(user, confirmed):
-            devices.append(device)
+        with timer('device_list', self) as list_timer:
+            devices = list(
+                self.model.objects.devices_for_user(user, confirmed))
+            list_timer.success = True
+        return devices
+
+    async def aget_user_devices(self, user, confirmed=True):
+        with timer('device_list', self) as list_timer:
+            queryset = self.model.objects.devices_for_user(user, confirmed)
+            if hasattr(queryset, '__aiter__'):
+                devices = [device async for device in queryset]
+            else:
+                # Django < 4.1 has no async queryset iteration.
+                devices = await sync_to_async(list)(queryset)
+            list_timer.success = True
         return devices
 
 
@@ -103,18 +172,23 @@ class KleidesMfaPluginRegistry():
     '''
     def __init__(self):
         self._registry = {}  # plugin.slug -> plugin
+        # The sorted plugins and the plugin priority used to sort them.
+        self._plugins = None, ()
 
     def register_plugin(self, plugin):
         if plugin.slug in self._registry:
             raise AlreadyRegistered(
                 'Plugin with slug {} already registered'.format(plugin.slug))
         self._registry[plugin.slug] = plugin
+        self._plugins = None, ()
 
     def register(self, *args, **kwargs):
         self.register_plugin(KleidesMfaPlugin(*args, **kwargs))
 
     def unregister(self, name_or_slug):
-        return self._registry.pop(slugify(name_or_slug))
+        plugin = self._registry.pop(slugify(name_or_slug))
+        self._plugins = None, ()
+        return plugin
 
     def get_plugin(self, slug):
         return self._registry[slug]
@@ -123,16 +197,62 @@ class KleidesMfaPluginRegistry():
         '''
         Return an iterable of registered plugins in settings.PLUGIN_PRIORITY.
         '''
-        for slug in app_settings.KLEIDES_MFA_PLUGIN_PRIORITY:
-            if slug in self._registry:
-                yield self._registry[slug]
+        priority = app_settings.KLEIDES_MFA_PLUGIN_PRIORITY
+        sorted_priority, plugins = self._plugins
+        if sorted_priority is not priority:
+            plugins = tuple(
+                self._registry[slug] for slug in priority
+                if slug in self._registry)
+            self._plugins = priority, plugins
+        return iter(plugins)
+
+    def form_classes(self):
+        '''
+        Return a list of the plugins with their resolved form classes.
+        This can be used to prepare the generated form classes at startup.
+        '''
+        return [
+            KleidesPluginFormClasses(plugin, plugin.get_form_classes())
+            for plugin in self.plugins()]
+
+    def _status_queryset(self, user, confirmed):
+        # A device count of the UserMfaStatus replaces the plugin queries.
+        if not confirmed or not app_settings.KLEIDES_MFA_USER_STATUS:
+            return None
+        from .models import UserMfaStatus
+        return UserMfaStatus.objects.filter(user_id=user.pk).values_list(
+            'device_count', flat=True)
 
     def user_has_device(self, user, confirmed=True):
+        status_queryset = self._status_queryset(user, confirmed)
+        if status_queryset is not None:
+            # Only a positive device count is trusted, a count of 0 is stale
+            # when devices were added without signals. A positive count is
+            # stale when devices were removed without signals, the user is
+            # then refused the setup views instead of being let in without a
+            # verification, until kleides_mfa_rebuild_status is run.
+            if (status_queryset.first() or 0) > 0:
+                return True
         for plugin in self.plugins():
             if plugin.get_user_devices(user, confirmed):
                 return True
         return False
 
+    async def auser_has_device(self, user, confirmed=True):
+        status_queryset = self._status_queryset(user, confirmed)
+        if status_queryset is not None:
+            # See user_has_device for the trusted device counts.
+            if hasattr(status_queryset, 'afirst'):
+                device_count = await status_queryset.afirst()
+            else:
+                device_count = await sync_to_async(status_queryset.first)()
+            if (device_count or 0) > 0:
+                return True
+        for plugin in self.plugins():
+            if await plugin.aget_user_devices(user, confirmed):
+                return True
+        return False
+
     def plugins_with_user_devices(self, user, confirmed=True):
         '''
         Return an iterable of the plugins with devices registered by the user.
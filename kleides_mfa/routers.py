@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+'''
+Route the reads of the device tables to a replica database.
+
+The device tables are the tables of the apps of the registered plugin
+models. Reads go to the ``KLEIDES_MFA_REPLICA_DATABASE`` until the request
+writes to a device table or is pinned with :func:`pin_primary`, then the
+request reads its own writes from the primary database. Writes always go to
+the primary database. A cookie pins the next requests of the browser for
+``KLEIDES_MFA_REPLICA_PIN_SECONDS`` to read past the replication lag.
+'''
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .conf import app_settings
+from .registry import registry
+
+__all__ = [
+    'ReplicaRouter', 'is_pinned', 'pin_primary', 'pin_request',
+    'pin_response', 'unpin']
+
+PIN_COOKIE_NAME = 'kleides_mfa_primary'
+# Requests pinned by the cookie do not extend the cookie.
+_PINNED_BY_COOKIE = 'cookie'
+
+_pinned = contextvars.ContextVar('kleides_mfa_pinned', default=False)
+
+
+def pin_primary():
+    '''
+    Read the device tables from the primary database for the rest of the
+    request.
+    '''
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def unpin(**kwargs):
+    '''
+    Signal handler connected to request_started and request_finished.
+    '''
+    _pinned.set(False)
+
+
+def pin_request(request):
+    '''
+    Pin the request when the browser wrote to the device tables recently.
+    '''
+    if (app_settings.KLEIDES_MFA_REPLICA_DATABASE
+            and PIN_COOKIE_NAME in request.COOKIES):
+        _pinned.set(_PINNED_BY_COOKIE)
+
+
+def pin_response(request, response):
+    '''
+    Set the pin cookie when the request wrote to the device tables or was
+    pinned with :func:`pin_primary`.
+    '''
+    seconds = app_settings.KLEIDES_MFA_REPLICA_PIN_SECONDS
+    if (app_settings.KLEIDES_MFA_REPLICA_DATABASE and seconds
+            and _pinned.get() is True):
+        response.set_cookie(
+            PIN_COOKIE_NAME, '1', max_age=seconds,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+            samesite='Lax')
+    return response
+
+
+def is_device_model(model):
+    return any(
+        model._meta.app_label == plugin.model._meta.app_label
+        for plugin in registry.plugins())
+
+
+class ReplicaRouter():
+    '''
+    Add to ``settings.DATABASE_ROUTERS`` to route the device reads to the
+    ``KLEIDES_MFA_REPLICA_DATABASE``.
+    '''
+    def db_for_read(self, model, **hints):
+        replica = app_settings.KLEIDES_MFA_REPLICA_DATABASE
+        if replica and not _pinned.get() and is_device_model(model):
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        if app_settings.KLEIDES_MFA_REPLICA_DATABASE and is_device_model(
+                model):
+            # Devices read from the replica are saved to the primary.
+            pin_primary()
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        replica = app_settings.KLEIDES_MFA_REPLICA_DATABASE
+        if replica and {obj1._state.db, obj2._state.db} <= {
+                DEFAULT_DB_ALIAS, replica}:
+            return True
+        return None
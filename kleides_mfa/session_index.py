@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Index the sessions by the user and the device they were verified with.
+
+When ``KLEIDES_MFA_SESSION_INDEX`` is enabled a ``DeviceSession`` is stored
+when a session is logged in with a device and removed on logout. The
+sessions of a lost device or user are ended with :func:`revoke_sessions`
+without decoding all sessions.
+
+The expiry of a session is extended while it is used, the index entries of
+expired sessions are therefore checked against the session store before
+they are removed. A few entries are pruned with every new entry.
+'''
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db, db
+from django.core.cache import caches
+from django.utils import timezone
+
+from .conf import app_settings
+
+__all__ = ['index_session', 'prune_sessions', 'revoke_sessions']
+
+PRUNE_BATCH_SIZE = 10
+
+
+def _session_store():
+    return import_module(settings.SESSION_ENGINE).SessionStore
+
+
+def _existing_session_keys(session_keys):
+    SessionStore = _session_store()
+    if issubclass(SessionStore, db.SessionStore):
+        return set(SessionStore.get_model_class().objects.filter(
+            session_key__in=session_keys,
+            expire_date__gt=timezone.now()).values_list(
+                'session_key', flat=True))
+    return {key for key in session_keys if SessionStore().exists(key)}
+
+
+def _delete_sessions(session_keys):
+    SessionStore = _session_store()
+    if not issubclass(SessionStore, db.SessionStore):
+        for key in session_keys:
+            SessionStore().delete(key)
+        return
+    SessionStore.get_model_class().objects.filter(
+        session_key__in=session_keys).delete()
+    if issubclass(SessionStore, cached_db.SessionStore):
+        caches[settings.SESSION_CACHE_ALIAS].delete_many([
+            cached_db.KEY_PREFIX + key for key in session_keys])
+
+
+def prune_sessions(batch_size=PRUNE_BATCH_SIZE):
+    '''
+    Remove the index entries of up to batch_size expired sessions that no
+    longer exist. The expiry of sessions that still exist is extended.
+    Returns the number of removed entries.
+    '''
+    from .models import DeviceSession
+    now = timezone.now()
+    entries = dict(
+        DeviceSession.objects.filter(expires__lt=now).order_by('expires')
+        .values_list('pk', 'session_key')[:batch_size])
+    if not entries:
+        return 0
+    existing = _existing_session_keys(set(entries.values()))
+    DeviceSession.objects.filter(pk__in=[
+        pk for pk, key in entries.items() if key in existing]).update(
+            expires=now + timedelta(seconds=settings.SESSION_COOKIE_AGE))
+    count, deleted = DeviceSession.objects.filter(pk__in=[
+        pk for pk, key in entries.items() if key not in existing]).delete()
+    return count
+
+
+def index_session(request, device):
+    '''
+    Add the session of the request that was verified with the device.
+    '''
+    if not app_settings.KLEIDES_MFA_SESSION_INDEX:
+        return
+    from .models import DeviceSession
+    session = request.session
+    if session.session_key is None:
+        session.save()
+    DeviceSession.objects.bulk_create([DeviceSession(
+        user_id=device.user_id, persistent_id=device.persistent_id,
+        session_key=session.session_key,
+        expires=session.get_expiry_date())], ignore_conflicts=True)
+    prune_sessions()
+
+
+def session_ended(sender, request, user, **kwargs):
+    '''
+    Signal handler connected to user_logged_out.
+    '''
+    if (not app_settings.KLEIDES_MFA_SESSION_INDEX or request is None
+            or request.session.session_key is None):
+        return
+    from .models import DeviceSession
+    DeviceSession.objects.filter(
+        session_key=request.session.session_key).delete()
+
+
+def revoke_sessions(user=None, persistent_id=None):
+    '''
+    End the indexed sessions of the user or the sessions that were verified
+    with the device of the persistent id, the device may be deleted already.
+    Returns the number of ended sessions.
+    '''
+    from .models import DeviceSession
+    if user is None and persistent_id is None:
+        raise ValueError('Revoke the sessions of a user or a device.')
+    entries = DeviceSession.objects.all()
+    if user is not None:
+        entries = entries.filter(user_id=user.pk)
+    if persistent_id is not None:
+        entries = entries.filter(persistent_id=persistent_id)
+    session_keys = set(entries.values_list('session_key', flat=True))
+    if not session_keys:
+        return 0
+    _delete_sessions(session_keys)
+    DeviceSession.objects.filter(session_key__in=session_keys).delete()
+    return len(session_keys)
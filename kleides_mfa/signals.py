@@ -2,3 +2,9 @@ from django.dispatch import Signal
 
 mfa_added = Signal()
 mfa_removed = Signal()
+mfa_updated = Signal()
+
+# Sent once per chunk of the bulk management commands with the plugin and
+# the list of devices instead of a signal per device.
+mfa_bulk_removed = Signal()
+mfa_bulk_updated = Signal()
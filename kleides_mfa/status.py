@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+'''
+The UserMfaStatus of a user in one row instead of a query per plugin.
+
+When ``KLEIDES_MFA_USER_STATUS`` is enabled the status is updated when a
+device of a registered plugin is created, deleted or changes its user or
+confirmation. Queryset updates and deletes do not send signals, rebuild the
+statuses with the ``kleides_mfa_rebuild_status`` command after those.
+
+The signal handlers are connected to the models of the plugins that are
+registered when kleides_mfa is ready. Call :func:`connect_signals` after
+registering a plugin later.
+'''
+from contextlib import contextmanager
+import contextvars
+
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import connections, router
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .conf import app_settings
+from .registry import registry
+
+__all__ = [
+    'connect_signals', 'deferred_status_updates', 'plugins_value',
+    'record_verification', 'update_user_status', 'update_user_statuses',
+    'user_statuses']
+
+STATE_ATTRIBUTE = '_kleides_mfa_status_state'
+
+_deferred_user_ids = contextvars.ContextVar(
+    'kleides_mfa_deferred_user_ids', default=None)
+
+
+def plugins_value(slugs):
+    '''
+    Return the ``UserMfaStatus.plugins`` value of the plugin slugs. The slugs
+    are enclosed in commas so ``plugins__contains=',totp,'`` matches a slug.
+    '''
+    if not slugs:
+        return ''
+    return ',{},'.format(','.join(slugs))
+
+
+def user_statuses(user_ids):
+    '''
+    Return a dictionary of user id to (plugins, device count) of the
+    confirmed devices of the users, with a query per plugin.
+    '''
+    slugs = {user_id: [] for user_id in user_ids}
+    device_counts = dict.fromkeys(user_ids, 0)
+    for plugin in registry.plugins():
+        counts = (
+            plugin.model.objects.filter(user_id__in=user_ids, confirmed=True)
+            .order_by().values_list('user_id').annotate(count=Count('pk')))
+        for user_id, count in counts:
+            slugs[user_id].append(plugin.slug)
+            device_counts[user_id] += count
+    return {
+        user_id: (plugins_value(slugs[user_id]), device_counts[user_id])
+        for user_id in user_ids}
+
+
+def update_user_statuses(user_ids):
+    '''
+    Create or update the statuses of the users with a query per plugin.
+    The last verification time is kept.
+    '''
+    from .models import UserMfaStatus
+    # Skip the users that were deleted.
+    user_ids = list(get_user_model().objects.filter(
+        pk__in=user_ids).values_list('pk', flat=True))
+    statuses = [
+        UserMfaStatus(
+            user_id=user_id, plugins=plugins, device_count=device_count)
+        for user_id, (plugins, device_count) in user_statuses(
+            user_ids).items()]
+    fields = ['plugins', 'device_count']
+    features = connections[router.db_for_write(UserMfaStatus)].features
+    # Django < 4.1 has no upserts.
+    if getattr(features, 'supports_update_conflicts_with_target', False):
+        UserMfaStatus.objects.bulk_create(
+            statuses, update_conflicts=True, unique_fields=['user'],
+            update_fields=fields)
+    elif getattr(features, 'supports_update_conflicts', False):
+        # MySQL and MariaDB update the row of any conflicting unique field.
+        UserMfaStatus.objects.bulk_create(
+            statuses, update_conflicts=True, update_fields=fields)
+    else:
+        # Update the existing statuses and create the others.
+        existing = set(UserMfaStatus.objects.filter(
+            user_id__in=user_ids).values_list('user_id', flat=True))
+        UserMfaStatus.objects.bulk_update(
+            [status for status in statuses if status.user_id in existing],
+            fields)
+        UserMfaStatus.objects.bulk_create(
+            [status for status in statuses
+             if status.user_id not in existing])
+
+
+@contextmanager
+def deferred_status_updates():
+    '''
+    Update the statuses of the changed users once at the end of the block
+    instead of for every device.
+    '''
+    user_ids = set()
+    token = _deferred_user_ids.set(user_ids)
+    try:
+        yield
+    finally:
+        _deferred_user_ids.reset(token)
+    if user_ids:
+        update_user_statuses(user_ids)
+
+
+def update_user_status(user_id, create=True):
+    '''
+    Update the status of the user, create it when ``create`` is True.
+    '''
+    from .models import UserMfaStatus
+    deferred_user_ids = _deferred_user_ids.get()
+    if deferred_user_ids is not None:
+        deferred_user_ids.add(user_id)
+        return
+    plugins, device_count = user_statuses([user_id])[user_id]
+    updated = UserMfaStatus.objects.filter(user_id=user_id).update(
+        plugins=plugins, device_count=device_count)
+    if not updated and create:
+        UserMfaStatus.objects.create(
+            user_id=user_id, plugins=plugins, device_count=device_count)
+
+
+def record_verification(user):
+    '''
+    Set the last verification time of the user.
+    '''
+    if not app_settings.KLEIDES_MFA_USER_STATUS:
+        return
+    from .models import UserMfaStatus
+    now = timezone.now()
+    if not UserMfaStatus.objects.filter(user_id=user.pk).update(
+            last_verified=now):
+        update_user_status(user.pk)
+        UserMfaStatus.objects.filter(user_id=user.pk).update(
+            last_verified=now)
+
+
+def _device_state(instance):
+    # Deferred fields are not loaded to get the state.
+    return (
+        instance.__dict__.get('user_id'), instance.__dict__.get('confirmed'))
+
+
+def device_initialized(sender, instance, **kwargs):
+    setattr(instance, STATE_ATTRIBUTE, _device_state(instance))
+
+
+def device_saved(sender, instance, created, **kwargs):
+    '''
+    Update the status when a device is created or changes its user or
+    confirmation. Saves by the token verification do not change the status.
+    '''
+    previous = getattr(instance, STATE_ATTRIBUTE, None)
+    state = _device_state(instance)
+    setattr(instance, STATE_ATTRIBUTE, state)
+    if not created and previous == state:
+        return
+    if previous is not None and previous[0] not in (None, state[0]):
+        update_user_status(previous[0], create=False)
+    update_user_status(instance.user_id)
+
+
+def device_deleted(sender, instance, **kwargs):
+    # The status is deleted with the user.
+    update_user_status(instance.user_id, create=False)
+
+
+SIGNAL_HANDLERS = (
+    (post_init, device_initialized),
+    (post_save, device_saved),
+    (post_delete, device_deleted),
+)
+
+
+def connect_signals():
+    '''
+    Connect the signal handlers to the registered plugin models when
+    ``KLEIDES_MFA_USER_STATUS`` is enabled, otherwise disconnect them.
+    The handlers are not connected to all senders because that disables the
+    fast deletes of all models.
+    '''
+    for plugin in registry.plugins():
+        for signal, handler in SIGNAL_HANDLERS:
+            dispatch_uid = 'kleides_mfa.status.{}'.format(handler.__name__)
+            if app_settings.KLEIDES_MFA_USER_STATUS:
+                signal.connect(
+                    handler, sender=plugin.model, dispatch_uid=dispatch_uid)
+            else:
+                signal.disconnect(
+                    sender=plugin.model, dispatch_uid=dispatch_uid)
+
+
+@receiver(setting_changed)
+def reconnect_signals(setting, **kwargs):
+    if setting in (
+            'KLEIDES_MFA_USER_STATUS', 'KLEIDES_MFA_PLUGIN_PRIORITY'):
+        connect_signals()
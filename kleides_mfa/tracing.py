@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+Tracing spans of the stages of the MFA login.
+
+The spans are started with the tracer returned by the callable of
+``KLEIDES_MFA_TRACER``. A tracer implements ``start_as_current_span(name,
+attributes=None)`` of the OpenTelemetry API and returns a context manager of
+a span with ``set_attribute(key, value)``. By default spans are not traced.
+'''
+import threading
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .conf import app_settings
+
+__all__ = [
+    'NOOP_SPAN', 'NoopTracer', 'OUTCOME', 'PLUGIN', 'get_tracer',
+    'opentelemetry_tracer', 'trace']
+
+# The span attributes.
+OUTCOME = 'kleides_mfa.outcome'
+PLUGIN = 'kleides_mfa.plugin'
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class NoopSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer():
+    '''
+    The default tracer that does not trace.
+    '''
+    def start_as_current_span(self, name, attributes=None, **kwargs):
+        return NOOP_SPAN
+
+
+def opentelemetry_tracer():
+    '''
+    Return the OpenTelemetry tracer of kleides_mfa.
+    Requires the opentelemetry-api package.
+    '''
+    from opentelemetry import trace as opentelemetry_trace
+    return opentelemetry_trace.get_tracer('kleides_mfa')
+
+
+def get_tracer():
+    '''
+    Return the tracer of ``KLEIDES_MFA_TRACER`` or the NoopTracer.
+    '''
+    global _tracer
+    tracer = _tracer
+    if tracer is not None:
+        return tracer
+    with _tracer_lock:
+        if _tracer is None:
+            if app_settings.KLEIDES_MFA_TRACER:
+                _tracer = import_string(app_settings.KLEIDES_MFA_TRACER)()
+            else:
+                _tracer = NoopTracer()
+        return _tracer
+
+
+@receiver(setting_changed)
+def clear_tracer(setting, **kwargs):
+    global _tracer
+    if setting == 'KLEIDES_MFA_TRACER':
+        with _tracer_lock:
+            _tracer = None
+
+
+def trace(stage, plugin=None):
+    '''
+    Return the context manager of the ``kleides_mfa.<stage>`` span.
+    '''
+    attributes = {}
+    if plugin is not None:
+        attributes[PLUGIN] = plugin.slug
+    return get_tracer().start_as_current_span(
+        'kleides_mfa.{}'.format(stage), attributes=attributes)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+'''
+Trusted browsers skip the device verification after a password login.
+
+The trust is stored in a signed cookie that is bound to the user, the
+session auth hash (changes with the password) and the verified device.
+The cookie is signed again with every trusted login. Trusted browsers are
+revoked per user or globally by changing a version in the
+``KLEIDES_MFA_CACHE``. A missing version is initialized with the current
+time so an evicted version revokes the trust instead of restoring it.
+'''
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .conf import app_settings
+
+__all__ = [
+    'get_trusted_device', 'revoke_trusted_browsers', 'set_trusted_browser']
+
+SIGNING_SALT = 'kleides_mfa.trusted_browsers'
+
+
+def _version_key(user_id=None):
+    if user_id is None:
+        return 'kleides-mfa:trusted-browsers'
+    return 'kleides-mfa:trusted-browsers:{}'.format(user_id)
+
+
+def _version(user_id=None):
+    cache = caches[app_settings.KLEIDES_MFA_CACHE]
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _user_hash(user):
+    session_hash = ''
+    if hasattr(user, 'get_session_auth_hash'):
+        session_hash = user.get_session_auth_hash()
+    return salted_hmac(
+        SIGNING_SALT, '{}:{}'.format(user.pk, session_hash),
+        algorithm='sha256').hexdigest()
+
+
+def _bump_version(user_id=None):
+    cache = caches[app_settings.KLEIDES_MFA_CACHE]
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def revoke_trusted_browsers(user=None):
+    '''
+    Revoke the trusted browsers of the user or of all users.
+    '''
+    _bump_version(None if user is None else user.pk)
+
+
+def device_removed(sender, instance, **kwargs):
+    '''
+    Signal handler connected to mfa_removed. A removed device could be lost
+    or stolen so the trusted browsers of the user are revoked.
+    '''
+    _bump_version(instance.user_id)
+
+
+def devices_removed(sender, devices, **kwargs):
+    '''
+    Signal handler connected to mfa_bulk_removed.
+    '''
+    for user_id in {device.user_id for device in devices}:
+        _bump_version(user_id)
+
+
+def _trust_data(request, user):
+    '''
+    Return the valid cookie data for the user or None.
+    '''
+    days = app_settings.KLEIDES_MFA_TRUSTED_BROWSER_DAYS
+    value = request.COOKIES.get(
+        app_settings.KLEIDES_MFA_TRUSTED_BROWSER_COOKIE_NAME)
+    if not days or not value:
+        return None
+
+    max_age = days * 86400
+    try:
+        data = signing.loads(value, salt=SIGNING_SALT, max_age=max_age)
+        valid = (
+            data['i'] + max_age > time.time()
+            and constant_time_compare(data['h'], _user_hash(user))
+            and data['g'] == _version()
+            and data['v'] == _version(user.pk))
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+    return data if valid else None
+
+
+def get_trusted_device(request, user, user_devices):
+    '''
+    Return the device that was verified when the browser was trusted.
+
+    ``user_devices`` are the confirmed devices of the user as returned by
+    ``registry.user_devices_with_plugin``.
+    '''
+    data = _trust_data(request, user)
+    if data is None:
+        return None
+    for plugin, device in user_devices:
+        if device.persistent_id == data['d']:
+            return device
+    return None
+
+
+def set_trusted_browser(request, response, user, device):
+    '''
+    Set or rotate the trusted browser cookie on the response.
+    '''
+    days = app_settings.KLEIDES_MFA_TRUSTED_BROWSER_DAYS
+    data = _trust_data(request, user)
+    trusted_since = int(time.time()) if data is None else data['i']
+    value = signing.dumps({
+        'd': device.persistent_id,
+        'g': _version(),
+        'h': _user_hash(user),
+        'i': trusted_since,
+        'v': _version(user.pk),
+    }, salt=SIGNING_SALT, compress=True)
+    response.set_cookie(
+        app_settings.KLEIDES_MFA_TRUSTED_BROWSER_COOKIE_NAME, value,
+        max_age=trusted_since + days * 86400 - int(time.time()),
+        domain=settings.SESSION_COOKIE_DOMAIN,
+        secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+        samesite='Lax')
+    return response
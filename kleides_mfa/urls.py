@@ -2,6 +2,8 @@
 from django.urls import path
 
 from . import views
+from .views import api
+from .views.auth_request import AuthRequestView
 
 app_name = 'kleides_mfa'
 
@@ -20,4 +22,18 @@ urlpatterns = [
     path(
         '<slug:plugin>/delete/<int:device_id>/',
         views.DeviceDeleteView.as_view(), name='delete'),
+    path('api/login/', api.ApiLoginView.as_view(), name='api-login'),
+    path('api/list/', api.ApiDeviceListView.as_view(), name='api-index'),
+    path(
+        'api/<slug:plugin>/create/', api.ApiDeviceCreateView.as_view(),
+        name='api-create'),
+    path(
+        'api/<slug:plugin>/verify/<int:device_id>/',
+        api.ApiDeviceVerifyView.as_view(), name='api-verify'),
+    path(
+        'api/<slug:plugin>/delete/<int:device_id>/',
+        api.ApiDeviceDeleteView.as_view(), name='api-delete'),
+    path(
+        'auth-request/<slug:level>/', AuthRequestView.as_view(),
+        name='auth-request'),
 ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from asgiref.sync import sync_to_async
+
+
+def _get_user(request):
+    user = request.user
+    # Load the lazy user in the thread.
+    user.is_authenticated
+    return user
+
+
+async def aget_user(request):
+    '''
+    Return the user of the request without blocking the event loop.
+    Django < 5.0 has no ``request.auser()``, the user is loaded in a thread.
+    '''
+    if hasattr(request, 'auser'):
+        return await request.auser()
+    return await sync_to_async(_get_user)(request)
+
+
+async def aget_session(session, key, default=None):
+    '''
+    Return a session value without blocking the event loop.
+    Session backends without async methods are called in a thread.
+    '''
+    if hasattr(session, 'aget'):
+        return await session.aget(key, default)
+    return await sync_to_async(session.get)(key, default)
+
+
+async def aset_session(session, key, value):
+    '''
+    Set a session value without blocking the event loop.
+    '''
+    if hasattr(session, 'aset'):
+        return await session.aset(key, value)
+    return await sync_to_async(session.__setitem__)(key, value)
+
+
+async def apop_session(session, key, default=None):
+    '''
+    Remove and return a session value without blocking the event loop.
+    '''
+    if hasattr(session, 'apop'):
+        return await session.apop(key, default)
+    return await sync_to_async(session.pop)(key, default)
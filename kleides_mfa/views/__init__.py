@@ -1,9 +1,26 @@
 # -*- coding: utf-8 -*-
-from .auth import LoginView, DeviceVerifyView
-from .devices import (
-    DeviceDeleteView, DeviceCreateView, DeviceListView, DeviceUpdateView)
+from importlib import import_module
 
 __all__ = [
     'DeviceDeleteView', 'DeviceCreateView', 'DeviceListView',
     'DeviceUpdateView', 'DeviceVerifyView', 'LoginView', 'VerifyView',
 ]
+
+# The views are imported on first use, importing the mixins for the admin
+# does not import the views and forms.
+_VIEW_MODULES = {
+    'DeviceCreateView': 'devices',
+    'DeviceDeleteView': 'devices',
+    'DeviceListView': 'devices',
+    'DeviceUpdateView': 'devices',
+    'DeviceVerifyView': 'auth',
+    'LoginView': 'auth',
+}
+
+
+def __getattr__(name):
+    module = _VIEW_MODULES.get(name)
+    if module is None:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+    return getattr(import_module('.' + module, __name__), name)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, set_response_etag)
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
+from django.views.generic import View
+
+from ..cache import device_list_version
+from ..conf import app_settings
+from ..registry import registry
+from ..tracing import OUTCOME
+from ..trusted_browsers import get_trusted_device, set_trusted_browser
+from .auth import DeviceVerifyView, LoginView, session_login
+from .devices import DeviceCreateView, DeviceDeleteView
+from .mixins import SetupOrMFARequiredMixin
+
+
+def device_data(plugin, device):
+    '''
+    Return the JSON representation of a device.
+    '''
+    return {
+        'plugin': plugin.slug,
+        'id': device.pk,
+        'name': device.name,
+        'confirmed': device.confirmed,
+    }
+
+
+def device_list_etag(request, *args, **kwargs):
+    '''
+    Return the ETag of the device list based on the device list version.
+    The version is only used with the device list cache enabled, otherwise
+    the ETag is computed from the response.
+    '''
+    if app_settings.KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT == 0:
+        return None
+    plugins = ','.join(plugin.slug for plugin in registry.plugins())
+    value = '{}:{}:{}'.format(
+        request.user.pk, device_list_version(request.user), plugins)
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+class JsonResponseMixin():
+    '''
+    Return JSON responses instead of redirects and rendered templates.
+    '''
+    def handle_no_permission(self):
+        return JsonResponse(
+            {'error': 'Authentication required.'}, status=403)
+
+    def add_message(self, level, message):
+        # Messages are displayed on HTML pages only.
+        pass
+
+    def form_invalid(self, form):
+        return JsonResponse(
+            {'errors': form.errors.get_json_data()}, status=400)
+
+
+class ApiLoginView(JsonResponseMixin, LoginView):
+    '''
+    Authenticate the first factor and return the devices to verify.
+    '''
+    http_method_names = ['post']
+
+    def form_valid(self, form):
+        user = form.get_user()
+        user_devices = self.get_user_devices(user)
+        trusted_device = get_trusted_device(self.request, user, user_devices)
+        if trusted_device is not None:
+            return self.trusted_login(user, trusted_device)
+        if user_devices:
+            self.start_verification(user)
+        else:
+            # Single factor authentication to setup the account.
+            self.trace_span.set_attribute(OUTCOME, 'single_factor')
+            session_login(self.request, user)
+        return JsonResponse({
+            'verified': False,
+            'setup': not user_devices,
+            'devices': [
+                dict(device_data(plugin, device), url=reverse(
+                    'kleides_mfa:api-verify', args=[plugin.slug, device.pk]))
+                for plugin, device in user_devices],
+        })
+
+    def trusted_login(self, user, device):
+        self.trace_span.set_attribute(OUTCOME, 'trusted_browser')
+        user.otp_device = device
+        session_login(self.request, user)
+        response = JsonResponse({'verified': True, 'setup': False})
+        return set_trusted_browser(self.request, response, user, device)
+
+
+class ApiDeviceListView(JsonResponseMixin, SetupOrMFARequiredMixin, View):
+    '''
+    Return the devices of the user by plugin.
+    '''
+    @method_decorator(condition(etag_func=device_list_etag))
+    def get(self, request, *args, **kwargs):
+        response = JsonResponse({'plugins': [
+            {
+                'slug': plugin.slug,
+                'name': str(plugin.name),
+                'devices': [
+                    device_data(plugin, device) for device in devices],
+            }
+            for plugin, devices in registry.plugins_with_user_devices(
+                request.user, confirmed=None)
+        ]})
+        patch_cache_control(response, private=True, no_cache=True)
+        if app_settings.KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT == 0:
+            # The devices may be changed without a new device list version.
+            set_response_etag(response)
+            return get_conditional_response(
+                request, etag=response['ETag'], response=response)
+        return response
+
+
+@method_decorator(never_cache, name='dispatch')
+class ApiDeviceCreateView(JsonResponseMixin, DeviceCreateView):
+    '''
+    Start the enrollment of a device with GET and confirm it with POST.
+    The responses carry the device secrets and are never stored.
+    '''
+    def get(self, request, *args, **kwargs):
+        self.object = None
+        form = self.get_form()
+        data = {'plugin': self.plugin.slug, 'fields': list(form.fields)}
+        # Provisioning uri of TOTP and similar devices.
+        config_url = getattr(form.instance, 'config_url', None)
+        if config_url is not None:
+            data['provisioning_uri'] = config_url
+        return JsonResponse(data)
+
+    def form_valid(self, form):
+        super().form_valid(form)
+        return JsonResponse(
+            {'device': device_data(self.plugin, self.object)}, status=201)
+
+
+class ApiDeviceVerifyView(JsonResponseMixin, DeviceVerifyView):
+    '''
+    Verify a device of the user that is logging in.
+    '''
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return JsonResponse({
+            'device': device_data(self.plugin, self.object),
+            'devices': [
+                device_data(plugin, device)
+                for plugin, device in registry.user_devices_with_plugin(
+                    self.unverified_user, confirmed=True)],
+        })
+
+    def device_does_not_exist(self):
+        self.request.session.flush()
+        return JsonResponse({'error': 'Device does not exist.'}, status=404)
+
+    def form_valid(self, form):
+        self.verified_login(form)
+        return self.trust_browser(form, JsonResponse({'verified': True}))
+
+    def form_invalid(self, form):
+        self.login_failed()
+        return super().form_invalid(form)
+
+
+class ApiDeviceDeleteView(JsonResponseMixin, DeviceDeleteView):
+    '''
+    Delete a device with POST or DELETE.
+    '''
+    http_method_names = ['post', 'delete']
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if self.request.method == 'DELETE':
+            kwargs['data'] = {}
+        return kwargs
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        if isinstance(response, JsonResponse):
+            return response
+        return HttpResponse(status=204)
+
+    def delete(self, request, *args, **kwargs):
+        return self.post(request, *args, **kwargs)
@@ -10,13 +10,39 @@ from django.utils.http import urlencode
 
 from .mixins import (
     BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, VERIFIED_SESSION_KEY,
-    PluginMixin, UnverifiedUserMixin)
+    PluginMixin, QueryBudgetMixin, UnverifiedUserMixin)
 from ..conf import app_settings
+from ..models import AuditLogEntry
+from ..query_budget import (
+    LOGIN_USER, REQUEST_USER, SESSION_INDEX, SESSION_LOGIN, TOKEN_VERIFICATION,
+    USER_DEVICES)
 from ..registry import registry
+from ..session_index import index_session
+from ..status import record_verification
+from ..tracing import NOOP_SPAN, OUTCOME, PLUGIN, trace
+from ..trusted_browsers import get_trusted_device, set_trusted_browser
 
 
-class LoginView(DjangoLoginView):
+def session_login(request, user, backend=None):
+    '''
+    Django login traced as the ``session_login`` stage.
+    '''
+    with trace('session_login'):
+        login(request, user, backend)
+        device = getattr(user, 'otp_device', None)
+        if device is not None:
+            index_session(request, device)
+
+
+class LoginView(QueryBudgetMixin, DjangoLoginView):
     template_name = 'kleides_mfa/login.html'
+    # The user and devices, plus the login of a trusted browser.
+    query_budget = LOGIN_USER + USER_DEVICES + SESSION_LOGIN + SESSION_INDEX
+    trace_span = NOOP_SPAN
+
+    def post(self, request, *args, **kwargs):
+        with trace('login') as self.trace_span:
+            return super().post(request, *args, **kwargs)
 
     def get_success_url(self, has_device=False):
         if not has_device:
@@ -27,18 +53,16 @@ class LoginView(DjangoLoginView):
         # If the user has any authentication methods remaining they must be
         # used *before the user is logged in*.
         user = form.get_user()
-        user_devices = registry.user_devices_with_plugin(user, confirmed=True)
+        user_devices = self.get_user_devices(user)
+        trusted_device = get_trusted_device(self.request, user, user_devices)
+        if trusted_device is not None:
+            return self.trusted_login(user, trusted_device)
         if user_devices:
-            # Store the User data in the session so we can call Django login
-            # after verifying a 2nd device.
-            session = self.request.session
-            session[SESSION_KEY] = user._meta.pk.value_to_string(user)
-            session[BACKEND_SESSION_KEY] = user.backend
-            if hasattr(user, 'get_session_auth_hash'):
-                session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            self.start_verification(user)
 
             # Devices are sorted by security/type.
             plugin, device = user_devices[0]
+            self.trace_span.set_attribute(PLUGIN, plugin.slug)
             redirect_url = reverse(
                 'kleides_mfa:verify', args=[plugin.slug, device.pk])
             params = urlencode(
@@ -47,32 +71,72 @@ class LoginView(DjangoLoginView):
             return HttpResponseRedirect('{}?{}'.format(redirect_url, params))
         # Otherwise the user is authenticated with a single factor and will
         # have to fortify his account by adding authentication methods.
-        return super().form_valid(form)
+        self.trace_span.set_attribute(OUTCOME, 'single_factor')
+        with trace('session_login'):
+            return super().form_valid(form)
 
+    def form_invalid(self, form):
+        self.trace_span.set_attribute(OUTCOME, 'failure')
+        return super().form_invalid(form)
 
-class DeviceVerifyView(UnverifiedUserMixin, PluginMixin, DjangoLoginView):
+    def get_user_devices(self, user):
+        with trace('device_inventory'):
+            return registry.user_devices_with_plugin(user, confirmed=True)
+
+    def trusted_login(self, user, device):
+        # The browser was trusted after verifying the device. The verified
+        # time is not set so recently verified views still require a device.
+        self.trace_span.set_attribute(OUTCOME, 'trusted_browser')
+        user.otp_device = device
+        session_login(self.request, user)
+        response = HttpResponseRedirect(self.get_success_url(has_device=True))
+        return set_trusted_browser(self.request, response, user, device)
+
+    def start_verification(self, user):
+        # Store the User data in the session so we can call Django login
+        # after verifying a 2nd device.
+        self.trace_span.set_attribute(OUTCOME, 'verification_required')
+        session = self.request.session
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = user.backend
+        if hasattr(user, 'get_session_auth_hash'):
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+
+
+class DeviceVerifyView(
+        QueryBudgetMixin, UnverifiedUserMixin, PluginMixin, DjangoLoginView):
     raise_exception = True
     template_name_suffix = '_verify_form'
+    # A failed verification lists the devices of the user, a successful one
+    # logs in.
+    query_budget = (
+        REQUEST_USER + TOKEN_VERIFICATION + USER_DEVICES + SESSION_LOGIN
+        + SESSION_INDEX)
+    trace_span = NOOP_SPAN
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         return super().get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        return super().post(request, *args, **kwargs)
+        with trace('verify', self.plugin) as self.trace_span:
+            self.object = self.get_object()
+            return super().post(request, *args, **kwargs)
 
     def dispatch(self, request, *args, **kwargs):
         try:
             return super().dispatch(request, *args, **kwargs)
         except self.get_plugin().model.DoesNotExist:
-            # A user tried to access a device that no longer exists or belongs
-            # to another user. Flush the session and restart authentication.
-            request.session.flush()
-            redirect_url = reverse('kleides_mfa:login')
-            params = urlencode(
-                {self.redirect_field_name: self.get_success_url()})
-            return HttpResponseRedirect('{}?{}'.format(redirect_url, params))
+            return self.device_does_not_exist()
+
+    def device_does_not_exist(self):
+        # A user tried to access a device that no longer exists or belongs
+        # to another user. Flush the session and restart authentication.
+        self.request.session.flush()
+        redirect_url = reverse('kleides_mfa:login')
+        params = urlencode(
+            {self.redirect_field_name: self.get_success_url()})
+        return HttpResponseRedirect('{}?{}'.format(redirect_url, params))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -97,16 +161,33 @@ class DeviceVerifyView(UnverifiedUserMixin, PluginMixin, DjangoLoginView):
 
     def get_object(self):
         # Fetch the the confirmed device of the unverified user.
-        return self.plugin.get_user_device(
-            self.kwargs['device_id'], self.unverified_user, confirmed=True)
+        with trace('device_lookup', self.plugin) as span:
+            try:
+                device = self.plugin.get_user_device(
+                    self.kwargs['device_id'], self.unverified_user,
+                    confirmed=True)
+            except self.plugin.model.DoesNotExist:
+                span.set_attribute(OUTCOME, 'not_found')
+                raise
+            span.set_attribute(OUTCOME, 'found')
+        return device
 
     def form_valid(self, form):
+        self.verified_login(form)
+        response = HttpResponseRedirect(self.get_success_url())
+        return self.trust_browser(form, response)
+
+    def verified_login(self, form):
         # User is now verified.
         user = form.get_user()
         # Pass otp device to django-otp.
         user.otp_device = form.get_device()
+        self.trace_span.set_attribute(OUTCOME, 'success')
+        self.audit(AuditLogEntry.VERIFIED, user.otp_device, user)
+        record_verification(user)
         # Perform django session login.
-        login(self.request, user, self.request.session[BACKEND_SESSION_KEY])
+        session_login(
+            self.request, user, self.request.session[BACKEND_SESSION_KEY])
         # Cleanup kleides_mfa session data.
         try:
             del self.request.session[SESSION_KEY]
@@ -120,17 +201,27 @@ class DeviceVerifyView(UnverifiedUserMixin, PluginMixin, DjangoLoginView):
         # Note that the verified session parameters should match the session
         # when the first device is added in DeviceCreateView.
         self.request.session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
-        return HttpResponseRedirect(self.get_success_url())
+
+    def trust_browser(self, form, response):
+        if form.cleaned_data.get('trust_browser'):
+            set_trusted_browser(
+                self.request, response, form.get_user(), form.get_device())
+        return response
 
     def form_invalid(self, form):
+        self.login_failed()
+        return super().form_invalid(form)
+
+    def login_failed(self):
         # The device verification failed, fire login_failed signal like Django
         # does on failed autentication attempts against all backends.
         # Provide the username in the credentials for compatibility with
         # other apps and log the user and device that were protected.
+        self.trace_span.set_attribute(OUTCOME, 'failure')
+        self.audit(AuditLogEntry.FAILED, self.object, self.unverified_user)
         User = get_user_model()
         username = getattr(self.unverified_user, User.USERNAME_FIELD)
         user_login_failed.send(
             sender=__name__, credentials={'username': username},
             request=self.request, user=self.unverified_user,
             device=self.object)
-        return super().form_invalid(form)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
+
+from ..conf import app_settings
+from .mixins import is_recently_verified
+
+USER_HEADER = 'X-Kleides-Mfa-User'
+# The verification time of the recently-verified level is updated at most
+# once per interval instead of saving the session for every subrequest.
+VERIFIED_UPDATE_INTERVAL = 60
+
+
+class AuthRequestCache():
+    '''
+    A small in-process cache of the passed auth requests by session key.
+    Only passed requests are cached so a login is effective immediately.
+    '''
+    max_size = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}  # (session_key, level) -> (expires, username)
+
+    def get(self, session_key, level):
+        try:
+            expires, username = self._cache[(session_key, level)]
+        except KeyError:
+            return None
+        if expires < time.monotonic():
+            return None
+        return username
+
+    def set(self, session_key, level, username, timeout):
+        with self._lock:
+            if len(self._cache) >= self.max_size:
+                self._cache.clear()
+            self._cache[(session_key, level)] = (
+                time.monotonic() + timeout, username)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AuthRequestView(View):
+    '''
+    Authorization endpoint for the nginx ``auth_request`` module.
+
+    Returns 200 when the user passes the authentication level, 401 for
+    anonymous users and 403 for users that need to verify a (recent) second
+    factor. The username is returned in the X-Kleides-Mfa-User header.
+    No templates or messages are used and the session is read once, it is
+    only saved when the verification time is updated.
+    '''
+    levels = {
+        'single-factor': lambda r: r.user.is_single_factor_authenticated,
+        'verified': lambda r: r.user.is_verified,
+        'recently-verified': functools.partial(
+            is_recently_verified, update_interval=VERIFIED_UPDATE_INTERVAL),
+    }
+    cache = AuthRequestCache()
+
+    def dispatch(self, request, level):
+        try:
+            test_func = self.levels[level]
+        except KeyError:
+            raise Http404('Authentication level does not exist')
+
+        timeout = app_settings.KLEIDES_MFA_AUTH_REQUEST_CACHE_TIMEOUT
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if timeout and session_key:
+            username = self.cache.get(session_key, level)
+            if username is not None:
+                return self.passed(username)
+
+        if test_func(request):
+            username = request.user.get_username()
+            if timeout and session_key:
+                self.cache.set(session_key, level, username, timeout)
+            return self.passed(username)
+
+        if request.user.is_single_factor_authenticated:
+            return HttpResponse(status=403)
+        return HttpResponse(status=401)
+
+    def passed(self, username):
+        response = HttpResponse()
+        response[USER_HEADER] = username
+        return response
@@ -1,31 +1,59 @@
 # -*- coding: utf-8 -*-
+import functools
+
 from django.contrib import messages
 from django.http import Http404
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import (
     CreateView, DeleteView, TemplateView, UpdateView)
 
 from django_otp import DEVICE_ID_SESSION_KEY, login as django_otp_login
 
-from ..registry import registry
-from ..signals import mfa_added, mfa_removed
+from ..cache import device_list_version
+from ..conf import app_settings
+from ..models import AuditLogEntry
+from ..query_budget import (
+    REQUEST_USER, SESSION_INDEX, USER_DEVICES, QueryBudget)
+from ..registry import KleidesPluginDevices, registry
+from ..session_index import index_session
+from ..signals import mfa_added, mfa_removed, mfa_updated
 from .mixins import (
-    VERIFIED_SESSION_KEY, PluginMixin, RecentMultiFactorRequiredMixin,
-    SetupOrMFARequiredMixin, SetupOrRecentMFARequiredMixin)
+    VERIFIED_SESSION_KEY, PluginMixin, QueryBudgetMixin,
+    RecentMultiFactorRequiredMixin, SetupOrMFARequiredMixin,
+    SetupOrRecentMFARequiredMixin)
 
 
-class DeviceListView(SetupOrMFARequiredMixin, TemplateView):
+class DeviceListView(QueryBudgetMixin, SetupOrMFARequiredMixin, TemplateView):
     template_name = 'kleides_mfa/plugin_list.html'
+    # The devices and the recovery codes.
+    query_budget = REQUEST_USER + USER_DEVICES + QueryBudget(1)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['plugins'] = registry.plugins_with_user_devices(
-            self.request.user, confirmed=None)
+        # The devices are only fetched when the device list fragment of the
+        # plugin is not cached.
+        context['plugins'] = [
+            KleidesPluginDevices(plugin, SimpleLazyObject(functools.partial(
+                plugin.get_user_devices, self.request.user, confirmed=None)))
+            for plugin in registry.plugins()]
+        timeout = app_settings.KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT
+        if timeout != 0:
+            context['device_list_cache'] = app_settings.KLEIDES_MFA_CACHE
+            context['device_list_cache_timeout'] = timeout
+            context['device_list_version'] = '{}.{}'.format(
+                self.request.user.pk, device_list_version(self.request.user))
         return context
 
 
-class DeviceCreateView(SetupOrRecentMFARequiredMixin, PluginMixin, CreateView):
+class DeviceCreateView(
+        QueryBudgetMixin, SetupOrRecentMFARequiredMixin, PluginMixin,
+        CreateView):
     template_name_suffix = '_create_form'
+    # The setup test checks the devices of every plugin, the device and its
+    # recovery codes are created and the first device is indexed.
+    query_budget = (
+        REQUEST_USER + USER_DEVICES + QueryBudget(6) + SESSION_INDEX)
 
     def get_form_class(self):
         form_class = self.plugin.get_create_form_class()
@@ -39,31 +67,45 @@ class DeviceCreateView(SetupOrRecentMFARequiredMixin, PluginMixin, CreateView):
         # This is the users first device, use it to verify the user.
         if not self.request.user.is_verified:
             django_otp_login(self.request, self.object)
+            index_session(self.request, self.object)
             # Add the last verification time to the session.
             # Note that the verified session parameters should match the
             # session when authenticating in DeviceVerifyView.
             self.request.session[
                 VERIFIED_SESSION_KEY] = timezone.now().isoformat()
-        messages.success(
-            self.request, self.plugin.get_create_message(self.object))
+        self.add_message(
+            messages.SUCCESS, self.plugin.get_create_message(self.object))
         mfa_added.send(
             sender=__name__, instance=self.object, request=self.request)
+        self.audit(AuditLogEntry.ADDED, self.object)
         return response
 
 
 class DeviceUpdateView(
-        RecentMultiFactorRequiredMixin, PluginMixin, UpdateView):
+        QueryBudgetMixin, RecentMultiFactorRequiredMixin, PluginMixin,
+        UpdateView):
+    # The device and its name or recovery codes.
+    query_budget = REQUEST_USER + QueryBudget(5)
+
     def get_form_class(self):
         return self.plugin.get_update_form_class()
 
     def form_valid(self, form):
-        messages.success(
-            self.request, self.plugin.get_update_message(self.object))
-        return super().form_valid(form)
+        self.add_message(
+            messages.SUCCESS, self.plugin.get_update_message(self.object))
+        response = super().form_valid(form)
+        mfa_updated.send(
+            sender=__name__, instance=self.object, request=self.request)
+        return response
 
 
 class DeviceDeleteView(
-        RecentMultiFactorRequiredMixin, PluginMixin, DeleteView):
+        QueryBudgetMixin, RecentMultiFactorRequiredMixin, PluginMixin,
+        DeleteView):
+    # The device and its recovery codes, the remaining devices are checked
+    # after the delete.
+    query_budget = REQUEST_USER + QueryBudget(4) + USER_DEVICES
+
     def get_form_class(self):
         return self.plugin.get_delete_form_class()
 
@@ -72,7 +114,10 @@ class DeviceDeleteView(
         mfa_removed.send(sender=__name__, instance=obj, request=request)
         message = self.plugin.get_delete_message(obj)
         response = super().post(request, *args, **kwargs)
-        messages.warning(request, message)
+        if self.object.pk is None:
+            # The deleted object lost its pk, obj keeps the persistent id.
+            self.audit(AuditLogEntry.REMOVED, obj)
+        self.add_message(messages.WARNING, message)
         # User has removed all authentication methods, disable his access.
         if not registry.user_has_device(self.request.user, confirmed=True):
             self.request.user.otp_device = None
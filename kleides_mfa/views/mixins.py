@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+import functools
 
 from django.conf import settings
 from django.contrib import messages
@@ -7,17 +8,23 @@ from django.contrib.auth import (
     get_user_model, load_backend, mixins as auth_mixins)
 from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import PermissionDenied
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.http import Http404
 from django.shortcuts import resolve_url
-from django.urls import reverse_lazy
+from django.urls import get_script_prefix, get_urlconf, reverse_lazy
 from django.utils import timezone
 from django.utils.crypto import constant_time_compare
 from django.utils.translation import gettext_lazy as _
 
 from urllib.parse import urlparse
 
+from ..audit import audit_log
 from ..conf import app_settings
 from ..registry import registry
+from ..routers import pin_primary
+from ..tracing import OUTCOME, trace
+from ..utils import aget_session, aget_user, aset_session
 
 
 # Note that these session keys are different from django auth so the user
@@ -29,12 +36,29 @@ HASH_SESSION_KEY = '_kleides-mfa_user_hash'
 VERIFIED_SESSION_KEY = '_kleides-mfa_user_verified'
 
 
+class QueryBudgetMixin():
+    '''
+    Declare the ``query_budget`` of the view, checked by the
+    :class:`~kleides_mfa.middleware.QueryBudgetMiddleware`.
+    '''
+    query_budget = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.query_budget is not None:
+            request._kleides_mfa_query_budget = (
+                self.query_budget, type(self).__name__)
+        return super().dispatch(request, *args, **kwargs)
+
+
 class PluginMixin():
     success_url = reverse_lazy('kleides_mfa:index')
 
-    def dispatch(self, *args, **kwargs):
+    def dispatch(self, request, *args, **kwargs):
         self.plugin = self.get_plugin()
-        return super().dispatch(*args, **kwargs)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            # Verify and change the devices of the primary database.
+            pin_primary()
+        return super().dispatch(request, *args, **kwargs)
 
     def get_plugin(self):
         try:
@@ -51,6 +75,12 @@ class PluginMixin():
         context['plugin'] = self.plugin
         return context
 
+    def add_message(self, level, message):
+        messages.add_message(self.request, level, message)
+
+    def audit(self, action, device, user=None):
+        audit_log.record(self.request, action, self.plugin, device, user)
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['plugin'] = self.plugin
@@ -65,6 +95,56 @@ class PluginMixin():
         ]
 
 
+@functools.lru_cache(maxsize=None)
+def _resolve_login_url(login_url, urlconf, script_prefix):
+    resolved_login_url = resolve_url(login_url)
+    login_scheme, login_netloc = urlparse(resolved_login_url)[:2]
+    return resolved_login_url, login_scheme, login_netloc
+
+
+def resolve_login_url(login_url):
+    '''
+    Return a tuple of the resolved login url, its scheme and net location.
+    The result is cached until the url settings change.
+    '''
+    if not isinstance(login_url, str):
+        # Lazy urls and models are resolved every time.
+        resolved_login_url = resolve_url(login_url)
+        return (resolved_login_url,) + tuple(urlparse(resolved_login_url)[:2])
+    return _resolve_login_url(login_url, get_urlconf(), get_script_prefix())
+
+
+@receiver(setting_changed)
+def clear_login_url_cache(setting, **kwargs):
+    if setting in ('LOGIN_URL', 'ROOT_URLCONF'):
+        _resolve_login_url.cache_clear()
+
+
+def login_redirect(request, login_url, redirect_field_name, user=None):
+    '''
+    Redirect to the login url with the current url as the "next" url.
+    Provide the user when ``request.user`` should not be evaluated.
+    '''
+    if user is None:
+        user = request.user
+    if user.is_verified:
+        messages.info(
+            request,
+            _('We need to confirm your identity, please login again.'))
+
+    resolved_login_url, login_scheme, login_netloc = resolve_login_url(
+        login_url)
+    # If the login url is the same scheme and net location then use the
+    # path as the "next" url.
+    if (not login_scheme or login_scheme == request.scheme) and (
+        not login_netloc or login_netloc == request.get_host()
+    ):
+        path = request.get_full_path()
+    else:
+        path = request.build_absolute_uri()
+    return redirect_to_login(path, resolved_login_url, redirect_field_name)
+
+
 class UserPassesTestMixin(auth_mixins.UserPassesTestMixin):
     def handle_no_permission(self):
         '''
@@ -76,26 +156,9 @@ class UserPassesTestMixin(auth_mixins.UserPassesTestMixin):
         if self.raise_exception:
             raise PermissionDenied(self.get_permission_denied_message())
 
-        if self.request.user.is_verified:
-            messages.info(
-                self.request,
-                _('We need to confirm your identity, please login again.'))
-
-        path = self.request.build_absolute_uri()
-        resolved_login_url = resolve_url(self.get_login_url())
-        # If the login url is the same scheme and net location then use the
-        # path as the "next" url.
-        login_scheme, login_netloc = urlparse(resolved_login_url)[:2]
-        current_scheme, current_netloc = urlparse(path)[:2]
-        if (not login_scheme or login_scheme == current_scheme) and (
-            not login_netloc or login_netloc == current_netloc
-        ):
-            path = self.request.get_full_path()
-        return redirect_to_login(
-            path,
-            resolved_login_url,
-            self.get_redirect_field_name(),
-        )
+        return login_redirect(
+            self.request, self.get_login_url(),
+            self.get_redirect_field_name())
 
 
 class SingleFactorRequiredMixin(UserPassesTestMixin):
@@ -114,23 +177,37 @@ class MultiFactorRequiredMixin(UserPassesTestMixin):
         return self.request.user.is_verified
 
 
-def is_recently_verified(request):
+def _is_recent_verification(verified_on, timeout=None):
+    '''
+    Return True if the isoformat verification time is within the timeout,
+    by default the KLEIDES_MFA_VERIFIED_TIMEOUT.
+    '''
+    try:
+        verified_on = datetime.fromisoformat(verified_on)
+    except (TypeError, ValueError):
+        return False
+
+    if timeout is None:
+        timeout = app_settings.KLEIDES_MFA_VERIFIED_TIMEOUT
+    verified_seconds = (timezone.now() - verified_on).seconds
+    return verified_seconds < timeout
+
+
+def is_recently_verified(request, update_interval=0):
     '''
     Verify that the user has recently verified with a authentication device.
+    The verification time is updated when it is at least update_interval
+    seconds old.
     '''
     if request.user.is_verified:
         if app_settings.KLEIDES_MFA_VERIFIED_TIMEOUT is None:
             return True
 
-        try:
-            verified_on = datetime.fromisoformat(
-                request.session[VERIFIED_SESSION_KEY])
-        except (KeyError, TypeError, ValueError):
-            return False
-
-        verified_seconds = (timezone.now() - verified_on).seconds
-        if verified_seconds < app_settings.KLEIDES_MFA_VERIFIED_TIMEOUT:
-            if app_settings.KLEIDES_MFA_VERIFIED_UPDATE:
+        verified_on = request.session.get(VERIFIED_SESSION_KEY)
+        if _is_recent_verification(verified_on):
+            if (app_settings.KLEIDES_MFA_VERIFIED_UPDATE
+                    and not _is_recent_verification(
+                        verified_on, update_interval)):
                 (request.session
                  [VERIFIED_SESSION_KEY]) = timezone.now().isoformat()
             return True
@@ -138,6 +215,29 @@ def is_recently_verified(request):
     return False
 
 
+async def ais_recently_verified(request, update_interval=0):
+    '''
+    Async version of :func:`is_recently_verified`.
+    '''
+    user = await aget_user(request)
+    if user.is_verified:
+        if app_settings.KLEIDES_MFA_VERIFIED_TIMEOUT is None:
+            return True
+
+        verified_on = await aget_session(
+            request.session, VERIFIED_SESSION_KEY)
+        if _is_recent_verification(verified_on):
+            if (app_settings.KLEIDES_MFA_VERIFIED_UPDATE
+                    and not _is_recent_verification(
+                        verified_on, update_interval)):
+                await aset_session(
+                    request.session, VERIFIED_SESSION_KEY,
+                    timezone.now().isoformat())
+            return True
+
+    return False
+
+
 class RecentMultiFactorRequiredMixin(UserPassesTestMixin):
     '''
     Verify that the user has recently authenticated with multiple
@@ -156,6 +256,16 @@ def is_user_in_setup(request):
         and not registry.user_has_device(request.user, confirmed=True))
 
 
+async def ais_user_in_setup(request):
+    '''
+    Async version of :func:`is_user_in_setup`.
+    '''
+    user = await aget_user(request)
+    return bool(
+        user.is_single_factor_authenticated
+        and not await registry.auser_has_device(user, confirmed=True))
+
+
 class SetupOrMFARequiredMixin(UserPassesTestMixin):
     '''
     Verify that the user is authenticated with multiple factors or
@@ -184,7 +294,10 @@ class UnverifiedUserMixin(UserPassesTestMixin):
     Note that the user may not be fully authenticated.
     '''
     def test_func(self):
-        self.unverified_user = self.get_unverified_user()
+        with trace('unverified_user') as span:
+            self.unverified_user = self.get_unverified_user()
+            span.set_attribute(OUTCOME, (
+                'not_found' if self.unverified_user is None else 'found'))
         return bool(self.unverified_user is not None)
 
     def get_unverified_user(self):
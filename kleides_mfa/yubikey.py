@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import caches
+
+from .conf import app_settings
+
+__all__ = ['validation_services']
+
+
+class ValidationServiceCatalogue():
+    '''
+    A cache of the primary keys and names of the otp_yubikey
+    ValidationService instances, the service choices of the Yubikey forms.
+    The api keys of the services are not cached.
+
+    The catalogue is cleared when a ValidationService is saved or deleted.
+    Other processes only see the clear with a shared ``KLEIDES_MFA_CACHE``,
+    the catalogue expires after ``timeout`` seconds.
+    '''
+    cache_key = 'kleides-mfa:validation-service-choices'
+    timeout = 300
+
+    @property
+    def cache(self):
+        return caches[app_settings.KLEIDES_MFA_CACHE]
+
+    def choices(self):
+        '''
+        Return a list of (pk, name) of all validation services ordered by
+        primary key.
+        '''
+        choices = self.cache.get(self.cache_key)
+        if choices is None:
+            from otp_yubikey.models import ValidationService
+            choices = list(ValidationService.objects.order_by('pk')
+                           .values_list('pk', 'name'))
+            self.cache.set(self.cache_key, choices, self.timeout)
+        return choices
+
+    def clear(self, **kwargs):
+        '''
+        Clear the catalogue, connected to the ValidationService post_save and
+        post_delete signals.
+        '''
+        self.cache.delete(self.cache_key)
+
+
+validation_services = ValidationServiceCatalogue()
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
+
+from kleides_mfa.admin import UserMfaDevicesAdminMixin
+
+User = get_user_model()
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UserAdmin(UserMfaDevicesAdminMixin, DjangoUserAdmin):
+    pass
@@ -17,7 +17,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': ':memory:',
-    }
+    },
+    # Used by the kleides_mfa.routers tests.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
 INSTALLED_APPS = [
@@ -47,6 +53,7 @@ MIDDLEWARE = [
     'kleides_mfa.middleware.KleidesAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'kleides_mfa.middleware.QueryBudgetMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = [
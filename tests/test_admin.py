@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_otp import DEVICE_ID_SESSION_KEY
+
+from kleides_mfa.signals import mfa_removed, mfa_updated
+from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+
+from .factories import UserFactory
+from .utils import handle_signal
+
+
+class UserMfaDevicesAdminTestCase(TestCase):
+    def setUp(self):
+        staff_user = UserFactory(is_staff=True, is_superuser=True)
+        device = staff_user.totpdevice_set.create(name='staff')
+        staff_user.otp_device = device
+        self.client.force_login(staff_user)
+        session = self.client.session
+        session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+        session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+        session.save()
+
+        self.user = UserFactory()
+        self.url = '/admin/auth/user/{}/change/'.format(self.user.pk)
+
+    def test_device_list(self):
+        self.user.totpdevice_set.create(name='phone')
+        static = self.user.staticdevice_set.create(name='static')
+        for token in ('token1', 'token2', 'token3'):
+            static.token_set.create(token=token)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'phone')
+        self.assertContains(response, '<td>3</td>', html=True)
+        self.assertContains(response, '/mfa-devices/recovery-codes/')
+        self.assertNotContains(response, 'token1')
+
+        # A query per plugin however many devices the user has.
+        for i in range(5):
+            self.user.totpdevice_set.create(name='phone {}'.format(i))
+            self.user.yubikeydevice_set.create(name='yubikey {}'.format(i))
+        with self.assertNumQueries(len(queries)):
+            self.client.get(self.url)
+
+    def test_delete_device(self):
+        device = self.user.totpdevice_set.create(name='phone')
+        url = '/admin/auth/user/{}/mfa-devices/totp/{}/delete/'.format(
+            self.user.pk, device.pk)
+        other_device = UserFactory().totpdevice_set.create(name='other')
+        self.assertEqual(self.client.post(
+            '/admin/auth/user/{}/mfa-devices/totp/{}/delete/'.format(
+                self.user.pk, other_device.pk)).status_code, 404)
+
+        # The device is deleted after a confirmation.
+        response = self.client.get(self.url)
+        self.assertContains(response, 'href="{}"'.format(url))
+        response = self.client.get(url)
+        self.assertContains(response, 'delete the TOTP "phone"?')
+        self.assertTrue(self.user.totpdevice_set.exists())
+
+        with handle_signal(mfa_removed) as handler:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url)
+                # The signal is sent after the commit.
+                handler.assert_not_called()
+        self.assertRedirects(response, self.url)
+        handler.assert_called_once()
+        self.assertEqual(
+            handler.call_args.kwargs['instance'].persistent_id,
+            device.persistent_id)
+        self.assertFalse(self.user.totpdevice_set.exists())
+
+    def test_replace_recovery_codes(self):
+        url = '/admin/auth/user/{}/mfa-devices/recovery-codes/'.format(
+            self.user.pk)
+        self.assertEqual(self.client.post(url).status_code, 404)
+        static = self.user.staticdevice_set.create(name='static')
+        static.token_set.create(token='token1')
+
+        with handle_signal(mfa_updated) as handler:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(url)
+                handler.assert_not_called()
+        self.assertRedirects(response, self.url)
+        handler.assert_called_once()
+        tokens = list(static.token_set.values_list('token', flat=True))
+        self.assertEqual(len(tokens), 10)
+        self.assertNotIn('token1', tokens)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from base64 import b32decode
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from django_otp.oath import TOTP
+
+from kleides_mfa.signals import mfa_added, mfa_removed
+
+from .factories import UserFactory
+from .utils import handle_signal
+
+
+class KleidesMfaApiTestCase(TestCase):
+    def tearDown(self):
+        # Device list versions are not rolled back with the users.
+        cache.clear()
+
+    def totp_from_uri(self, uri):
+        params = parse_qs(urlsplit(uri).query)
+        return TOTP(
+            b32decode(params['secret'][0]),
+            step=int(params['period'][0]),
+            digits=int(params['digits'][0]), t0=0, drift=0)
+
+    def api_login(self, user):
+        response = self.client.post(
+            '/api/login/',
+            {'username': user.username, 'password': user.raw_password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_login_failure(self):
+        response = self.client.post(
+            '/api/login/', {'username': 'test', 'password': 'test1234'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('__all__', response.json()['errors'])
+        self.assertEqual(self.client.get('/api/login/').status_code, 405)
+
+    def test_permission_denied(self):
+        response = self.client.get('/api/list/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(
+            response.json(), {'error': 'Authentication required.'})
+        response = self.client.post('/api/totp/verify/1/')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(OTP_TOTP_THROTTLE_FACTOR=0)
+    def test_api(self):
+        user = UserFactory()
+        self.assertEqual(
+            self.api_login(user),
+            {'verified': False, 'setup': True, 'devices': []})
+
+        response = self.client.get('/api/list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        plugins = response.json()['plugins']
+        self.assertIn(
+            {'slug': 'totp', 'name': 'TOTP', 'devices': []}, plugins)
+
+        # Enrollment returns the provisioning uri.
+        response = self.client.get('/api/totp/create/')
+        data = response.json()
+        self.assertEqual(data['fields'], ['name', 'otp_token'])
+        totp = self.totp_from_uri(data['provisioning_uri'])
+        self.assertIn('no-store', response['Cache-Control'])
+
+        response = self.client.post(
+            '/api/totp/create/', {'otp_token': 'XXX', 'name': 'My Phone'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['errors']['__all__'][0]['message'],
+            'Unable to validate the token with the device.')
+
+        with handle_signal(mfa_added) as handler:
+            response = self.client.post(
+                '/api/totp/create/',
+                {'otp_token': totp.token(), 'name': 'My Phone'})
+            handler.assert_called_once()
+        self.assertEqual(response.status_code, 201)
+        device = user.totpdevice_set.get()
+        self.assertEqual(response.json(), {'device': {
+            'plugin': 'totp', 'id': device.pk, 'name': 'My Phone',
+            'confirmed': True}})
+
+        # The device list supports conditional requests.
+        response = self.client.get('/api/list/')
+        self.assertIn(
+            {'slug': 'totp', 'name': 'TOTP', 'devices': [{
+                'plugin': 'totp', 'id': device.pk, 'name': 'My Phone',
+                'confirmed': True}]},
+            response.json()['plugins'])
+        etag = response['ETag']
+        response = self.client.get('/api/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.logout()
+
+        # Login requires verification of the device.
+        data = self.api_login(user)
+        verify_url = '/api/totp/verify/{}/'.format(device.pk)
+        self.assertEqual(data['devices'][0]['url'], verify_url)
+        self.assertFalse(data['setup'])
+        self.assertEqual(self.client.get('/api/list/').status_code, 403)
+
+        response = self.client.get(verify_url)
+        self.assertEqual(response.json()['device']['id'], device.pk)
+
+        with handle_signal(user_login_failed) as handler:
+            response = self.client.post(verify_url, {'otp_token': '123'})
+            handler.assert_called_once_with(
+                credentials={'username': user.username}, user=user,
+                device=device, sender=mock.ANY, request=mock.ANY,
+                signal=user_login_failed)
+        self.assertEqual(response.status_code, 400)
+
+        totp.drift = 1
+        response = self.client.post(verify_url, {'otp_token': totp.token()})
+        self.assertEqual(response.json(), {'verified': True})
+
+        response = self.client.get('/api/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with handle_signal(mfa_removed) as handler:
+            response = self.client.delete(
+                '/api/totp/delete/{}/'.format(device.pk))
+            handler.assert_called_once()
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(user.totpdevice_set.exists())
+
+        response = self.client.get('/api/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_device_list_etag(self):
+        # Without the device list cache the ETag is computed from the devices,
+        # changes outside the kleides_mfa views are not missed.
+        user = UserFactory()
+        self.api_login(user)
+        etag = self.client.get('/api/list/')['ETag']
+        response = self.client.get('/api/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+        user.totpdevice_set.create(name='test', confirmed=False)
+        response = self.client.get('/api/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_device(self):
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        self.api_login(user)
+        device.delete()
+        response = self.client.get(
+            '/api/totp/verify/{}/'.format(device.pk))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+import json
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from kleides_mfa.audit import audit_log
+from kleides_mfa.models import AuditLogEntry
+from kleides_mfa.registry import registry
+from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+
+from .factories import UserFactory
+
+
+@override_settings(KLEIDES_MFA_AUDIT_LOG=True, OTP_STATIC_THROTTLE_FACTOR=0)
+class AuditLogTestCase(TestCase):
+    def tearDown(self):
+        # Buffered entries are not rolled back with the test.
+        audit_log.flush()
+
+    def login(self, user):
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password},
+            REMOTE_ADDR='192.0.2.1')
+
+    def test_audit_log(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        verify_url = '/recovery-code/verify/{}/'.format(device.pk)
+
+        # The entries are buffered until the batch size is reached.
+        with override_settings(KLEIDES_MFA_AUDIT_LOG_FLUSH_INTERVAL=60):
+            self.login(user)
+            self.client.post(
+                verify_url, {'otp_token': 'bad'}, REMOTE_ADDR='192.0.2.1')
+            self.assertFalse(AuditLogEntry.objects.exists())
+            with override_settings(KLEIDES_MFA_AUDIT_LOG_BATCH_SIZE=2):
+                self.client.post(
+                    verify_url, {'otp_token': 'token1'},
+                    REMOTE_ADDR='192.0.2.1')
+
+        session = self.client.session
+        session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+        session.save()
+        # By default the entries are written at the end of every request.
+        self.client.post('/recovery-code/delete/{}/'.format(device.pk))
+
+        self.assertEqual(list(AuditLogEntry.objects.order_by('pk').values_list(
+            'action', 'plugin', 'persistent_id', 'user', 'ip_address')), [
+            ('failed', 'recovery-code', device.persistent_id, user.pk,
+             '192.0.2.1'),
+            ('verified', 'recovery-code', device.persistent_id, user.pk,
+             '192.0.2.1'),
+            ('removed', 'recovery-code', device.persistent_id, user.pk,
+             '127.0.0.1'),
+        ])
+
+    def test_audit_log_write_failure(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        audit_log.record(
+            RequestFactory().get('/'), AuditLogEntry.VERIFIED,
+            registry.get_plugin('recovery-code'), device, user=user)
+        with mock.patch.object(
+                AuditLogEntry.objects, 'bulk_create',
+                side_effect=DatabaseError('read only')):
+            with self.assertLogs('kleides_mfa.audit', 'ERROR') as logs:
+                audit_log.request_finished()
+        self.assertIn('Unable to write 1 audit log entries', logs.output[0])
+        # The failed entries are not written again.
+        audit_log.flush()
+        self.assertFalse(AuditLogEntry.objects.exists())
+
+    def test_audit_log_export(self):
+        user = UserFactory()
+        AuditLogEntry.objects.create(
+            action='verified', plugin='totp', persistent_id='otp.1',
+            user=user, ip_address='192.0.2.1')
+        AuditLogEntry.objects.create(
+            action='failed', plugin='totp', persistent_id='otp.1')
+
+        stdout = StringIO()
+        call_command('kleides_mfa_audit_log', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(
+            lines[0],
+            'created,action,plugin,persistent_id,user_id,ip_address')
+        self.assertTrue(lines[1].endswith(
+            ',verified,totp,otp.1,{},192.0.2.1'.format(user.pk)))
+        self.assertTrue(lines[2].endswith(',failed,totp,otp.1,,'))
+
+        stdout = StringIO()
+        call_command(
+            'kleides_mfa_audit_log', format='jsonl', user=user.pk,
+            since='2000-01-01T00:00', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['user_id'], user.pk)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from django_otp import DEVICE_ID_SESSION_KEY
+
+from kleides_mfa.views.auth_request import AuthRequestView
+from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+
+from .factories import UserFactory
+
+
+class AuthRequestTestCase(TestCase):
+    levels = ('single-factor', 'verified', 'recently-verified')
+
+    def tearDown(self):
+        AuthRequestView.cache.clear()
+
+    def login_with_mfa(self, user, verified_on):
+        device = user.totpdevice_set.get_or_create(name='test')[0]
+        user.otp_device = device
+        self.client.force_login(user)
+        session = self.client.session
+        session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+        session[VERIFIED_SESSION_KEY] = verified_on.isoformat()
+        session.save()
+
+    def assertStatus(self, *expected):
+        for level, status_code in zip(self.levels, expected):
+            response = self.client.get('/auth-request/{}/'.format(level))
+            self.assertEqual(response.status_code, status_code, level)
+
+    @override_settings(KLEIDES_MFA_VERIFIED_TIMEOUT=60)
+    def test_auth_request(self):
+        self.assertStatus(401, 401, 401)
+        response = self.client.get('/auth-request/unknown/')
+        self.assertEqual(response.status_code, 404)
+
+        user = UserFactory()
+        self.client.force_login(user)
+        self.assertStatus(200, 403, 403)
+
+        self.login_with_mfa(
+            user, verified_on=timezone.now() - timedelta(seconds=90))
+        self.assertStatus(200, 200, 403)
+
+        self.login_with_mfa(user, verified_on=timezone.now())
+        self.assertStatus(200, 200, 200)
+        response = self.client.post('/auth-request/verified/')
+        self.assertEqual(response['X-Kleides-Mfa-User'], user.username)
+
+    def test_recently_verified_update(self):
+        user = UserFactory()
+        self.login_with_mfa(user, verified_on=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/auth-request/verified/')
+
+        # The session is not saved while the verification time is recent.
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/auth-request/recently-verified/')
+        self.assertEqual(response.status_code, 200)
+
+        verified_on = timezone.now() - timedelta(seconds=90)
+        self.login_with_mfa(user, verified_on=verified_on)
+        response = self.client.get('/auth-request/recently-verified/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(
+            self.client.session[VERIFIED_SESSION_KEY],
+            verified_on.isoformat())
+
+    @override_settings(KLEIDES_MFA_AUTH_REQUEST_CACHE_TIMEOUT=60)
+    def test_auth_request_cache(self):
+        user = UserFactory()
+        self.login_with_mfa(user, verified_on=timezone.now())
+        self.assertStatus(200, 200, 200)
+
+        # Passed requests are answered from the cache.
+        with self.assertNumQueries(0):
+            response = self.client.get('/auth-request/verified/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Kleides-Mfa-User'], user.username)
+
+        # Denied requests are not cached.
+        self.client.logout()
+        self.assertStatus(401, 401, 401)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from kleides_mfa.events import deferred_receiver, disconnect_deferred
+from kleides_mfa.models import AuditLogEntry, OutboxEvent, UserMfaStatus
+from kleides_mfa.signals import (
+    mfa_bulk_removed, mfa_bulk_updated, mfa_removed)
+
+from .factories import UserFactory
+
+
+class BulkCommandTestCase(TestCase):
+    def setUp(self):
+        self.receiver = mock.Mock()
+        for signal in (mfa_bulk_removed, mfa_bulk_updated, mfa_removed):
+            signal.connect(self.receiver)
+            self.addCleanup(signal.disconnect, self.receiver)
+
+    def call_command(self, name, **options):
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(name, interactive=False, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    @override_settings(KLEIDES_MFA_USER_STATUS=True)
+    def test_remove_devices(self):
+        users = UserFactory.create_batch(3)
+        for user in users:
+            user.totpdevice_set.create(name='totp')
+            user.staticdevice_set.create(name='static')
+        other_user = UserFactory()
+        other_user.totpdevice_set.create(name='totp')
+
+        output = self.call_command(
+            'kleides_mfa_remove_devices', plugins=['totp'],
+            users=[user.pk for user in users], chunk_size=2)
+        self.assertEqual(output.splitlines(), [
+            'Processed 2 users: 2 totp',
+            'Processed 3 users: 3 totp',
+            'Done, 3 users: 3 totp',
+        ])
+        for user in users:
+            self.assertFalse(user.totpdevice_set.exists())
+            self.assertTrue(user.staticdevice_set.exists())
+            self.assertEqual(
+                UserMfaStatus.objects.get(user=user).plugin_slugs,
+                ['recovery-code'])
+        self.assertTrue(other_user.totpdevice_set.exists())
+
+        # A signal is sent per chunk and plugin.
+        self.assertEqual(self.receiver.call_count, 2)
+        self.assertEqual(
+            [len(call.kwargs['devices'])
+             for call in self.receiver.call_args_list], [2, 1])
+        for call in self.receiver.call_args_list:
+            self.assertEqual(call.kwargs['signal'], mfa_bulk_removed)
+            self.assertEqual(call.kwargs['plugin'].slug, 'totp')
+
+        # All devices of the users.
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write('{}\n\n{}\n'.format(users[0].pk, other_user.pk))
+            f.flush()
+            output = self.call_command(
+                'kleides_mfa_remove_devices', users_file=f.name)
+        self.assertEqual(
+            output.splitlines()[-1], 'Done, 2 users: 1 recovery-code, 1 totp')
+        self.assertFalse(other_user.totpdevice_set.exists())
+        self.assertEqual(UserMfaStatus.objects.get(
+            user=other_user).device_count, 0)
+
+    @override_settings(
+        KLEIDES_MFA_AUDIT_LOG=True,
+        KLEIDES_MFA_EVENT_DISPATCHER=(
+            'kleides_mfa.events.OutboxEventDispatcher'))
+    def test_remove_devices_audit_log_and_events(self):
+        receiver = mock.Mock()
+        deferred_receiver('mfa_bulk_removed')(receiver)
+        self.addCleanup(disconnect_deferred, 'mfa_bulk_removed', receiver)
+        user = UserFactory()
+        devices = [
+            user.totpdevice_set.create(name='totp'),
+            user.totpdevice_set.create(name='backup')]
+
+        self.call_command('kleides_mfa_remove_devices', plugins=['totp'])
+        self.assertEqual(sorted(AuditLogEntry.objects.values_list(
+            'action', 'plugin', 'persistent_id', 'user', 'ip_address')), [
+            ('removed', 'totp', device.persistent_id, user.pk, None)
+            for device in devices])
+        event = OutboxEvent.objects.get(name='mfa_bulk_removed').payload
+        self.assertEqual(event['plugin'], 'totp')
+        self.assertEqual(
+            [device['persistent_id'] for device in event['devices']],
+            [device.persistent_id for device in devices])
+
+    def test_remove_devices_options(self):
+        with self.assertRaisesMessage(CommandError, 'Select the devices'):
+            call_command('kleides_mfa_remove_devices', interactive=False)
+        with self.assertRaisesMessage(CommandError, "Unknown plugin 'sms'."):
+            call_command(
+                'kleides_mfa_remove_devices', plugins=['sms'],
+                interactive=False)
+        with self.assertRaisesMessage(CommandError, 'at least 1'):
+            call_command(
+                'kleides_mfa_remove_devices', plugins=['totp'], chunk_size=0,
+                interactive=False)
+
+        user = UserFactory()
+        user.totpdevice_set.create(name='totp')
+        stdout = StringIO()
+        with mock.patch('builtins.input', return_value='no') as input:
+            call_command(
+                'kleides_mfa_remove_devices', plugins=['totp'], stdout=stdout)
+        input.assert_called_once_with(
+            'Remove the totp devices of all users? Type "yes" to continue: ')
+        self.assertEqual(stdout.getvalue(), 'Cancelled.\n')
+        self.assertTrue(user.totpdevice_set.exists())
+
+    def test_regenerate_recovery_codes(self):
+        users = UserFactory.create_batch(2)
+        for user in users:
+            device = user.staticdevice_set.create(name='static')
+            device.token_set.create(token='token1')
+        UserFactory()
+
+        output = self.call_command('kleides_mfa_regenerate_recovery_codes')
+        self.assertEqual(
+            output.splitlines()[-1], 'Done, 3 users: 2 recovery-code')
+        for user in users:
+            tokens = list(user.staticdevice_set.get().token_set.values_list(
+                'token', flat=True))
+            self.assertEqual(len(tokens), 10)
+            self.assertNotIn('token1', tokens)
+        self.receiver.assert_called_once()
+        self.assertEqual(
+            self.receiver.call_args.kwargs['signal'], mfa_bulk_updated)
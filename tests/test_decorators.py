@@ -1,6 +1,9 @@
 from datetime import timedelta
+from unittest.mock import patch
 
+from asgiref.sync import async_to_sync, iscoroutinefunction
 from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
 from django.test import RequestFactory, TestCase
@@ -9,7 +12,11 @@ from django.utils import timezone
 
 from django_otp import DEVICE_ID_SESSION_KEY
 
-from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+from kleides_mfa.middleware import KleidesAuthenticationMiddleware
+
+from kleides_mfa.registry import registry
+from kleides_mfa.views.mixins import (
+    VERIFIED_SESSION_KEY, ais_recently_verified, resolve_login_url)
 from kleides_mfa.decorators import (
     create_decorator, single_factor_required, multi_factor_required,
     recent_multi_factor_required, setup_or_mfa_required,
@@ -42,6 +49,14 @@ class KleidesMfaDecoratorTestCase(TestCase):
         request.session[VERIFIED_SESSION_KEY] = verified_on.isoformat()
         return request
 
+    def async_request(self, request):
+        user = request.user
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
     def test_create_decorator(self):
         with self.assertRaises(ValueError):
             create_decorator(lambda r: r.user.is_verified)
@@ -64,6 +79,27 @@ class KleidesMfaDecoratorTestCase(TestCase):
         response = view_test(request)
         self.assertEqual(response.status_code, 302)
 
+    def test_login_redirect(self):
+        @single_factor_required
+        def view_test(request):
+            return HttpResponse('view_test')
+
+        request = self.request(AnonymousUser())
+        response = view_test(request)
+        self.assertEqual(response['Location'], '/login/?next=/view_test/')
+        self.assertEqual(
+            resolve_login_url('kleides_mfa:login'), ('/login/', '', ''))
+
+        # The resolved login url is refreshed when the setting changes.
+        with override_settings(LOGIN_URL='https://sso.example.com/login/'):
+            response = view_test(request)
+            self.assertEqual(
+                response['Location'],
+                'https://sso.example.com/login/'
+                '?next=http%3A//testserver/view_test/')
+        response = view_test(request)
+        self.assertEqual(response['Location'], '/login/?next=/view_test/')
+
     def test_single_factor_required(self):
         @single_factor_required(raise_exception=True)
         def view_test(request):
@@ -168,3 +204,146 @@ class KleidesMfaDecoratorTestCase(TestCase):
         request = self.mfa_request(UserFactory())
         response = view_test(request)
         self.assertEqual(response.status_code, 200)
+
+    def test_async_views(self):
+        @single_factor_required
+        async def single_factor_view(request):
+            return HttpResponse('view_test')
+
+        @multi_factor_required(raise_exception=True)
+        async def multi_factor_view(request):
+            return HttpResponse('view_test')
+
+        @setup_or_mfa_required(raise_exception=True)
+        async def setup_view(request):
+            return HttpResponse('view_test')
+
+        # Async views are wrapped with async views.
+        self.assertTrue(iscoroutinefunction(single_factor_view))
+
+        request = self.async_request(self.request(AnonymousUser()))
+        response = async_to_sync(single_factor_view)(request)
+        self.assertEqual(response['Location'], '/login/?next=/view_test/')
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(setup_view)(request)
+
+        request = self.async_request(self.request(UserFactory()))
+        response = async_to_sync(single_factor_view)(request)
+        self.assertEqual(response.status_code, 200)
+        response = async_to_sync(setup_view)(request)
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(multi_factor_view)(request)
+
+        request.user.totpdevice_set.get_or_create(name='test')
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(setup_view)(request)
+
+        request = self.async_request(self.mfa_request(UserFactory()))
+        response = async_to_sync(multi_factor_view)(request)
+        self.assertEqual(response.status_code, 200)
+        response = async_to_sync(setup_view)(request)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(KLEIDES_MFA_VERIFIED_TIMEOUT=60)
+    def test_async_views_without_auser(self):
+        # Django < 5.0 requests have no auser().
+        @setup_or_recent_mfa_required(raise_exception=True)
+        async def setup_recent_view(request):
+            return HttpResponse('view_test')
+
+        request = self.request(UserFactory())
+        response = async_to_sync(setup_recent_view)(request)
+        self.assertEqual(response.status_code, 200)
+        request.user.totpdevice_set.get_or_create(name='test')
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(setup_recent_view)(request)
+
+        request = self.mfa_request(UserFactory())
+        response = async_to_sync(setup_recent_view)(request)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(KLEIDES_MFA_VERIFIED_TIMEOUT=60)
+    def test_async_recent_views(self):
+        @recent_multi_factor_required(raise_exception=True)
+        async def recent_view(request):
+            return HttpResponse('view_test')
+
+        @setup_or_recent_mfa_required(raise_exception=True)
+        async def setup_recent_view(request):
+            return HttpResponse('view_test')
+
+        request = self.async_request(self.request(UserFactory()))
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(recent_view)(request)
+        response = async_to_sync(setup_recent_view)(request)
+        self.assertEqual(response.status_code, 200)
+
+        request = self.async_request(self.mfa_request(
+            UserFactory(), verified_on=timezone.now() - timedelta(seconds=90)))
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(recent_view)(request)
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(setup_recent_view)(request)
+
+        request = self.async_request(self.mfa_request(
+            UserFactory(), verified_on=timezone.now() - timedelta(seconds=30)))
+        response = async_to_sync(recent_view)(request)
+        self.assertEqual(response.status_code, 200)
+        response = async_to_sync(setup_recent_view)(request)
+        self.assertEqual(response.status_code, 200)
+        # The verification time is updated.
+        self.assertGreater(
+            request.session[VERIFIED_SESSION_KEY],
+            (timezone.now() - timedelta(seconds=5)).isoformat())
+
+    @override_settings(KLEIDES_MFA_VERIFIED_TIMEOUT=120)
+    def test_async_recently_verified_update_interval(self):
+        verified_on = timezone.now() - timedelta(seconds=30)
+        request = self.async_request(self.mfa_request(
+            UserFactory(), verified_on=verified_on))
+        self.assertTrue(async_to_sync(ais_recently_verified)(
+            request, update_interval=60))
+        # The verification time is not updated within the interval.
+        self.assertEqual(
+            request.session[VERIFIED_SESSION_KEY], verified_on.isoformat())
+        self.assertTrue(async_to_sync(ais_recently_verified)(
+            request, update_interval=10))
+        self.assertGreater(
+            request.session[VERIFIED_SESSION_KEY], verified_on.isoformat())
+
+    def test_async_device_list_without_async_queryset(self):
+        # Django < 4.1 querysets have no async iteration.
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        plugin = registry.get_plugin('totp')
+        queryset = plugin.model.objects.devices_for_user(user, True)
+        with patch.object(
+                plugin.model.objects, 'devices_for_user',
+                return_value=(device for device in queryset)):
+            devices = async_to_sync(plugin.aget_user_devices)(user)
+        self.assertEqual(devices, [device])
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse('view_test')
+
+        middleware = KleidesAuthenticationMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        other_device = UserFactory().totpdevice_set.create(name='test')
+        for persistent_id, otp_device in (
+                (device.persistent_id, device),
+                (other_device.persistent_id, None)):
+            request = self.async_request(self.request(user))
+            request.session = SessionStore()
+            request.session[DEVICE_ID_SESSION_KEY] = persistent_id
+            async_to_sync(middleware)(request)
+            auser = async_to_sync(request.auser)()
+            self.assertEqual(auser.otp_device, otp_device)
+            self.assertIs(async_to_sync(request.auser)(), auser)
+            self.assertEqual(
+                DEVICE_ID_SESSION_KEY in request.session,
+                otp_device is not None)
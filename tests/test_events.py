@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from django_otp import DEVICE_ID_SESSION_KEY
+
+from kleides_mfa.events import (
+    OutboxEventDispatcher, deferred_receiver, disconnect_deferred,
+    get_dispatcher)
+from kleides_mfa.models import OutboxEvent
+from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+
+from .factories import UserFactory
+
+
+class EventsTestCase(TestCase):
+    def setUp(self):
+        self.receiver = mock.Mock()
+        for name in ('mfa_removed', 'login_failed'):
+            deferred_receiver(name)(self.receiver)
+            self.addCleanup(disconnect_deferred, name, self.receiver)
+
+    def login_with_mfa(self, user):
+        device = user.totpdevice_set.create(name='test')
+        user.otp_device = device
+        self.client.force_login(user)
+        session = self.client.session
+        session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+        session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+        session.save()
+        return device
+
+    def test_thread_dispatcher(self):
+        user = UserFactory()
+        device = self.login_with_mfa(user)
+        self.client.logout()
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/totp/verify/{}/'.format(device.pk), {'otp_token': 'XXX'},
+                REMOTE_ADDR='192.0.2.1')
+        get_dispatcher().join()
+
+        self.receiver.assert_called_once()
+        event = self.receiver.call_args[0][0]
+        self.assertEqual(event['name'], 'login_failed')
+        self.assertEqual(event['username'], user.username)
+        self.assertEqual(event['user']['pk'], user.pk)
+        self.assertEqual(
+            event['device']['persistent_id'], device.persistent_id)
+        self.assertEqual(event['request']['remote_addr'], '192.0.2.1')
+
+    @override_settings(
+        KLEIDES_MFA_EVENT_DISPATCHER=(
+            'kleides_mfa.events.OutboxEventDispatcher'))
+    def test_outbox_dispatcher(self):
+        user = UserFactory()
+        device = self.login_with_mfa(user)
+        self.client.post('/totp/delete/{}/'.format(device.pk))
+        self.receiver.assert_not_called()
+        outbox_event = OutboxEvent.objects.get()
+        self.assertEqual(outbox_event.name, 'mfa_removed')
+        self.assertIsNone(outbox_event.delivered)
+
+        # Failed events are delivered again after the retry delay.
+        self.receiver.side_effect = ValueError('unavailable')
+        with self.assertLogs('kleides_mfa.events', 'ERROR'):
+            call_command('kleides_mfa_deliver_events', verbosity=0)
+        outbox_event.refresh_from_db()
+        self.assertIsNone(outbox_event.delivered)
+        self.assertEqual(outbox_event.attempts, 1)
+        self.assertIn("ValueError('unavailable')", outbox_event.last_error)
+        self.assertGreater(outbox_event.next_attempt, timezone.now())
+        self.receiver.reset_mock(side_effect=True)
+        call_command('kleides_mfa_deliver_events', verbosity=0)
+        self.receiver.assert_not_called()
+
+        OutboxEvent.objects.update(next_attempt=timezone.now())
+        call_command('kleides_mfa_deliver_events', verbosity=0)
+        self.receiver.assert_called_once_with(outbox_event.payload)
+        self.assertEqual(outbox_event.payload['device']['pk'], device.pk)
+        outbox_event.refresh_from_db()
+        self.assertIsNotNone(outbox_event.delivered)
+
+    @override_settings(KLEIDES_MFA_EVENT_MAX_ATTEMPTS=2)
+    def test_outbox_dead_letter(self):
+        dispatcher = OutboxEventDispatcher()
+        failed_event = OutboxEvent.objects.create(
+            name='mfa_removed', payload={'name': 'mfa_removed'})
+        self.receiver.side_effect = [ValueError, ValueError, None]
+        with self.assertLogs('kleides_mfa.events', 'ERROR') as logs:
+            self.assertEqual(dispatcher.deliver(), (0, 1))
+            OutboxEvent.objects.update(next_attempt=timezone.now())
+            self.assertEqual(dispatcher.deliver(), (0, 1))
+        self.assertIn('failed 2 times and is not retried', logs.output[-1])
+        failed_event.refresh_from_db()
+        self.assertIsNone(failed_event.next_attempt)
+        self.assertIsNone(failed_event.delivered)
+
+        # A failed event does not hold back the newer events.
+        outbox_event = OutboxEvent.objects.create(
+            name='mfa_removed', payload={'name': 'mfa_removed'})
+        self.assertEqual(dispatcher.deliver(batch_size=1), (1, 0))
+        outbox_event.refresh_from_db()
+        self.assertIsNotNone(outbox_event.delivered)
+        self.assertEqual(self.receiver.call_count, 3)
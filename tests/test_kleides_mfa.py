@@ -1,27 +1,37 @@
 # -*- coding: utf-8 -*-
 from datetime import timedelta
 from unittest import mock
+import warnings
 
 from django.conf import settings
 from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.db import connection
 from django.shortcuts import resolve_url
+from django.core.cache import cache
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
 from django_otp import DEVICE_ID_SESSION_KEY
 from django_otp.plugins.otp_totp.models import TOTPDevice
 
+from kleides_mfa.cache import device_list_version
 from kleides_mfa.conf import app_settings
 from kleides_mfa.forms import DeviceUpdateForm
 from kleides_mfa.registry import AlreadyRegistered, registry
-from kleides_mfa.views.mixins import SESSION_KEY, VERIFIED_SESSION_KEY
+from kleides_mfa.trusted_browsers import revoke_trusted_browsers
+from kleides_mfa.views.mixins import (
+    SESSION_KEY, VERIFIED_SESSION_KEY, is_recently_verified)
 
 from .factories import UserFactory
 from .utils import handle_signal
 
 
 class KleidesMfaTestCase(TestCase):
+    def tearDown(self):
+        # Cached device lists are not rolled back with the users.
+        cache.clear()
+
     def login(self, user, redirect_to='/list/', login_url='/login/'):
         # The LoginView prepares the session for 2 step authentication.
         response = self.client.post(
@@ -154,6 +164,43 @@ class KleidesMfaTestCase(TestCase):
         self.assertFalse(context_user.is_authenticated)
         self.assertFalse(context_user.is_verified)
 
+    @override_settings(KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT=300)
+    def test_device_list_cache(self):
+        user = UserFactory()
+        self.login_with_mfa(user)
+        device = user.totpdevice_set.get()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/list/')
+        self.assertContains(response, 'test')
+        uncached_queries = len(queries)
+
+        # The cached device lists skip the device queries.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/list/')
+        self.assertContains(response, 'test')
+        cached_plugins = [
+            plugin for plugin in registry.plugins()
+            if plugin.cache_device_list]
+        self.assertEqual(
+            len(queries), uncached_queries - len(cached_plugins))
+        version = device_list_version(user)
+
+        # Changes are visible once they are committed.
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.post(
+                '/totp/update/{}/'.format(device.pk), {'name': 'Secure Phone'})
+            self.assertEqual(device_list_version(user), version)
+        self.assertTrue(callbacks)
+        self.assertNotEqual(device_list_version(user), version)
+        response = self.client.get('/list/')
+        self.assertContains(response, 'Secure Phone')
+
+        with override_settings(KLEIDES_MFA_DEVICE_LIST_CACHE_TIMEOUT=0):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/list/')
+            self.assertEqual(len(queries), uncached_queries)
+
     @override_settings(KLEIDES_MFA_VERIFIED_TIMEOUT=None)
     def test_recently_verified(self):
         user = UserFactory()
@@ -173,6 +220,70 @@ class KleidesMfaTestCase(TestCase):
             response = self.client.get('/totp/create/')
             self.assertRedirects(response, '/login/?next=/totp/create/')
 
+    @override_settings(KLEIDES_MFA_TRUSTED_BROWSER_DAYS=30)
+    def test_trusted_browser(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        verify_url = '/recovery-code/verify/{}/?next=/list/'.format(device.pk)
+
+        def logout():
+            # The test client logout also removes the trusted cookie.
+            trusted = self.client.cookies.get('kleides_mfa_trusted')
+            self.client.logout()
+            if trusted is not None:
+                self.client.cookies[trusted.key] = trusted.value
+
+        def verify(**data):
+            self.client.logout()
+            self.login(user, verify_url)
+            token = device.token_set.create(token=str(timezone.now()))
+            return self.client.post(
+                verify_url, dict(data, otp_token=token.token))
+
+        # Verify the device without trusting the browser.
+        response = verify()
+        self.assertRedirects(response, '/list/')
+        self.assertNotIn('kleides_mfa_trusted', response.cookies)
+        logout()
+        self.login(user, verify_url)
+
+        # The trusted browser is verified without a token and the cookie is
+        # rotated. Recently verified views still require a token.
+        response = verify(trust_browser='on')
+        self.assertIn('kleides_mfa_trusted', response.cookies)
+        logout()
+        response = self.client.post(
+            '/login/', {'username': user.username,
+                        'password': user.raw_password})
+        self.assertRedirects(response, '/list/')
+        self.assertIn('kleides_mfa_trusted', response.cookies)
+        response = self.client.get('/list/')
+        self.assertTrue(response.context['user'].is_verified)
+        response = self.client.get('/totp/create/')
+        self.assertRedirects(response, '/login/?next=/totp/create/')
+
+        # The trust is revoked per user, globally and by a password change.
+        def change_password():
+            user.raw_password = 'changed'
+            user.set_password(user.raw_password)
+            user.save()
+
+        for revoke in (
+                lambda: revoke_trusted_browsers(user),
+                revoke_trusted_browsers, change_password):
+            verify(trust_browser='on')
+            revoke()
+            logout()
+            self.login(user, verify_url)
+
+        # Removing a device revokes the trust of the user.
+        verify(trust_browser='on')
+        other = user.totpdevice_set.create(name='other')
+        response = self.client.post('/totp/delete/{}/'.format(other.pk))
+        self.assertRedirects(response, '/list/')
+        logout()
+        self.login(user, verify_url)
+
     def test_secure_admin(self):
         # Users must be verified to access the admin interface.
         user = UserFactory(is_staff=True, is_superuser=True)
@@ -183,8 +294,13 @@ class KleidesMfaTestCase(TestCase):
 
         self.login_with_mfa(user)
 
-        response = self.client.get('/admin/', follow=True)
+        # The verification is checked once per request.
+        with mock.patch(
+                'kleides_mfa.admin.is_recently_verified',
+                wraps=is_recently_verified) as recently_verified:
+            response = self.client.get('/admin/', follow=True)
         self.assertEqual(response.status_code, 200)
+        recently_verified.assert_called_once()
 
     def test_login_redirect(self):
         user = UserFactory()
@@ -241,8 +357,10 @@ class KleidesMfaTestCase(TestCase):
     def test_plugin(self):
         # Plugins are allowed to use the same device/model.
         totp_plugin = registry.get_plugin('totp')
+        # Form classes can be dotted paths that are imported on first use.
         registry.register(
-            'TEST', TOTPDevice, update_form_class=DeviceUpdateForm)
+            'TEST', TOTPDevice,
+            update_form_class='kleides_mfa.forms.DeviceUpdateForm')
         plugin = registry.get_plugin('test')
         self.assertEqual(plugin.model, totp_plugin.model)
         self.assertEqual(str(plugin), 'TEST')
@@ -252,9 +370,26 @@ class KleidesMfaTestCase(TestCase):
             "'django_otp.plugins.otp_totp.models.TOTPDevice'>)")
 
         self.assertIsNone(plugin.get_create_form_class())
-        self.assertIsNotNone(plugin.get_update_form_class())
+        self.assertIs(plugin.get_update_form_class(), DeviceUpdateForm)
         self.assertIsNone(plugin.get_verify_form_class())
 
+        # Generated form classes are created once.
+        self.assertIs(
+            totp_plugin.get_delete_form_class(),
+            totp_plugin.get_delete_form_class())
+        self.assertIs(
+            totp_plugin.get_update_form_class(),
+            totp_plugin.get_update_form_class())
+        self.assertIsNot(
+            totp_plugin.get_update_form_class(),
+            totp_plugin.get_delete_form_class())
+        form_classes = dict(registry.form_classes())
+        self.assertEqual(
+            form_classes[totp_plugin], totp_plugin.get_form_classes())
+        self.assertIs(
+            form_classes[totp_plugin]['delete'],
+            totp_plugin.get_delete_form_class())
+
         # But the name must be unique.
         with self.assertRaises(AlreadyRegistered):
             registry.register('tEsT', TOTPDevice)
@@ -273,3 +408,25 @@ class KleidesMfaTestCase(TestCase):
         # Cannot access django settings on app settings.
         with self.assertRaises(AttributeError):
             app_settings.INSTALLED_APPS
+
+        # Settings are resolved once and do not warn on access.
+        override = override_settings(KLEIDES_MFA_PATCH_ADMIN=True)
+        with self.assertWarns(DeprecationWarning):
+            override.enable()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                self.assertTrue(app_settings.KLEIDES_MFA_PATCH_ADMIN)
+        finally:
+            override.disable()
+        self.assertFalse(app_settings.KLEIDES_MFA_PATCH_ADMIN)
+
+        # The plugin order follows the plugin priority setting.
+        with override_settings(
+                KLEIDES_MFA_PLUGIN_PRIORITY=('recovery-code', 'totp')):
+            self.assertEqual(
+                [plugin.slug for plugin in registry.plugins()],
+                ['recovery-code', 'totp'])
+        self.assertEqual(
+            [plugin.slug for plugin in registry.plugins()][-2:],
+            ['totp', 'recovery-code'])
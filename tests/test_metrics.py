@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import socket
+
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+from kleides_mfa.metrics import MetricsView, get_sink
+from kleides_mfa.registry import registry
+
+from .factories import UserFactory
+
+
+@override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+class MetricsTestCase(TestCase):
+    def verify(self, user, tokens):
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        for token in tokens:
+            self.client.post(
+                '/recovery-code/verify/{}/'.format(device.pk),
+                {'otp_token': token})
+        return device
+
+    @override_settings(
+        KLEIDES_MFA_METRICS_SINK='kleides_mfa.metrics.PrometheusSink')
+    def test_prometheus_sink(self):
+        user = UserFactory()
+        self.verify(user, ['bad', 'token1'])
+        plugin = registry.get_plugin('recovery-code')
+        with self.assertRaises(plugin.model.DoesNotExist):
+            plugin.get_user_device(0, user)
+
+        response = MetricsView.as_view()(RequestFactory().get('/metrics/'))
+        self.assertEqual(
+            response['Content-Type'], 'text/plain; version=0.0.4')
+        metrics = response.content.decode().splitlines()
+        self.assertIn(
+            'kleides_mfa_verify_seconds_bucket'
+            '{plugin="recovery-code",le="+Inf"} 2', metrics)
+        self.assertIn(
+            'kleides_mfa_verify_seconds_count{plugin="recovery-code"} 2',
+            metrics)
+        self.assertIn(
+            'kleides_mfa_verify_total'
+            '{plugin="recovery-code",result="failure"} 1', metrics)
+        self.assertIn(
+            'kleides_mfa_verify_total'
+            '{plugin="recovery-code",result="success"} 1', metrics)
+        self.assertIn(
+            'kleides_mfa_device_lookup_total'
+            '{plugin="recovery-code",result="failure"} 1', metrics)
+        self.assertIn(
+            'kleides_mfa_device_lookup_total'
+            '{plugin="recovery-code",result="success"} 2', metrics)
+        self.assertTrue(any(
+            line.startswith(
+                'kleides_mfa_device_list_total'
+                '{plugin="totp",result="success"} ')
+            for line in metrics))
+
+    @override_settings(
+        KLEIDES_MFA_METRICS_SINK='kleides_mfa.metrics.PrometheusSink')
+    def test_create_metrics(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        self.client.get('/totp/create/')
+        self.client.post('/totp/create/', {'otp_token': '123', 'name': 'x'})
+        self.client.post('/local-yubikey/create/', {
+            'name': 'x', 'private_id': '0' * 12, 'key': '0' * 32,
+            'otp_token': 'c' * 44})
+
+        response = MetricsView.as_view()(RequestFactory().get('/metrics/'))
+        metrics = response.content.decode().splitlines()
+        for plugin in ('totp', 'local-yubikey'):
+            self.assertIn(
+                'kleides_mfa_verify_total'
+                '{{plugin="{}",result="failure"}} 1'.format(plugin), metrics)
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        with override_settings(
+                KLEIDES_MFA_METRICS_SINK='kleides_mfa.metrics.StatsdSink',
+                KLEIDES_MFA_METRICS_STATSD_ADDRESS=server.getsockname()):
+            self.addCleanup(get_sink().socket.close)
+            self.verify(UserFactory(), ['bad'])
+
+        packets = {}
+        with self.assertRaises(socket.timeout):
+            while True:
+                lines = server.recv(1024).decode().splitlines()
+                packets[lines[1]] = lines[0]
+                server.settimeout(0.5)
+        self.assertRegex(
+            packets['kleides_mfa.device_lookup.recovery-code.success:1|c'],
+            r'^kleides_mfa\.device_lookup\.recovery-code:[\d.]+\|ms$')
+        self.assertRegex(
+            packets['kleides_mfa.verify.recovery-code.failure:1|c'],
+            r'^kleides_mfa\.verify\.recovery-code:[\d.]+\|ms$')
+        self.assertRegex(
+            packets['kleides_mfa.device_list.totp.success:1|c'],
+            r'^kleides_mfa\.device_list\.totp:[\d.]+\|ms$')
+
+    def test_metrics_disabled(self):
+        self.assertIsNone(get_sink())
+        response = MetricsView.as_view()(RequestFactory().get('/metrics/'))
+        self.assertEqual(response.status_code, 404)
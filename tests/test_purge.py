@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django_otp.plugins.otp_static.models import StaticDevice
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from kleides_mfa.purge import purge_unconfirmed_devices
+
+from .factories import UserFactory
+
+
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        old = timezone.now() - timedelta(days=8)
+        self.confirmed = self.user.totpdevice_set.create(name='confirmed')
+        self.recent = self.user.totpdevice_set.create(
+            name='recent', confirmed=False)
+        self.abandoned = [
+            self.user.totpdevice_set.create(name='old', confirmed=False)
+            for i in range(3)]
+        self.abandoned.append(self.user.staticdevice_set.create(
+            name='static', confirmed=False))
+        for model in (TOTPDevice, StaticDevice):
+            model.objects.filter(confirmed=False).exclude(
+                pk=self.recent.pk).update(created_at=old)
+        self.confirmed.created_at = old
+        self.confirmed.save()
+        self.user.yubikeydevice_set.create(
+            name='yubikey', confirmed=False)
+
+    def test_purge_unconfirmed_devices(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(purge_unconfirmed_devices(batch_size=2), {
+                'totp': 3, 'recovery-code': 1, 'yubikey': None,
+                'local-yubikey': None})
+        # A transaction per batch.
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(
+            set(self.user.totpdevice_set.all()),
+            {self.confirmed, self.recent})
+        self.assertFalse(self.user.staticdevice_set.exists())
+        self.assertTrue(self.user.yubikeydevice_set.exists())
+
+    @override_settings(KLEIDES_MFA_PURGE_UNCONFIRMED_DAYS=10)
+    def test_purge_command(self):
+        stdout = StringIO()
+        call_command('kleides_mfa_purge_devices', stdout=stdout)
+        self.assertIn('totp: purged 0 device(s)', stdout.getvalue())
+
+        stdout = StringIO()
+        call_command('kleides_mfa_purge_devices', days=7, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'yubikey: skipped, the device model has no created_at field',
+            'local-yubikey: skipped, the device model has no created_at '
+            'field',
+            'totp: purged 3 device(s)',
+            'recovery-code: purged 1 device(s)',
+        ])
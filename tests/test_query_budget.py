@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from binascii import unhexlify
+from unittest.mock import patch
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_otp import DEVICE_ID_SESSION_KEY
+from django_otp.oath import TOTP
+from otp_yubikey.models import RemoteYubikeyDevice, ValidationService
+
+from kleides_mfa.forms import TOTP_SESSION_KEY
+from kleides_mfa.middleware import KleidesAuthenticationMiddleware
+from kleides_mfa.query_budget import (
+    QueryBudget, QueryBudgetExceeded, QueryBudgetWarning)
+from kleides_mfa.views.devices import DeviceListView
+from kleides_mfa.views.mixins import VERIFIED_SESSION_KEY
+from kleides_mfa.yubikey import validation_services
+
+from .factories import UserFactory
+
+
+@override_settings(DEBUG=True, KLEIDES_MFA_QUERY_BUDGET='raise')
+class QueryBudgetTestCase(TestCase):
+    def tearDown(self):
+        validation_services.clear()
+        cache.clear()
+
+    def assertStatus(self, response, status_code=200):
+        self.assertEqual(response.status_code, status_code)
+
+    def login(self, user, redirect_to):
+        response = self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        self.assertRedirects(
+            response, redirect_to, fetch_redirect_response=False)
+
+    @override_settings(KLEIDES_MFA_TRUSTED_BROWSER_DAYS=1)
+    def login_and_verify(self, user, plugin, device):
+        verify_url = '/{}/verify/{}/'.format(plugin, device.pk)
+        self.assertStatus(self.client.get('/login/'))
+        self.login(user, '{}?next=/list/'.format(verify_url))
+        self.assertStatus(self.client.get(verify_url))
+        with patch.object(type(device), 'verify_token', return_value=False):
+            self.assertStatus(
+                self.client.post(verify_url, {'otp_token': '123456'}))
+        with patch.object(type(device), 'verify_token', return_value=True):
+            self.assertRedirects(self.client.post(verify_url, {
+                'otp_token': '123456', 'trust_browser': 'on'}),
+                '/list/', fetch_redirect_response=False)
+        # Login with the trusted browser.
+        self.login(user, '/list/')
+
+    def manage_device(self, plugin, device):
+        self.assertStatus(self.client.get('/list/'))
+        self.assertStatus(self.client.get('/{}/create/'.format(plugin)))
+        update_url = '/{}/update/{}/'.format(plugin, device.pk)
+        self.assertStatus(self.client.get(update_url))
+        self.assertRedirects(
+            self.client.post(update_url, {'name': 'Updated'}), '/list/',
+            fetch_redirect_response=False)
+        delete_url = '/{}/delete/{}/'.format(plugin, device.pk)
+        self.assertStatus(self.client.get(delete_url))
+        self.assertRedirects(
+            self.client.post(delete_url), '/list/',
+            fetch_redirect_response=False)
+
+    def test_totp(self):
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        self.login_and_verify(user, 'totp', device)
+        self.manage_device('totp', device)
+
+        # Enroll a new device in the setup stage.
+        self.assertStatus(self.client.get('/totp/create/'))
+        key = unhexlify(self.client.session[TOTP_SESSION_KEY])
+        totp = TOTP(key)
+        totp.time = time.time()
+        self.assertRedirects(
+            self.client.post('/totp/create/', {'otp_token': totp.token()}),
+            '/list/', fetch_redirect_response=False)
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+    def test_recovery_code(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        self.login_and_verify(user, 'recovery-code', device)
+        self.manage_device('recovery-code', device)
+        self.assertRedirects(
+            self.client.post('/recovery-code/create/'), '/list/',
+            fetch_redirect_response=False)
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+    def test_recovery_code_verify(self):
+        # The token verification deletes the used recovery code.
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        verify_url = '/recovery-code/verify/{}/'.format(device.pk)
+        self.login(user, '{}?next=/list/'.format(verify_url))
+        self.assertStatus(
+            self.client.post(verify_url, {'otp_token': 'invalid'}))
+        self.assertRedirects(
+            self.client.post(verify_url, {'otp_token': 'token1'}),
+            '/list/', fetch_redirect_response=False)
+        self.assertFalse(device.token_set.exists())
+
+    @override_settings(KLEIDES_MFA_SESSION_INDEX=True)
+    def test_session_index(self):
+        # The logins and the first device of the setup are indexed.
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        self.login_and_verify(user, 'totp', device)
+        self.manage_device('totp', device)
+        self.assertRedirects(
+            self.client.post('/recovery-code/create/'), '/list/',
+            fetch_redirect_response=False)
+
+    def test_yubikey(self):
+        user = UserFactory()
+        service = ValidationService.objects.latest('pk')
+        device = user.remoteyubikeydevice_set.create(
+            name='test', service=service)
+        self.login_and_verify(user, 'yubikey', device)
+        self.manage_device('yubikey', device)
+        with patch.object(RemoteYubikeyDevice, 'verify_token',
+                          return_value=True):
+            self.assertRedirects(self.client.post('/yubikey/create/', {
+                'service': service.pk, 'otp_token': 'cccccccccccc' + 'x' * 32,
+                'name': 'Keychain'}), '/list/', fetch_redirect_response=False)
+
+    def test_query_budget_exceeded(self):
+        user = UserFactory()
+        device = user.totpdevice_set.create(name='test')
+        user.otp_device = device
+        self.client.force_login(user)
+        session = self.client.session
+        session[DEVICE_ID_SESSION_KEY] = device.persistent_id
+        session[VERIFIED_SESSION_KEY] = timezone.now().isoformat()
+        session.save()
+
+        with patch.object(DeviceListView, 'query_budget', QueryBudget(1)):
+            with self.assertRaisesMessage(
+                    QueryBudgetExceeded, 'DeviceListView executed'):
+                self.client.get('/list/')
+
+            with override_settings(KLEIDES_MFA_QUERY_BUDGET='warn'):
+                with self.assertWarns(QueryBudgetWarning):
+                    self.client.get('/list/')
+
+            with override_settings(DEBUG=False):
+                self.assertStatus(self.client.get('/list/'))
+
+            # The budgets are checked by the QueryBudgetMiddleware.
+            with self.modify_settings(MIDDLEWARE={
+                    'remove': 'kleides_mfa.middleware.QueryBudgetMiddleware'}):
+                client = self.client_class()
+                client.cookies = self.client.cookies
+                self.assertStatus(client.get('/list/'))
+
+        with patch.object(
+                KleidesAuthenticationMiddleware, 'query_budget',
+                QueryBudget(0)):
+            with self.assertRaisesMessage(
+                    QueryBudgetExceeded,
+                    'KleidesAuthenticationMiddleware executed'):
+                self.client.get('/list/')
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 
 from kleides_mfa.registry import registry
@@ -7,6 +8,10 @@ from .factories import UserFactory
 
 
 class DjangoOtpRecoveryTestCase(TestCase):
+    def tearDown(self):
+        # Cached device lists are not rolled back with the users.
+        cache.clear()
+
     def login(self, user, redirect_to='/list/'):
         response = self.client.post(
             '/login/',
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from kleides_mfa.routers import PIN_COOKIE_NAME
+
+from .factories import UserFactory
+
+
+@override_settings(
+    DATABASE_ROUTERS=['kleides_mfa.routers.ReplicaRouter'],
+    KLEIDES_MFA_REPLICA_DATABASE='replica', OTP_STATIC_THROTTLE_FACTOR=0)
+class ReplicaRouterTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def device_queries(self, func):
+        '''
+        Return the databases of the device table queries of func.
+        '''
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            func()
+        return {
+            alias for alias, queries in (
+                ('default', default), ('replica', replica))
+            if any('otp_static' in query['sql'] for query in queries)}
+
+    def test_replica_router(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        verify_url = '/recovery-code/verify/{}/'.format(device.pk)
+
+        # The device inventory of the login is read from the replica.
+        self.assertEqual(self.device_queries(lambda: self.client.post(
+            '/login/', {
+                'username': user.username, 'password': user.raw_password})),
+            {'replica'})
+        self.assertNotIn(PIN_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(
+            self.device_queries(lambda: self.client.get(verify_url)),
+            {'replica'})
+
+        # The verification is pinned to the primary.
+        self.assertEqual(self.device_queries(lambda: self.client.post(
+            verify_url, {'otp_token': 'token1'})), {'default'})
+        self.assertTrue(self.client.cookies[PIN_COOKIE_NAME].value)
+
+        # The browser reads from the primary until the cookie expires.
+        self.assertEqual(
+            self.device_queries(lambda: self.client.get('/list/')),
+            {'default'})
+        del self.client.cookies[PIN_COOKIE_NAME]
+        self.assertEqual(
+            self.device_queries(lambda: self.client.get('/list/')),
+            {'replica'})
+
+    @override_settings(KLEIDES_MFA_REPLICA_DATABASE=None)
+    def test_replica_disabled(self):
+        user = UserFactory()
+        user.staticdevice_set.create(name='test')
+        self.assertEqual(self.device_queries(lambda: self.client.post(
+            '/login/', {
+                'username': user.username, 'password': user.raw_password})),
+            {'default'})
+        self.assertNotIn(PIN_COOKIE_NAME, self.client.cookies)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from kleides_mfa.models import DeviceSession
+from kleides_mfa.session_index import prune_sessions, revoke_sessions
+
+from .factories import UserFactory
+
+
+@override_settings(
+    KLEIDES_MFA_SESSION_INDEX=True, OTP_STATIC_THROTTLE_FACTOR=0)
+class SessionIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.device = self.user.staticdevice_set.create(name='static')
+        self.device.token_set.create(token='token1')
+        self.device.token_set.create(token='token2')
+
+    def verified_client(self, token):
+        client = Client()
+        client.post('/login/', {
+            'username': self.user.username,
+            'password': self.user.raw_password})
+        client.post(
+            '/recovery-code/verify/{}/'.format(self.device.pk),
+            {'otp_token': token})
+        return client
+
+    def test_revoke_sessions(self):
+        clients = [
+            self.verified_client(token) for token in ('token1', 'token2')]
+        self.assertEqual(
+            set(DeviceSession.objects.values_list('session_key', flat=True)),
+            {client.session.session_key for client in clients})
+        self.assertEqual(
+            set(DeviceSession.objects.values_list(
+                'user_id', 'persistent_id')),
+            {(self.user.pk, self.device.persistent_id)})
+        for client in clients:
+            self.assertEqual(client.get('/list/').status_code, 200)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(revoke_sessions(
+                persistent_id=self.device.persistent_id), 2)
+        self.assertFalse(DeviceSession.objects.exists())
+        for client in clients:
+            self.assertEqual(client.get('/list/').status_code, 302)
+
+    def test_logout(self):
+        client = self.verified_client('token1')
+        client.logout()
+        self.assertFalse(DeviceSession.objects.exists())
+
+    def test_prune_sessions(self):
+        client = self.verified_client('token1')
+        expired = timezone.now() - timedelta(minutes=1)
+        DeviceSession.objects.update(expires=expired)
+        DeviceSession.objects.create(
+            user=self.user, persistent_id=self.device.persistent_id,
+            session_key='ended', expires=expired)
+        self.assertEqual(prune_sessions(), 1)
+        # The session that is still in use is kept.
+        entry = DeviceSession.objects.get()
+        self.assertEqual(entry.session_key, client.session.session_key)
+        self.assertGreater(entry.expires, timezone.now())
+
+    def test_revoke_sessions_command(self):
+        self.verified_client('token1')
+        UserFactory().staticdevice_set.create(name='static')
+        stdout = StringIO()
+        call_command(
+            'kleides_mfa_revoke_sessions', user=self.user.pk, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Ended 1 session(s).\n')
+        self.assertFalse(Session.objects.exists())
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+# Modules that are imported on first use instead of at startup.
+LAZY_MODULES = (
+    'kleides_mfa.forms', 'kleides_mfa.views.auth', 'kleides_mfa.views.devices',
+    'kleides_mfa.views.api')
+
+
+def imported_modules(code=''):
+    '''
+    Return the modules imported by django.setup() and the code in a new
+    interpreter.
+    '''
+    result = subprocess.run(
+        [sys.executable, '-c', (
+            'import json, sys, django\n'
+            'django.setup()\n'
+            '{}\n'
+            'print(json.dumps(sorted(sys.modules)))').format(code)],
+        env=dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings'),
+        capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+class StartupTestCase(SimpleTestCase):
+    def test_lazy_imports(self):
+        # Measure the startup with ``python -m benchmarks.startup``.
+        modules = imported_modules()
+        self.assertIn('kleides_mfa.registry', modules)
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, modules)
+
+        # The forms are imported by the first use of a plugin.
+        modules = imported_modules(
+            'from kleides_mfa.registry import registry\n'
+            'registry.get_plugin("totp").get_create_form_class()')
+        self.assertIn('kleides_mfa.forms', modules)
+        self.assertNotIn('kleides_mfa.views.auth', modules)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+from kleides_mfa.models import UserMfaStatus
+from kleides_mfa.registry import registry
+from kleides_mfa.status import update_user_statuses
+
+from .factories import UserFactory
+
+
+@override_settings(KLEIDES_MFA_USER_STATUS=True, OTP_STATIC_THROTTLE_FACTOR=0)
+class UserMfaStatusTestCase(TestCase):
+    def assertStatus(self, user, slugs, device_count):
+        status = UserMfaStatus.objects.get(user=user)
+        self.assertEqual(status.plugin_slugs, slugs)
+        self.assertEqual(status.device_count, device_count)
+        return status
+
+    def test_user_status(self):
+        user = UserFactory()
+        totp = user.totpdevice_set.create(name='totp')
+        self.assertStatus(user, ['totp'], 1)
+        static = user.staticdevice_set.create(name='static', confirmed=False)
+        self.assertStatus(user, ['totp'], 1)
+        static.confirmed = True
+        static.save()
+        self.assertStatus(user, ['totp', 'recovery-code'], 2)
+
+        # Saves of the token verification do not update the status.
+        device = TOTPDevice.objects.get(pk=totp.pk)
+        with self.assertNumQueries(1):
+            device.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(registry.user_has_device(user))
+
+        other_user = UserFactory()
+        device.user = other_user
+        device.save()
+        self.assertStatus(user, ['recovery-code'], 1)
+        self.assertStatus(other_user, ['totp'], 1)
+        device.delete()
+        self.assertStatus(other_user, [], 0)
+        # A device count of 0 falls back to the plugin queries.
+        with self.assertNumQueries(1 + len(list(registry.plugins()))):
+            self.assertFalse(registry.user_has_device(other_user))
+
+        # The last verification time is recorded by the verify view.
+        static.token_set.create(token='token1')
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        self.client.post(
+            '/recovery-code/verify/{}/'.format(static.pk),
+            {'otp_token': 'token1'})
+        self.assertIsNotNone(
+            self.assertStatus(user, ['recovery-code'], 1).last_verified)
+
+        # The status is deleted with the user.
+        user.delete()
+        self.assertFalse(UserMfaStatus.objects.filter(user_id=user.pk))
+
+    def test_plugin_priority_change(self):
+        user = UserFactory()
+        user.totpdevice_set.create(name='totp')
+        # The status keeps the plugin slugs when the priority changes.
+        with override_settings(
+                KLEIDES_MFA_PLUGIN_PRIORITY=('recovery-code', 'totp')):
+            self.assertStatus(user, ['totp'], 1)
+            user.staticdevice_set.create(name='static')
+            self.assertStatus(user, ['recovery-code', 'totp'], 2)
+        self.assertStatus(user, ['recovery-code', 'totp'], 2)
+        self.assertTrue(UserMfaStatus.objects.filter(
+            user=user, plugins__contains=',totp,').exists())
+
+    def test_stale_status(self):
+        user = UserFactory()
+        UserMfaStatus.objects.create(user=user)
+        # Devices created without signals leave the device count at 0.
+        TOTPDevice.objects.bulk_create([TOTPDevice(user=user, name='totp')])
+        self.assertStatus(user, [], 0)
+        self.assertTrue(registry.user_has_device(user))
+        self.assertTrue(async_to_sync(registry.auser_has_device)(user))
+
+        # The user is not in setup and cannot add a device without MFA.
+        self.client.force_login(user)
+        self.assertRedirects(
+            self.client.get('/totp/create/'), '/login/?next=/totp/create/',
+            fetch_redirect_response=False)
+
+    def test_rebuild_status(self):
+        with override_settings(KLEIDES_MFA_USER_STATUS=False):
+            user = UserFactory()
+            user.totpdevice_set.create(name='totp')
+            user.staticdevice_set.create(name='static')
+            single_factor_user = UserFactory()
+            other_user = UserFactory()
+            other_user.staticdevice_set.create(name='static')
+        verified = timezone.now()
+        UserMfaStatus.objects.create(user=user, last_verified=verified)
+
+        stdout = StringIO()
+        call_command('kleides_mfa_rebuild_status', chunk_size=2, stdout=stdout)
+        self.assertEqual(
+            stdout.getvalue(), 'Rebuilt the MFA status of 3 users.\n')
+        status = self.assertStatus(user, ['totp', 'recovery-code'], 2)
+        self.assertEqual(status.last_verified, verified)
+        self.assertEqual(status.plugins, ',totp,recovery-code,')
+        self.assertStatus(single_factor_user, [], 0)
+        self.assertStatus(other_user, ['recovery-code'], 1)
+
+    def test_update_user_statuses_without_upsert(self):
+        with override_settings(KLEIDES_MFA_USER_STATUS=False):
+            user = UserFactory()
+            user.totpdevice_set.create(name='totp')
+            other_user = UserFactory()
+        verified = timezone.now()
+        UserMfaStatus.objects.create(user=user, last_verified=verified)
+
+        with mock.patch.multiple(
+                connection.features,
+                supports_update_conflicts=False,
+                supports_update_conflicts_with_target=False):
+            update_user_statuses([user.pk, other_user.pk])
+        status = self.assertStatus(user, ['totp'], 1)
+        self.assertEqual(status.last_verified, verified)
+        self.assertStatus(other_user, [], 0)
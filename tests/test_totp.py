@@ -4,6 +4,7 @@ from unittest import mock
 from urllib.parse import parse_qs, urlsplit
 
 from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
@@ -17,6 +18,10 @@ from .utils import handle_signal
 
 
 class DjangoOtpTotpTestCase(TestCase):
+    def tearDown(self):
+        # Cached device lists are not rolled back with the users.
+        cache.clear()
+
     def totp_from_device(self, device):
         url = urlsplit(device.config_url)
         params = parse_qs(url.query)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from kleides_mfa.tracing import get_tracer
+
+from .factories import UserFactory
+
+
+class RecordingSpan():
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class RecordingTracer():
+    def __init__(self):
+        self.spans = []
+        self.stack = []
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None, **kwargs):
+        parent = self.stack[-1].name if self.stack else None
+        span = RecordingSpan(name, attributes, parent)
+        self.spans.append(span)
+        self.stack.append(span)
+        try:
+            yield span
+        finally:
+            self.stack.pop()
+
+
+@override_settings(
+    KLEIDES_MFA_TRACER='tests.test_tracing.RecordingTracer',
+    OTP_STATIC_THROTTLE_FACTOR=0)
+class TracingTestCase(TestCase):
+    def spans(self):
+        def stage(name):
+            return name and name.split('.')[1]
+
+        spans = [
+            (stage(span.name), stage(span.parent),
+             span.attributes.get('kleides_mfa.plugin'),
+             span.attributes.get('kleides_mfa.outcome'))
+            for span in get_tracer().spans]
+        get_tracer().spans.clear()
+        return spans
+
+    def test_login_stages(self):
+        user = UserFactory()
+        device = user.staticdevice_set.create(name='test')
+        device.token_set.create(token='token1')
+        verify_url = '/recovery-code/verify/{}/'.format(device.pk)
+
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        self.assertEqual(self.spans(), [
+            ('login', None, 'recovery-code', 'verification_required'),
+            ('device_inventory', 'login', None, None),
+        ])
+
+        self.client.post(verify_url, {'otp_token': 'bad'})
+        self.assertEqual(self.spans(), [
+            ('unverified_user', None, None, 'found'),
+            ('verify', None, 'recovery-code', 'failure'),
+            ('device_lookup', 'verify', 'recovery-code', 'found'),
+            ('verify_token', 'verify', 'recovery-code', 'failure'),
+        ])
+
+        self.client.post(verify_url, {'otp_token': 'token1'})
+        self.assertEqual(self.spans(), [
+            ('unverified_user', None, None, 'found'),
+            ('verify', None, 'recovery-code', 'success'),
+            ('device_lookup', 'verify', 'recovery-code', 'found'),
+            ('verify_token', 'verify', 'recovery-code', 'success'),
+            ('session_login', 'verify', None, None),
+        ])
+
+    def test_single_factor_login(self):
+        user = UserFactory()
+        self.client.post('/login/', {
+            'username': user.username, 'password': 'invalid'})
+        self.client.post('/login/', {
+            'username': user.username, 'password': user.raw_password})
+        self.assertEqual(self.spans(), [
+            ('login', None, None, 'failure'),
+            ('login', None, None, 'single_factor'),
+            ('device_inventory', 'login', None, None),
+            ('session_login', 'login', None, None),
+        ])
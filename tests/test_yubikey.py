@@ -2,17 +2,25 @@
 from binascii import unhexlify
 from unittest.mock import patch
 
-from django.test import TestCase
-from yubiotp.otp import YubiKey
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from yubiotp.otp import YubiKey, encode_otp
 from otp_yubikey.models import (
-    RemoteYubikeyDevice, ValidationService, default_id)
+    RemoteYubikeyDevice, ValidationService, default_id, default_key)
 
+from kleides_mfa.forms import YubikeyDeviceCreateForm
 from kleides_mfa.registry import registry
+from kleides_mfa.yubikey import validation_services
 
 from .factories import UserFactory
 
 
 class DjangoOtpYubikeyTestCase(TestCase):
+    def tearDown(self):
+        # Services created in the test are rolled back without signals.
+        validation_services.clear()
+        cache.clear()
+
     def login(self, user, redirect_to='/list/'):
         response = self.client.post(
             '/login/',
@@ -113,3 +121,118 @@ class DjangoOtpYubikeyTestCase(TestCase):
         self.assertContains(
             response,
             'The Yubikey &quot;Acme Inc.&quot; was deleted successfully.')
+
+    def test_validation_service_cache(self):
+        request = RequestFactory().get('/yubikey/create/')
+        request.user = UserFactory()
+        request.session = {}
+        plugin = registry.get_plugin('yubikey')
+        service = ValidationService.objects.get()
+        validation_services.choices()
+
+        # Rendering the form uses the cached validation services.
+        with self.assertNumQueries(0):
+            form = YubikeyDeviceCreateForm(plugin, request)
+            str(form)
+        self.assertTrue(form.fields['service'].widget.is_hidden)
+        self.assertEqual(form.fields['service'].initial, service.pk)
+
+        # The cache is cleared when the validation services change.
+        custom = ValidationService.objects.create(
+            name='YubiCustom', param_sl='', param_timeout='')
+        form = YubikeyDeviceCreateForm(plugin, request)
+        self.assertFalse(form.fields['service'].widget.is_hidden)
+        self.assertEqual(validation_services.choices(), [
+            (service.pk, service.name), (custom.pk, 'YubiCustom')])
+
+        custom.delete()
+        self.assertEqual(
+            validation_services.choices(), [(service.pk, service.name)])
+
+
+class DjangoOtpLocalYubikeyTestCase(TestCase):
+    def tearDown(self):
+        # Cached device lists are not rolled back with the users.
+        cache.clear()
+
+    def login(self, user, redirect_to='/list/'):
+        response = self.client.post(
+            '/login/',
+            {'username': user.username, 'password': user.raw_password},
+            follow=True)
+        self.assertRedirects(response, redirect_to)
+        return response
+
+    def token(self, yubikey, key, public_id=b''):
+        return encode_otp(
+            yubikey.generate(), unhexlify(key), public_id).decode()
+
+    def test_local_yubikey(self):
+        user = UserFactory()
+        self.login(user)
+
+        private_id = default_id()
+        key = default_key()
+        yubikey = YubiKey(unhexlify(private_id), 3, 0)
+
+        # Tokens from another key are rejected.
+        response = self.client.post(
+            '/local-yubikey/create/', {
+                'private_id': private_id, 'key': default_key(),
+                'otp_token': self.token(yubikey, key), 'name': 'Keychain'})
+        self.assertContains(
+            response, 'Unable to validate the token with the device.')
+        response = self.client.post(
+            '/local-yubikey/create/', {
+                'private_id': private_id, 'key': 'XXX',
+                'otp_token': self.token(yubikey, key), 'name': 'Keychain'})
+        self.assertContains(
+            response, 'Unable to validate the token with the device.')
+
+        response = self.client.post(
+            '/local-yubikey/create/', {
+                'private_id': private_id, 'key': key,
+                'otp_token': self.token(yubikey, key), 'name': 'Keychain'},
+            follow=True)
+        self.assertRedirects(response, '/list/')
+        device = user.yubikeydevice_set.get()
+        self.assertTrue(device.confirmed)
+        self.assertEqual(device.session, 3)
+        self.assertEqual(device.counter, 2)
+        self.assertContains(response, device.public_id().decode())
+
+        self.client.logout()
+
+        verify_url = '/local-yubikey/verify/{}/'.format(device.pk)
+        self.login(user, '{}?next=/list/'.format(verify_url))
+
+        # The public id must match the device.
+        response = self.client.post(
+            verify_url, {'otp_token': self.token(yubikey, key)})
+        self.assertContains(
+            response, 'The token is not valid for this device.')
+
+        token = self.token(yubikey, key, device.public_id())
+        # Replayed and older tokens are rejected.
+        stale_token = self.token(
+            YubiKey(unhexlify(private_id), 2, 10), key, device.public_id())
+        response = self.client.post(verify_url, {'otp_token': stale_token})
+        self.assertContains(
+            response, 'The token is not valid for this device.')
+
+        response = self.client.post(
+            verify_url, {'otp_token': token}, follow=True)
+        self.assertRedirects(response, '/list/')
+        self.assertTrue(response.context['user'].is_verified)
+        self.assertEqual(
+            registry.user_authentication_method(response.context['user']),
+            'local-yubikey')
+        device.refresh_from_db()
+        self.assertEqual((device.session, device.counter), (3, 4))
+
+        # The same token cannot be used again.
+        self.client.logout()
+        self.login(user, '{}?next=/list/'.format(verify_url))
+        response = self.client.post(verify_url, {'otp_token': token})
+        self.assertContains(
+            response, 'The token is not valid for this device.')
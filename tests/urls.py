@@ -4,6 +4,9 @@ from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
+# Register the user admin of the test project.
+from . import admin as test_admin  # noqa: F401
+
 urlpatterns = [
     path('', RedirectView.as_view(url='/list/')),
     path('', include('kleides_mfa.urls')),